@@ -0,0 +1,274 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+METRICS = ("cosine", "l2")
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+def _nearest_centroids(vectors, centroids, chunk_size=16384):
+    """Index of the nearest centroid (Euclidean) of each row, computed a chunk of rows at a time."""
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        scores = vectors[start:start + chunk_size] @ centroids.T
+        scores *= -2
+        scores += centroid_norms
+        labels[start:start + len(scores)] = scores.argmin(axis=1)
+    return labels
+
+def train_coarse_quantizer(vectors, n_lists, train_size=None, iterations=10, seed=0):
+    """
+    Lloyd's k-means on a random sample of the vectors.
+
+    :param train_size: Sample size (default: 32 vectors per list, at most all of them).
+    :return: (n_lists, d) float32 centroids.
+    """
+    rng = np.random.default_rng(seed)
+    train_size = min(len(vectors), train_size or 32 * n_lists)
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), train_size, replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _nearest_centroids(sample, centroids)
+        counts = np.bincount(labels, minlength=n_lists)
+        order = np.argsort(labels, kind="stable")
+        filled = counts > 0
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        centroids[filled] = np.add.reduceat(sample[order], starts, axis=0) / counts[filled, np.newaxis]
+        # Restart empty lists from random sample points, so that every list gets used.
+        centroids[~filled] = sample[rng.choice(len(sample), int((~filled).sum()), replace=False)]
+    return centroids
+
+class IVFIndex:
+    """
+    Approximate nearest-neighbour index with a coarse quantizer and inverted lists (IVF).
+
+    The vectors are partitioned into n_lists lists by k-means, and stored sorted by list so
+    that each list is one contiguous block. A query is compared with the centroids, then
+    exhaustively with the vectors of its n_probe closest lists only: more probes give a
+    higher recall at a lower speed, and n_probe = n_lists is an exact search.
+
+    With metric "cosine", vectors and queries are normalized and scores are cosine
+    similarities (higher is closer); with "l2", scores are Euclidean distances (lower is closer).
+
+    Saved as a directory of .npy files; load() memory-maps the vectors, so only the probed
+    lists are read into memory.
+    """
+
+    def __init__(self, centroids, offsets, ids, vectors, norms, metric):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.vectors = vectors
+        self.norms = norms
+        self.metric = metric
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, metric="cosine", train_size=None, iterations=10, seed=0):
+        """
+        Build an index over the rows of vectors; search results are row indices.
+
+        :param n_lists: Number of inverted lists (default: 4 * sqrt(len(vectors))).
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric {metric!r}, expected one of {METRICS}")
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if metric == "cosine":
+            vectors = _normalize(vectors)
+        n_lists = min(len(vectors), n_lists or max(1, int(round(4 * np.sqrt(len(vectors))))))
+
+        centroids = train_coarse_quantizer(vectors, n_lists, train_size, iterations, seed)
+        labels = _nearest_centroids(vectors, centroids)
+        ids = np.argsort(labels, kind="stable")
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=n_lists))))
+        vectors = vectors[ids]
+        norms = np.einsum("ij,ij->i", vectors, vectors) if metric == "l2" else None
+        return cls(centroids, offsets, ids, vectors, norms, metric)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        arrays = {"centroids": self.centroids, "offsets": self.offsets, "ids": self.ids, "vectors": self.vectors}
+        if self.norms is not None:
+            arrays["norms"] = self.norms
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, name + ".npy"), array)
+        with open(os.path.join(directory, "index.json"), "w") as f:
+            json.dump({"metric": self.metric, "n_lists": len(self.centroids)}, f)
+
+    @classmethod
+    def load(cls, directory):
+        """Open an index written by save(), memory-mapping the vectors and their ids."""
+        with open(os.path.join(directory, "index.json")) as f:
+            meta = json.load(f)
+        path = lambda name: os.path.join(directory, name + ".npy")
+        norms = np.load(path("norms"), mmap_mode="r") if meta["metric"] == "l2" else None
+        return cls(np.load(path("centroids")), np.load(path("offsets")), np.load(path("ids"), mmap_mode="r"),
+                   np.load(path("vectors"), mmap_mode="r"), norms, meta["metric"])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, queries, k=10, n_probe=8, batch_size=1024):
+        """
+        Find the approximate k nearest neighbours of each query.
+
+        Queries are processed in batches; within a batch, each probed list is scored against
+        all the queries probing it with one matrix product.
+
+        :param queries: (nq, d) array, or a single (d,) vector.
+        :return: (scores, ids), both (nq, k), sorted closest first. Rows with fewer than k
+                 candidates are padded with id -1 and a score of nan.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.metric == "cosine":
+            queries = _normalize(queries)
+        n_probe = min(n_probe, len(self.centroids))
+        scores = np.empty((len(queries), k), dtype=np.float32)
+        ids = np.empty((len(queries), k), dtype=np.int64)
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start:start + batch_size]
+            scores[start:start + len(batch)], ids[start:start + len(batch)] = self._search_batch(batch, k, n_probe)
+        return scores, ids
+
+    def _search_batch(self, queries, k, n_probe):
+        # Internally, lower is closer: -similarity for cosine, ||x||^2 - 2 x.q for l2.
+        coarse = _nearest_lists(queries, self.centroids, n_probe)
+        best = np.full((len(queries), k), np.inf, dtype=np.float32)
+        best_rows = np.full((len(queries), k), -1, dtype=np.int64)
+
+        probes = coarse.ravel()
+        probing = np.repeat(np.arange(len(queries)), n_probe)
+        order = np.argsort(probes, kind="stable")
+        lists, starts = np.unique(probes[order], return_index=True)
+        for list_id, group in zip(lists, np.split(order, starts[1:])):
+            begin, end = self.offsets[list_id], self.offsets[list_id + 1]
+            if begin == end:
+                continue
+            query_rows = probing[group]
+            list_scores = np.asarray(self.vectors[begin:end]) @ queries[query_rows].T
+            list_scores *= -2 if self.metric == "l2" else -1
+            if self.metric == "l2":
+                list_scores += np.asarray(self.norms[begin:end])[:, np.newaxis]
+            if end - begin > k:
+                top = np.argpartition(list_scores, k - 1, axis=0)[:k]
+                list_scores = np.take_along_axis(list_scores, top, axis=0)
+            else:
+                top = np.broadcast_to(np.arange(end - begin)[:, np.newaxis], list_scores.shape)
+            merged = np.concatenate((best[query_rows], list_scores.T), axis=1)
+            merged_rows = np.concatenate((best_rows[query_rows], top.T + begin), axis=1)
+            keep = np.argpartition(merged, k - 1, axis=1)[:, :k]
+            best[query_rows] = np.take_along_axis(merged, keep, axis=1)
+            best_rows[query_rows] = np.take_along_axis(merged_rows, keep, axis=1)
+
+        order = np.argsort(best, axis=1, kind="stable")
+        best = np.take_along_axis(best, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        found = best_rows >= 0
+        ids = np.where(found, np.asarray(self.ids)[np.where(found, best_rows, 0)], -1)
+        if self.metric == "cosine":
+            scores = -best
+        else:
+            scores = np.sqrt(np.maximum(best + np.einsum("ij,ij->i", queries, queries)[:, np.newaxis], 0))
+        return np.where(found, scores, np.nan), ids
+
+def _nearest_lists(queries, centroids, n_probe):
+    scores = queries @ centroids.T
+    scores *= -2
+    scores += np.einsum("ij,ij->i", centroids, centroids)
+    if n_probe >= len(centroids):
+        return np.broadcast_to(np.arange(len(centroids)), scores.shape)
+    return np.argpartition(scores, n_probe - 1, axis=1)[:, :n_probe]
+
+def exact_search(vectors, queries, k=10, metric="cosine", chunk_size=65536):
+    """
+    Brute-force k nearest neighbours, as ground truth for IVFIndex (same scores and order).
+
+    :return: (scores, ids), both (nq, k).
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    if metric == "cosine":
+        queries = _normalize(queries)
+    best = np.full((len(queries), 0), np.inf, dtype=np.float32)
+    best_ids = np.empty((len(queries), 0), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+        if metric == "cosine":
+            scores = -(_normalize(chunk) @ queries.T).T
+        else:
+            scores = (np.einsum("ij,ij->i", chunk, chunk) - 2 * (chunk @ queries.T).T)
+        merged = np.concatenate((best, scores), axis=1)
+        merged_ids = np.concatenate((best_ids, np.broadcast_to(np.arange(start, start + len(chunk)), scores.shape)), axis=1)
+        keep = np.argpartition(merged, min(k, merged.shape[1]) - 1, axis=1)[:, :k]
+        best = np.take_along_axis(merged, keep, axis=1)
+        best_ids = np.take_along_axis(merged_ids, keep, axis=1)
+    order = np.argsort(best, axis=1, kind="stable")
+    best = np.take_along_axis(best, order, axis=1)
+    best_ids = np.take_along_axis(best_ids, order, axis=1)
+    if metric == "cosine":
+        return -best, best_ids
+    return np.sqrt(np.maximum(best + np.einsum("ij,ij->i", queries, queries)[:, np.newaxis], 0)), best_ids
+
+def benchmark_recall(index, vectors, queries, k=10, n_probes=(1, 2, 4, 8, 16, 32, 64)):
+    """
+    Measure recall@k of index against exact search over vectors, for several n_probe settings.
+
+    :return: List of {"n_probe", "recall", "queries_per_second", "ms_per_query"} dicts,
+             plus one for exact search with n_probe None.
+    """
+    start = time.perf_counter()
+    _, exact_ids = exact_search(vectors, queries, k, index.metric)
+    exact_seconds = time.perf_counter() - start
+    results = [{"n_probe": None, "recall": 1.0, "queries_per_second": len(queries) / exact_seconds,
+                "ms_per_query": 1000 * exact_seconds / len(queries)}]
+    for n_probe in n_probes:
+        start = time.perf_counter()
+        _, ids = index.search(queries, k, n_probe)
+        seconds = time.perf_counter() - start
+        hits = sum(len(np.intersect1d(found, expected)) for found, expected in zip(ids, exact_ids))
+        results.append({"n_probe": n_probe, "recall": hits / exact_ids.size,
+                        "queries_per_second": len(queries) / seconds, "ms_per_query": 1000 * seconds / len(queries)})
+    return results
+
+if __name__ == "__main__":
+    from word_embeddings import WordEmbeddings
+
+    parser = argparse.ArgumentParser(description="Build, query and benchmark an approximate nearest-neighbour "
+                                                 "index over word embeddings converted by word_embeddings.py.")
+    parser.add_argument("--embeddings_dir", required=True, help="Directory with vectors.npy and vocab.txt.")
+    parser.add_argument("--index_dir", required=True, help="Index directory; the index is built there if missing.")
+    parser.add_argument("--n_lists", type=int, help="Inverted lists when building (default: 4 * sqrt(vocabulary size)).")
+    parser.add_argument("--metric", choices=METRICS, default="cosine", help="Similarity when building (default: cosine).")
+    parser.add_argument("--words", nargs="+", help="Print the nearest words of these words.")
+    parser.add_argument("--k", type=int, default=10, help="Neighbours per query (default: 10).")
+    parser.add_argument("--n_probe", type=int, default=8, help="Lists searched per query (default: 8).")
+    parser.add_argument("--benchmark", type=int, metavar="QUERIES",
+                        help="Report recall@k against exact search for this many random vocabulary words.")
+    args = parser.parse_args()
+
+    embeddings = WordEmbeddings.load(args.embeddings_dir)
+    if not os.path.exists(os.path.join(args.index_dir, "index.json")):
+        start = time.perf_counter()
+        IVFIndex.build(embeddings.vectors, args.n_lists, args.metric).save(args.index_dir)
+        print(f"Built an index of {len(embeddings)} vectors in {time.perf_counter() - start:.1f}s")
+    index = IVFIndex.load(args.index_dir)
+
+    if args.words:
+        words = [word for word in args.words if word in embeddings]
+        scores, ids = index.search(embeddings.vectors_for(words), args.k + 1, args.n_probe)
+        for word, row_scores, row_ids in zip(words, scores, ids):
+            neighbours = [(embeddings.words[i], score) for i, score in zip(row_ids, row_scores)
+                          if i >= 0 and embeddings.words[i] != word][:args.k]
+            print(f"{word}: " + ", ".join(f"{neighbour} ({score:.3f})" for neighbour, score in neighbours))
+
+    if args.benchmark:
+        rng = np.random.default_rng(0)
+        queries = embeddings.vectors[np.sort(rng.choice(len(embeddings), args.benchmark, replace=False))]
+        for result in benchmark_recall(index, embeddings.vectors, queries, args.k):
+            print(f"n_probe {result['n_probe'] or 'exact':>5}: recall@{args.k} {result['recall']:.3f}, "
+                  f"{result['ms_per_query']:.3f} ms/query ({result['queries_per_second']:.0f} queries/s)")
@@ -1,69 +1,153 @@
+import os
+import time
+from functools import lru_cache
+
 import numpy as np
-import torch
-import torch.nn.functional as F
-from sklearn.cluster import KMeans
-from gensim.downloader import load
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from word_embeddings import load_embeddings
+
+# GloVe embeddings (100-dimensional vectors), converted once into a memory-mapped matrix
+# (see word_embeddings.py) so that startup does not parse the whole vocabulary.
+EMBEDDINGS_SOURCE = "glove-wiki-gigaword-100"
+EMBEDDINGS_DIR = os.environ.get(
+    "WORD_EMBEDDINGS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "embeddings", EMBEDDINGS_SOURCE))
+
+@lru_cache(maxsize=None)
+def get_word_vectors():
+    return load_embeddings(EMBEDDINGS_DIR, source=EMBEDDINGS_SOURCE)
 
-# Load GloVe embeddings (100-dimensional vectors)
-word_vectors = load("glove-wiki-gigaword-100")
+# Above this many words, cluster_words switches to mini-batch k-means by default.
+MINI_BATCH_THRESHOLD = 10_000
 
-def cluster_words(word_list, k):
+def assign_to_centroids(embeddings, centroids, chunk_size=16384):
+    """
+    Assigns each row of embeddings to its nearest centroid, a chunk of rows at a time.
+
+    Distances are computed as ||x||^2 - 2 x.c + ||c||^2 with one matrix product per chunk,
+    so memory stays at chunk_size x k distances regardless of the number of words.
+
+    Parameters:
+    - embeddings: (n, d) float32 array.
+    - centroids: (k, d) array.
+    - chunk_size: Rows per chunk.
+
+    Returns (labels, distances): (n,) cluster indices and (n,) Euclidean distances to the assigned centroid.
+    """
+    centroids = np.asarray(centroids, dtype=np.float32)
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(len(embeddings), dtype=np.int64)
+    distances = np.empty(len(embeddings), dtype=np.float32)
+    for start in range(0, len(embeddings), chunk_size):
+        chunk = embeddings[start:start + chunk_size]
+        scores = chunk @ centroids.T
+        scores *= -2
+        scores += centroid_norms
+        chunk_labels = scores.argmin(axis=1)
+        labels[start:start + len(chunk)] = chunk_labels
+        distances[start:start + len(chunk)] = (scores[np.arange(len(chunk)), chunk_labels]
+                                               + np.einsum("ij,ij->i", chunk, chunk))
+    # Rounding can make the expanded form slightly negative for points on a centroid.
+    np.maximum(distances, 0, out=distances)
+    return labels, np.sqrt(distances, out=distances)
+
+def cluster_words(word_list, k, mini_batch=None, batch_size=4096, random_state=42):
     """
     Clusters words using GloVe embeddings and K-Means clustering.
 
     Parameters:
     - word_list: List of words to cluster.
     - k: Number of clusters.
+    - mini_batch: Fit with MiniBatchKMeans instead of KMeans(n_init=10). Defaults to True
+      above MINI_BATCH_THRESHOLD words, where full-batch k-means gets too slow.
+    - batch_size: Words per mini-batch.
+    - random_state: Seed of the k-means initialization.
 
-    Prints the clusters with their representative words.
+    Returns a dict with:
+    - "clusters": List of {"id", "representative", "words", "size"} dicts, one per non-empty
+      cluster, in order of each cluster's first word in word_list; the representative is the
+      word closest to the cluster's centroid.
+    - "words", "labels", "centers": The clustered words (in input order), their cluster
+      indices and the (k, d) centroids, for further processing.
+    - "missing": Words not in the GloVe vocabulary.
+    - "seconds": Time spent per step.
     """
+    timings = {}
+    start = time.perf_counter()
+    word_vectors = get_word_vectors()
+
     # Filter words that exist in the GloVe vocabulary
     filtered_words = [word for word in word_list if word in word_vectors]
+    missing = [word for word in word_list if word not in word_vectors]
     if len(filtered_words) < k:
         print(f"Not enough valid words for {k} clusters. Using {len(filtered_words)} instead.")
         k = min(len(filtered_words), k)
 
-    # Get word embeddings
-    word_embeddings = np.array([word_vectors[word] for word in filtered_words])
+    # Get word embeddings, as one float32 matrix
+    word_embeddings = word_vectors.vectors_for(filtered_words)
+    timings["lookup"] = time.perf_counter() - start
 
     # Apply K-Means clustering
-    kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
+    start = time.perf_counter()
+    if mini_batch is None:
+        mini_batch = len(filtered_words) > MINI_BATCH_THRESHOLD
+    if mini_batch:
+        # Labels come from the single assignment pass below, which also yields the distances.
+        kmeans = MiniBatchKMeans(n_clusters=k, batch_size=batch_size, n_init=3, random_state=random_state,
+                                 compute_labels=False)
+    else:
+        kmeans = KMeans(n_clusters=k, random_state=random_state, n_init=10)
     kmeans.fit(word_embeddings)
-    labels = kmeans.labels_
-
-    # Group words by cluster and find the most representative word
-    clusters = {}
-    for i, word in enumerate(filtered_words):
-        cluster_id = labels[i]
-        if cluster_id not in clusters:
-            clusters[cluster_id] = []
-        clusters[cluster_id].append(word)
-
-    # Find the most representative word in each cluster (closest to centroid)
-    cluster_representatives = {}
-    for cluster_id, words in clusters.items():
-        cluster_vectors = np.array([word_vectors[word] for word in words])
-        centroid = kmeans.cluster_centers_[cluster_id]
-
-        # Compute distances to centroid
-        distances = np.linalg.norm(cluster_vectors - centroid, axis=1)
-
-        # Select the word closest to the centroid
-        best_word = words[np.argmin(distances)]
-        cluster_representatives[cluster_id] = best_word
-
-    # Print results
-    for cluster_id, words in clusters.items():
-        print(f"\nCluster {cluster_id + 1}: Representative Word -> {cluster_representatives[cluster_id]}")
-        print("Words in this cluster:", words)
-
-word_list = [
-    "king", "queen", "prince", "princess", "throne", "royalty",
-    "cow", "sheep", "dog", "cat", "wolf", "lion", "tiger", "cheetah",
-    "apple", "banana", "grape", "fruit", "mango", "peach",
-    "car", "bus", "truck", "train", "bike", "vehicle",
-    "happy", "joy", "cheerful", "smiling", "laughter", "delighted"
-]
-
-k = 5  # Set the number of clusters
-cluster_words(word_list, k)
+    centers = kmeans.cluster_centers_.astype(np.float32)
+    timings["fit"] = time.perf_counter() - start
+
+    # Assign every word to its closest centroid, keeping the distances for the representatives
+    start = time.perf_counter()
+    labels, distances = assign_to_centroids(word_embeddings, centers)
+    timings["assign"] = time.perf_counter() - start
+
+    # Group words by cluster (in input order) and find the most representative word of each
+    # (closest to centroid): the first word of each cluster when sorted by cluster, then distance.
+    start = time.perf_counter()
+    sizes = np.bincount(labels, minlength=k)
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    by_cluster = np.argsort(labels, kind="stable")
+    by_distance = np.lexsort((distances, labels))
+    # Clusters are listed in order of their first word in the input, as the original script printed them.
+    nonempty = np.flatnonzero(sizes)
+    clusters = []
+    for cluster_id in nonempty[np.argsort(by_cluster[offsets[nonempty]])]:
+        members = by_cluster[offsets[cluster_id]:offsets[cluster_id] + sizes[cluster_id]]
+        clusters.append({
+            "id": int(cluster_id),
+            "representative": filtered_words[by_distance[offsets[cluster_id]]],
+            "words": [filtered_words[i] for i in members],
+            "size": int(sizes[cluster_id]),
+        })
+    timings["group"] = time.perf_counter() - start
+
+    return {
+        "clusters": clusters,
+        "words": filtered_words,
+        "labels": labels,
+        "centers": centers,
+        "missing": missing,
+        "seconds": timings,
+    }
+
+def print_clusters(result):
+    """Prints the clusters returned by cluster_words with their representative words."""
+    for cluster in result["clusters"]:
+        print(f"\nCluster {cluster['id'] + 1}: Representative Word -> {cluster['representative']}")
+        print("Words in this cluster:", cluster["words"])
+
+if __name__ == "__main__":
+    word_list = [
+        "king", "queen", "prince", "princess", "throne", "royalty",
+        "cow", "sheep", "dog", "cat", "wolf", "lion", "tiger", "cheetah",
+        "apple", "banana", "grape", "fruit", "mango", "peach",
+        "car", "bus", "truck", "train", "bike", "vehicle",
+        "happy", "joy", "cheerful", "smiling", "laughter", "delighted"
+    ]
+
+    k = 5  # Set the number of clusters
+    print_clusters(cluster_words(word_list, k))
@@ -0,0 +1,156 @@
+"""
+Tags many images against a fixed vocabulary with CLIP, e.g. the generated images in
+images/, before choosing subjects to turn into relief blocks:
+
+    python bulk_label.py ../images --labels_file vocabulary.txt --output labels.jsonl
+
+Each image gets one JSON line with its top-k labels and scores, written as soon as its
+batch is scored. Running the same command again after an interruption skips the images
+already in the output file and appends the rest.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+from clip_labeler import ClipLabeler, scores_from_embeddings, top_labels
+from image_files import list_images as list_image_files, prefetch_map
+
+def list_images(source: str) -> list[str]:
+    """
+    Returns the image paths of a directory (searched recursively, sorted) or a manifest.
+
+    Parameters:
+        source (str): A directory, or a text file with one image path per line. Relative
+                      paths in a manifest are relative to the manifest's directory.
+    """
+    if os.path.isdir(source):
+        return list_image_files(source, recursive=True)
+    base = os.path.dirname(source)
+    with open(source) as f:
+        return [os.path.join(base, line.strip()) for line in f if line.strip()]
+
+def read_done_paths(output_path: str) -> set[str]:
+    """
+    Returns the paths already recorded in a JSONL output file.
+
+    A line cut short by an interruption is removed from the file, so that appending
+    to it produces valid JSONL again.
+    """
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    return {json.loads(line)["path"] for line in data[:end].splitlines() if line.strip()}
+
+def label_images(image_paths: list[str], labels: list[str], output_path: str, labeler: ClipLabeler,
+                 top_k: int = 5, num_workers: int = 4, resume: bool = True) -> dict:
+    """
+    Labels images in batches and appends one JSON line per image to output_path.
+
+    Images are decoded and preprocessed on a thread pool, a bounded number ahead of
+    the model, and encoded in batches of labeler.batch_size. The label embeddings are
+    computed once, and every batch is scored against that matrix. Lines look like
+    {"path": ..., "labels": [...], "scores": [...]}, or {"path": ..., "error": ...}
+    for images that could not be decoded, which are not retried on resume.
+
+    Parameters:
+        image_paths (list[str]): Images to label.
+        labels (list[str]): The vocabulary.
+        output_path (str): JSONL file to write to.
+        labeler (ClipLabeler): Loaded CLIP labeler.
+        top_k (int): Number of labels recorded per image.
+        num_workers (int): Threads used for decoding and preprocessing.
+        resume (bool): Skip images already in output_path and append to it, instead of overwriting it.
+
+    Returns:
+        dict: Stats: "labeled", "failed", "skipped", "seconds" and "images_per_second".
+    """
+    done = read_done_paths(output_path) if resume else set()
+    pending = [path for path in image_paths if path not in done]
+    text_embeddings = labeler.text_embeddings(labels)
+
+    def decode(path):
+        try:
+            return path, labeler.preprocess(Image.open(path).convert("RGB")), None
+        except Exception as e:
+            return path, None, str(e)
+
+    start = time.perf_counter()
+    labeled = failed = 0
+    with open(output_path, "a" if resume else "w") as out, ThreadPoolExecutor(max_workers=num_workers) as pool:
+
+        def run_batch(batch):
+            paths, tensors = zip(*batch)
+            scores = scores_from_embeddings(labeler.encode_preprocessed(list(tensors)), text_embeddings)
+            for path, row in zip(paths, scores):
+                ranked = top_labels(row, labels, top_k)
+                out.write(json.dumps({"path": path,
+                                      "labels": [label for label, _ in ranked],
+                                      "scores": [round(score, 6) for _, score in ranked]}) + "\n")
+            # One flush per batch: an interruption loses at most the batch being encoded.
+            out.flush()
+
+        # Decode a bounded number of images ahead of the model.
+        prefetch = max(labeler.batch_size, num_workers) * 2
+        batch = []
+        for path, tensor, error in prefetch_map(pool, decode, pending, prefetch):
+            if error is not None:
+                out.write(json.dumps({"path": path, "error": error}) + "\n")
+                failed += 1
+                continue
+            batch.append((path, tensor))
+            if len(batch) == labeler.batch_size:
+                run_batch(batch)
+                labeled += len(batch)
+                batch = []
+                if labeled % (labeler.batch_size * 20) == 0:
+                    print(f"Labeled {labeled}/{len(pending)} images")
+        if batch:
+            run_batch(batch)
+            labeled += len(batch)
+
+    seconds = time.perf_counter() - start
+    stats = {
+        "labeled": labeled,
+        "failed": failed,
+        "skipped": len(image_paths) - len(pending),
+        "seconds": seconds,
+        "images_per_second": labeled / seconds if seconds > 0 else 0.0,
+    }
+    print(f"Labeled {labeled} images ({failed} failed, {stats['skipped']} already done) in {seconds:.2f}s "
+          f"({stats['images_per_second']:.2f} images/s), written to {output_path}")
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Tag images against a fixed vocabulary with CLIP, as resumable JSONL.")
+    parser.add_argument("source", help="Directory of images, or a text file with one image path per line.")
+    parser.add_argument("--output", required=True, help="JSONL file to write (appended to when resuming).")
+    parser.add_argument("--labels", nargs="+", help="Vocabulary labels.")
+    parser.add_argument("--labels_file", help="Text file with one vocabulary label per line.")
+    parser.add_argument("--top_k", type=int, default=5, help="Labels recorded per image (default: 5).")
+    parser.add_argument("--batch_size", type=int, default=64, help="Images per CLIP forward pass (default: 64).")
+    parser.add_argument("--num_workers", type=int, default=4, help="Decoding threads (default: 4).")
+    parser.add_argument("--model", default="ViT-B/32", help="CLIP model name (default: ViT-B/32).")
+    parser.add_argument("--cache_dir", default="./clip_cache", help="Label embedding cache directory.")
+    parser.add_argument("--no_resume", action="store_true", help="Overwrite the output instead of resuming.")
+    args = parser.parse_args()
+
+    labels = list(args.labels or [])
+    if args.labels_file:
+        with open(args.labels_file) as f:
+            labels.extend(line.strip() for line in f if line.strip())
+    if not labels:
+        parser.error("no labels given; use --labels or --labels_file")
+
+    labeler = ClipLabeler(args.model, cache_dir=args.cache_dir, batch_size=args.batch_size)
+    label_images(list_images(args.source), labels, args.output, labeler, top_k=args.top_k,
+                 num_workers=args.num_workers, resume=not args.no_resume)
+
+if __name__ == "__main__":
+    main()
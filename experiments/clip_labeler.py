@@ -0,0 +1,153 @@
+import hashlib
+import os
+import tempfile
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+import torch
+import clip  # OpenAI's CLIP library
+
+class ClipLabeler:
+    """
+    Scores images against text labels with CLIP.
+
+    The model is loaded once, when the labeler is created. Label text embeddings are
+    cached in memory and, if cache_dir is set, on disk as one .npy file per model and
+    label, so each label is encoded once. Images are encoded in batches of batch_size.
+
+    Embeddings are returned as L2-normalized float32 NumPy arrays, so scores can be
+    computed from precomputed embedding matrices with scores_from_embeddings.
+    """
+
+    def __init__(self, model_name: str = "ViT-B/32", device: str | None = None,
+                 cache_dir: str | None = None, batch_size: int = 32):
+        self.model_name = model_name
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.model, self.preprocess = clip.load(model_name, device=self.device)
+        self.cache_dir = cache_dir
+        self.batch_size = batch_size
+        self._text_embeddings = {}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _cache_path(self, label: str) -> str:
+        key = hashlib.sha256(f"{self.model_name}\n{label}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def _save_embedding(self, label: str, embedding: np.ndarray):
+        # Written to a temporary file and renamed, so concurrent labelers never read a partial file.
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, embedding)
+            os.replace(tmp_path, self._cache_path(label))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def text_embeddings(self, labels: list[str]) -> np.ndarray:
+        """
+        Returns the embeddings of the labels, encoding only those not cached yet.
+
+        Parameters:
+            labels (list[str]): Label strings.
+
+        Returns:
+            np.ndarray: (len(labels), D) float32 array of normalized embeddings.
+        """
+        missing = []
+        for label in dict.fromkeys(labels):
+            if label in self._text_embeddings:
+                continue
+            if self.cache_dir and os.path.exists(self._cache_path(label)):
+                self._text_embeddings[label] = np.load(self._cache_path(label))
+                continue
+            missing.append(label)
+
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            with torch.no_grad():
+                features = self.model.encode_text(clip.tokenize(batch).to(self.device))
+            features /= features.norm(dim=-1, keepdim=True)
+            for label, embedding in zip(batch, features.float().cpu().numpy()):
+                self._text_embeddings[label] = embedding
+                if self.cache_dir:
+                    self._save_embedding(label, embedding)
+
+        return np.stack([self._text_embeddings[label] for label in labels])
+
+    def image_embeddings(self, images) -> np.ndarray:
+        """
+        Encodes images in batches of batch_size.
+
+        Parameters:
+            images: Iterable of RGB images, as NumPy arrays or PIL Images. It is consumed
+                    one batch at a time, so it can be a generator.
+
+        Returns:
+            np.ndarray: (N, D) float32 array of normalized embeddings.
+        """
+        embeddings = []
+        batch = []
+        for image in images:
+            if isinstance(image, np.ndarray):
+                image = Image.fromarray(image)
+            batch.append(self.preprocess(image))
+            if len(batch) == self.batch_size:
+                embeddings.append(self.encode_preprocessed(batch))
+                batch = []
+        if batch:
+            embeddings.append(self.encode_preprocessed(batch))
+        if not embeddings:
+            return np.empty((0, self.model.visual.output_dim), dtype=np.float32)
+        return np.concatenate(embeddings)
+
+    def encode_preprocessed(self, batch: list) -> np.ndarray:
+        """Encodes one batch of images already run through self.preprocess (e.g. on worker threads)."""
+        with torch.no_grad():
+            features = self.model.encode_image(torch.stack(batch).to(self.device))
+        features /= features.norm(dim=-1, keepdim=True)
+        return features.float().cpu().numpy()
+
+    def rank(self, images, labels: list[str], top_k: int | None = None) -> list[list[tuple[str, float]]]:
+        """
+        Ranks the labels for each image by similarity score.
+
+        Parameters:
+            images: Iterable of RGB images, as NumPy arrays or PIL Images.
+            labels (list[str]): A list of label strings to match against the images.
+            top_k (int | None): Keep only the top_k labels per image (default: all).
+
+        Returns:
+            list[list[tuple[str, float]]]: For each image, (label, score) tuples sorted by descending score.
+        """
+        scores = scores_from_embeddings(self.image_embeddings(images), self.text_embeddings(labels))
+        return [top_labels(row, labels, top_k) for row in scores]
+
+def scores_from_embeddings(image_embeddings: np.ndarray, text_embeddings: np.ndarray) -> np.ndarray:
+    """
+    Softmax over the labels of the scaled cosine similarities, as in CLIP's zero-shot classifier.
+
+    Parameters:
+        image_embeddings (np.ndarray): (N, D) normalized image embeddings.
+        text_embeddings (np.ndarray): (L, D) normalized label embeddings.
+
+    Returns:
+        np.ndarray: (N, L) float32 scores; each row sums to 1.
+    """
+    logits = 100.0 * image_embeddings @ text_embeddings.T
+    logits -= logits.max(axis=-1, keepdims=True)
+    np.exp(logits, out=logits)
+    logits /= logits.sum(axis=-1, keepdims=True)
+    return logits
+
+def top_labels(scores: np.ndarray, labels: list[str], top_k: int | None = None) -> list[tuple[str, float]]:
+    """Pairs the labels with one row of scores, sorted by descending score."""
+    order = np.argsort(-scores, kind="stable")[:top_k]
+    return [(labels[i], float(scores[i])) for i in order]
+
+@lru_cache(maxsize=None)
+def get_clip_labeler(model_name: str = "ViT-B/32", cache_dir: str | None = None) -> ClipLabeler:
+    """Returns a labeler shared by all callers with the same model and cache directory."""
+    return ClipLabeler(model_name, cache_dir=cache_dir)
@@ -0,0 +1 @@
+../scripts/image_files.py
\ No newline at end of file
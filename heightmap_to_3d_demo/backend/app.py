@@ -1,9 +1,21 @@
+import hashlib
+import io
 import os
+import time
 import uuid
-from flask import Flask, request, jsonify, send_from_directory
+import numpy as np
+from flask import Flask, Response, g, request, jsonify, send_from_directory
 from flask_cors import CORS
-from heightmap_to_3d import generate_block_from_heightmap
-from generate_depth import get_grayscale_depth  # ZoeDepth-based function
+from werkzeug.wsgi import ClosingIterator
+from PIL import Image
+from heightmap_to_3d import lod_level_for_budget
+from generate_depth import get_heightmap  # ZoeDepth-based function
+from depth_models import DEFAULT_DEPTH_MODEL
+from depth_cache import DepthCache
+from jobs import JobManager, QueueFullError
+from retention import RetentionSweeper
+from metrics import Counter, Gauge, Histogram, Registry, exponential_buckets
+from timing import span
 
 app = Flask(__name__)
 CORS(app)
@@ -13,6 +25,137 @@ OUTPUT_FOLDER = "outputs"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
+# The pipeline passes the upload, heightmap and color reference between stages in memory.
+# Set DEBUG_INTERMEDIATES=true to also write the upload and heightmap to UPLOAD_FOLDER.
+DEBUG_INTERMEDIATES = os.environ.get("DEBUG_INTERMEDIATES", "false").lower() == "true"
+
+# Heightmaps are cached by image content and model, so re-uploads skip inference.
+# Entries are raw float32 .npy arrays, which load without an image decode and keep
+# the depth precision that an 8-bit heightmap would quantize to 256 levels.
+DEPTH_CACHE_FOLDER = "depth_cache"
+DEPTH_CACHE_MAX_BYTES = int(os.environ.get("DEPTH_CACHE_MAX_BYTES", 1 << 30))
+depth_cache = DepthCache(DEPTH_CACHE_FOLDER, max_bytes=DEPTH_CACHE_MAX_BYTES, extension=".npy")
+
+# Content types of the model files, which mimetypes does not know.
+OUTPUT_MIMETYPES = {".glb": "model/gltf-binary", ".stl": "model/stl", ".ply": "application/ply"}
+
+# Models above this many triangles get a low-LOD preview served before the full file.
+PREVIEW_TRIANGLE_BUDGET = 200_000
+
+# Prometheus metrics, served at /metrics. Stage timings come from the timing spans of the
+# pipeline, which also end up in the job status as "timings".
+registry = Registry()
+REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency.", ["endpoint", "method"]))
+REQUESTS_IN_FLIGHT = registry.register(Gauge(
+    "http_requests_in_flight", "HTTP requests being handled."))
+STAGE_SECONDS = registry.register(Histogram(
+    "generate_stage_seconds", "Duration of the stages of finished generate jobs.", ["stage"]))
+JOBS_FINISHED = registry.register(Counter(
+    "generate_jobs_finished_total", "Finished generate jobs.", ["status"]))
+INPUT_PIXELS = registry.register(Histogram(
+    "generate_input_pixels", "Pixels of the uploaded color images (and heightmaps).",
+    buckets=exponential_buckets(1 << 14, 4, 8)))
+OUTPUT_TRIANGLES = registry.register(Histogram(
+    "generate_output_triangles", "Triangles of the full-resolution models.",
+    buckets=exponential_buckets(1 << 15, 4, 8)))
+OUTPUT_BYTES = registry.register(Histogram(
+    "generate_output_bytes", "Size of the full-resolution model files.",
+    buckets=exponential_buckets(1 << 20, 4, 8)))
+
+def run_depth(job):
+    """Depth stage of a generate job: produce the heightmap and return the meshing arguments."""
+    params = job.params
+    image_bytes = job.inputs["color_image"]
+    decoded = {}
+
+    def color_image():
+        if "image" not in decoded:
+            with span("depth.decode"):
+                decoded["image"] = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        return decoded["image"]
+
+    def create(path):
+        decoded["heightmap"] = get_heightmap(color_image(), high_precision=True)
+        np.save(path, decoded["heightmap"])
+
+    with span("depth.hash"):
+        cache_key = DepthCache.make_key(hashlib.sha256(image_bytes).hexdigest(), DEFAULT_DEPTH_MODEL + "-float32")
+    cached_heightmap = depth_cache.get_or_create(cache_key, create)
+    heightmap = decoded.get("heightmap")
+    if heightmap is None:
+        with span("depth.cache_load"):
+            heightmap = np.load(cached_heightmap)
+    # The heightmap has the size of the image, which a cache hit does not decode.
+    INPUT_PIXELS.observe(heightmap.size)
+    if DEBUG_INTERMEDIATES:
+        Image.fromarray(np.rint(heightmap * 255).astype(np.uint8), mode="L").save(params["heightmap_path"])
+
+    preview_level = lod_level_for_budget(heightmap.shape[1], heightmap.shape[0], PREVIEW_TRIANGLE_BUDGET)
+    generate_kwargs = dict(params["generate_kwargs"],
+                           heightmap=heightmap,
+                           output_path=params["output_path"],
+                           # Only provided if include_color is True
+                           ref_pixels=np.asarray(color_image()) if params["include_color"] else None)
+    return generate_kwargs, [preview_level, 0] if preview_level else [0]
+
+# Depth inference runs on one worker thread (the model is shared), meshing in a process pool.
+MAX_QUEUED_JOBS = int(os.environ.get("MAX_QUEUED_JOBS", 8))
+MESH_WORKERS = int(os.environ.get("MESH_WORKERS", 2))
+
+def record_job_metrics(job):
+    """Called by the job manager, with its lock held, when a job is done, failed or cancelled."""
+    JOBS_FINISHED.inc(status=job.status)
+    for stage, state in job.stages.items():
+        if state["seconds"] is not None:
+            STAGE_SECONDS.observe(state["seconds"], stage=stage)
+    for stage, seconds in job.timings.items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    stats = job.output_stats.get(0)
+    if job.status == "done" and stats:
+        OUTPUT_TRIANGLES.observe(stats["triangles"])
+        OUTPUT_BYTES.observe(stats["fileSize"])
+
+jobs = JobManager(run_depth, max_queued=MAX_QUEUED_JOBS, mesh_workers=MESH_WORKERS,
+                  on_finish=record_job_metrics)
+
+registry.register(Gauge(
+    "generate_jobs", "Generate jobs kept by the job manager, by status.", ["status"],
+    callback=lambda: {(status,): count for status, count in jobs.stats()["jobs"].items()}))
+
+def is_referenced_by_job(path):
+    """Whether an active job still reads or writes path (its LODs and .gz copies share the stem)."""
+    name = os.path.basename(path)
+    for params in jobs.active_params():
+        for job_path in (params["output_path"], params["heightmap_path"]):
+            if name.startswith(os.path.splitext(os.path.basename(job_path))[0]):
+                return True
+    return False
+
+# Generated files are deleted once they have not been served for OUTPUT_TTL_SECONDS, least
+# recently served first while the total exceeds OUTPUT_MAX_BYTES.
+OUTPUT_TTL_SECONDS = int(os.environ.get("OUTPUT_TTL_SECONDS", 24 * 3600))
+OUTPUT_MAX_BYTES = int(os.environ.get("OUTPUT_MAX_BYTES", 10 << 30))
+RETENTION_SWEEP_SECONDS = int(os.environ.get("RETENTION_SWEEP_SECONDS", 60))
+retention = RetentionSweeper([UPLOAD_FOLDER, OUTPUT_FOLDER], ttl=OUTPUT_TTL_SECONDS,
+                             max_bytes=OUTPUT_MAX_BYTES, interval=RETENTION_SWEEP_SECONDS,
+                             is_protected=is_referenced_by_job)
+
+@app.before_request
+def start_request():
+    # Started on first use rather than at import, which the meshing processes also do.
+    retention.start()
+    g.start = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc()
+
+@app.teardown_request
+def end_request(exc):
+    if "start" in g:
+        REQUESTS_IN_FLIGHT.dec()
+        # Labelled by route rule rather than URL, so job IDs and filenames do not add series.
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - g.start, endpoint=endpoint, method=request.method)
+
 @app.route("/api/generate", methods=["POST"])
 def api_generate():
     # 1) Check if "color_image" is in the request
@@ -23,20 +166,7 @@ def api_generate():
     if color_image_file.filename == "":
         return jsonify({"error": "No file selected"}), 400
 
-    # 2) Save the color image
-    color_image_filename = str(uuid.uuid4()) + "_" + color_image_file.filename
-    color_image_path = os.path.join(UPLOAD_FOLDER, color_image_filename)
-    color_image_file.save(color_image_path)
-
-    # 3) Generate a grayscale depth image (heightmap) from the color image
-    heightmap_filename = "depth_" + color_image_filename
-    heightmap_path = os.path.join(UPLOAD_FOLDER, heightmap_filename)
-    try:
-        get_grayscale_depth(color_image_path, heightmap_path)
-    except Exception as e:
-        return jsonify({"error": f"Error generating heightmap: {str(e)}"}), 500
-
-    # 4) Retrieve numeric parameters from form data
+    # 2) Retrieve numeric parameters from form data
     try:
         block_width = float(request.form.get("block_width", 100))
         block_length = float(request.form.get("block_length", 100))
@@ -46,25 +176,36 @@ def api_generate():
         mode = request.form.get("mode", "protrude")
         invert = request.form.get("invert", "false").lower() == "true"
         include_color = request.form.get("include_color", "false").lower() == "true"  # new parameter
+        file_format = request.form.get("file_format", "auto")  # "auto" (STL or PLY) or "glb"
+        quantize = request.form.get("quantize", "false").lower() == "true"
+        compression = request.form.get("compression", "none")  # "none" or "gzip"
     except ValueError:
         return jsonify({"error": "Invalid parameter values"}), 400
+    if (mode not in ("protrude", "carve") or file_format not in ("auto", "glb")
+            or compression not in ("none", "gzip")):
+        return jsonify({"error": "Invalid parameter values"}), 400
+
+    # 3) Read the color image; it stays in memory for the rest of the pipeline
+    start = time.perf_counter()
+    color_image = color_image_file.read()
+    timings = {"upload": time.perf_counter() - start}
+    color_image_filename = str(uuid.uuid4()) + "_" + color_image_file.filename
 
-    # 5) Set output file type and filename based on include_color
-    if include_color:
-        file_type = "ply"
-        color_reference_param = color_image_path
+    # 4) Set output file type and filename based on file_format and include_color
+    if file_format == "glb":
+        output_filename = str(uuid.uuid4()) + ".glb"
+    elif include_color:
         output_filename = str(uuid.uuid4()) + ".ply"
     else:
-        file_type = "stl"
-        color_reference_param = None
         output_filename = str(uuid.uuid4()) + ".stl"
-    output_path = os.path.join(OUTPUT_FOLDER, output_filename)
 
-    # 6) Generate the 3D model using the new heightmap and the original color image as reference (if needed)
-    try:
-        generate_block_from_heightmap(
-            heightmap_path=heightmap_path,
-            output_path=output_path,
+    # 5) Queue the job: the heightmap is generated from the color image, then the 3D model from the heightmap
+    params = {
+        "include_color": include_color,
+        "heightmap_path": os.path.join(UPLOAD_FOLDER, "depth_" + os.path.splitext(color_image_filename)[0] + ".png"),
+        "output_path": os.path.join(OUTPUT_FOLDER, output_filename),
+        "compression": compression,
+        "generate_kwargs": dict(
             block_width=block_width,
             block_length=block_length,
             block_thickness=block_thickness,
@@ -72,17 +213,100 @@ def api_generate():
             base_height=base_height,
             mode=mode,
             invert=invert,
-            color_reference=color_reference_param  # Only provided if include_color is True
-        )
-    except Exception as e:
-        return jsonify({"error": f"Error generating model: {str(e)}"}), 500
+            quantize=quantize
+        ),
+    }
+    try:
+        job = jobs.submit(params, timings, inputs={"color_image": color_image})
+    except QueueFullError as e:
+        response = jsonify({"error": str(e)})
+        response.headers["Retry-After"] = "5"
+        return response, 503
+
+    if DEBUG_INTERMEDIATES:
+        with open(os.path.join(UPLOAD_FOLDER, color_image_filename), "wb") as f:
+            f.write(color_image)
+
+    return jsonify({"jobId": job.id, "statusUrl": request.host_url + "api/jobs/" + job.id,
+                    "timings": timings}), 202
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def api_job_status(job_id):
+    status = jobs.get(job_id)
+    if status is None:
+        return jsonify({"error": "Unknown job"}), 404
 
-    file_url = request.host_url + "outputs/" + output_filename
-    return jsonify({"fileUrl": file_url, "fileType": file_type})
+    # Outputs are keyed by level of detail; anything above 0 is a preview.
+    outputs = status.pop("outputs")
+    previews = [level for level in outputs if level > 0]
+    if previews:
+        status["previewUrl"] = request.host_url + "outputs/" + outputs[min(previews)]
+    if status["status"] == "done":
+        status["fileUrl"] = request.host_url + "outputs/" + outputs[0]
+        # Size and encode time of the full-resolution file, plus its gzip size if compressed.
+        status.update(status["outputStats"][0])
+    if outputs:
+        status["fileType"] = os.path.splitext(outputs[max(outputs)])[1][1:]
+    return jsonify(status)
+
+@app.route("/api/jobs/<job_id>", methods=["DELETE"])
+def api_cancel_job(job_id):
+    if not jobs.cancel(job_id):
+        return jsonify({"error": "Unknown or finished job"}), 404
+    return jsonify(jobs.get(job_id))
+
+@app.route("/api/jobs/stats")
+def api_job_stats():
+    return jsonify(jobs.stats())
+
+@app.route("/api/retention/stats")
+def api_retention_stats():
+    return jsonify(retention.stats())
+
+@app.route("/api/cache/stats")
+def api_cache_stats():
+    return jsonify(depth_cache.stats())
+
+@app.route("/metrics")
+def metrics():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
 
 @app.route("/outputs/<filename>")
 def serve_output(filename):
-    return send_from_directory(OUTPUT_FOLDER, filename)
+    # Serve the precompressed copy written for compression="gzip" when the client accepts it.
+    mimetype = OUTPUT_MIMETYPES.get(os.path.splitext(filename)[1].lower())
+    gzip_path = os.path.join(OUTPUT_FOLDER, filename + ".gz")
+    has_gzip = os.path.isfile(gzip_path)
+    gzipped = has_gzip and request.accept_encodings["gzip"] > 0
+    served_filename = filename + ".gz" if gzipped else filename
+
+    # Keep the retention sweeper away from the file until the response is fully sent. The
+    # original and its .gz copy are acquired together so both stay equally fresh for the LRU
+    # order and neither is swept while the other is still being served.
+    held_paths = [os.path.join(OUTPUT_FOLDER, filename)] + ([gzip_path] if has_gzip else [])
+    for path in held_paths:
+        retention.acquire(path)
+
+    def release():
+        for path in held_paths:
+            retention.release(path)
+
+    try:
+        if gzipped:
+            response = send_from_directory(OUTPUT_FOLDER, served_filename,
+                                           mimetype=mimetype or "application/octet-stream")
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            response = send_from_directory(OUTPUT_FOLDER, served_filename, mimetype=mimetype)
+        if has_gzip:
+            response.headers["Vary"] = "Accept-Encoding"
+    except Exception:
+        release()
+        raise
+    # send_from_directory responses are passed through to the server as is, bypassing
+    # call_on_close, so release the files when the server closes the body iterator.
+    response.response = ClosingIterator(response.response, release)
+    return response
 
 if __name__ == "__main__":
     app.run(debug=True)
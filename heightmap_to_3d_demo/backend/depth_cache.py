@@ -0,0 +1,146 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+def hash_file(path, chunk_size=1 << 20):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class DepthCache:
+    """
+    On-disk cache of depth results, keyed by content hash and model ID.
+
+    Entries are files in a single directory. The least recently used entries are
+    evicted once the total size exceeds max_bytes; file modification times record
+    use, so the LRU order survives restarts. Concurrent requests for the same key
+    share one computation (single flight).
+    """
+
+    def __init__(self, directory, max_bytes=1 << 30, extension=".png"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.extension = extension
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+        # Index existing entries: key -> [size, last use].
+        self._entries = {}
+        for name in os.listdir(directory):
+            if name.endswith(extension):
+                stat = os.stat(os.path.join(directory, name))
+                self._entries[name[:-len(extension)]] = [stat.st_size, stat.st_mtime]
+        self._total_bytes = sum(size for size, _ in self._entries.values())
+
+    @staticmethod
+    def make_key(content_hash, model_id):
+        """Build a cache key from an input content hash and the ID of the model producing the result."""
+        return f"{content_hash}_{model_id}"
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key + self.extension)
+
+    def get_or_create(self, key, create):
+        """
+        Return the path of the cached entry for key, creating it on a miss.
+
+        Args:
+            key (str): Cache key, see make_key.
+            create (Callable[[str], None]): Writes the result to the given path. Only
+                one call runs per key at a time; concurrent callers wait for it and
+                receive its result or exception.
+
+        Returns:
+            str: Path of the cached file. Copy it before long use, since it may be evicted.
+        """
+        path = self.path_for(key)
+        with self._lock:
+            if key in self._entries and os.path.exists(path):
+                self.hits += 1
+                self._touch(key, path)
+                return path
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                self.misses += 1
+                future = self._in_flight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not owner:
+            return future.result()
+
+        try:
+            tmp_path = os.path.join(self.directory, f".{uuid.uuid4().hex}{self.extension}")
+            try:
+                create(tmp_path)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            with self._lock:
+                self._add(key, path)
+            future.set_result(path)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return path
+
+    def stats(self):
+        """Return hit/miss counters and the current size of the cache."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _touch(self, key, path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self._entries[key][1] = time.time()
+
+    def _add(self, key, path):
+        stat = os.stat(path)
+        previous = self._entries.get(key)
+        if previous is not None:
+            self._total_bytes -= previous[0]
+        self._entries[key] = [stat.st_size, stat.st_mtime]
+        self._total_bytes += stat.st_size
+        self._evict(keep=key)
+
+    def _evict(self, keep):
+        if self._total_bytes <= self.max_bytes:
+            return
+        for key in sorted(self._entries, key=lambda k: self._entries[k][1]):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            size, _ = self._entries.pop(key)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
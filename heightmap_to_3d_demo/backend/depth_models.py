@@ -0,0 +1 @@
+../../scripts/depth_models.py
\ No newline at end of file
@@ -0,0 +1,290 @@
+import gzip
+import multiprocessing
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from heightmap_to_3d import generate_block_from_array
+from timing import record_spans
+
+STAGES = ("depth", "mesh")
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the inference queue is full."""
+
+# Set in each meshing process by _init_mesh_worker.
+_progress_queue = None
+
+def _init_mesh_worker(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+
+def gzip_file(path, compresslevel=1):
+    """
+    Write a gzip-compressed copy of path to path + '.gz' and return its size in bytes.
+
+    Level 1 compresses mesh files only a few percent worse than level 6, about four
+    times faster.
+    """
+    gz_path = path + ".gz"
+    with open(path, "rb") as src, open(gz_path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=compresslevel, mtime=0) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+    return os.path.getsize(gz_path)
+
+def _mesh_worker(job_id, generate_kwargs, lod_levels, compression=None):
+    """
+    Meshing stage, run in the process pool. Reports each written level of detail, with
+    its size and encode time, back to the parent, and returns them all at the end
+    together with the timing spans of the stage.
+    """
+    export_stats = {}
+    written = []
+
+    def on_lod_written(level, path):
+        stats = {"fileSize": export_stats[level]["bytes"],
+                 "triangles": export_stats[level]["triangles"],
+                 "encodeSeconds": export_stats[level]["encode_seconds"]}
+        if compression == "gzip":
+            start = time.perf_counter()
+            stats["compressedSize"] = gzip_file(path)
+            stats["compressSeconds"] = time.perf_counter() - start
+        written.append((level, path, stats))
+        _progress_queue.put((job_id, level, path, stats))
+
+    with record_spans() as spans:
+        generate_block_from_array(lod_levels=lod_levels, on_lod_written=on_lod_written,
+                                  export_stats=export_stats, **generate_kwargs)
+    return written, spans
+
+class Job:
+    """State of one /api/generate request as it moves through the stages."""
+
+    def __init__(self, params, inputs=None):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.inputs = inputs or {}  # large inputs of the depth stage, released once it has run
+        self.status = "queued"  # queued, running, done, failed or cancelled
+        self.stages = {stage: {"status": "pending", "seconds": None} for stage in STAGES}
+        self.outputs = {}  # level of detail -> output path
+        self.output_stats = {}  # level of detail -> size and encode time
+        self.timings = {}  # timing span or stage name -> seconds
+        self.error = None
+        self.cancel_requested = False
+        self.mesh_future = None
+        self.created = time.time()
+        self.finished = None
+
+    def to_dict(self):
+        return {
+            "jobId": self.id,
+            "status": self.status,
+            "stages": {stage: dict(info) for stage, info in self.stages.items()},
+            "outputs": {level: os.path.basename(path) for level, path in self.outputs.items()},
+            "outputStats": {level: dict(stats) for level, stats in self.output_stats.items()},
+            "timings": dict(self.timings),
+            "error": self.error,
+        }
+
+class JobManager:
+    """
+    In-process job queue for the generate pipeline.
+
+    Jobs wait in a bounded queue for a single inference thread, since the depth model is
+    shared, and are then meshed in a process pool. Submitting to a full queue raises
+    QueueFullError. Workers are started on first submit, so importing the module (as
+    the spawned meshing processes do) starts nothing. If a meshing process dies (e.g. is
+    OOM-killed), its jobs fail and the pool is replaced, so later jobs still run.
+
+    :param run_depth: Callable(job) run on the inference thread; returns the
+                      (generate_kwargs, lod_levels) for the meshing stage. job.inputs
+                      is cleared once it returns, so large inputs such as the uploaded
+                      image are not kept in memory for as long as the job is.
+    :param max_queued: Maximum number of jobs waiting for inference.
+    :param mesh_workers: Number of meshing processes.
+    :param job_ttl: Seconds finished jobs are kept for status queries.
+    :param on_finish: Optional callback(job) invoked when a job is done, failed or cancelled,
+                      e.g. to record metrics. It runs with the manager's lock held, so it
+                      must not call back into the manager.
+    """
+
+    def __init__(self, run_depth, max_queued=8, mesh_workers=2, job_ttl=3600, on_finish=None):
+        self._run_depth = run_depth
+        self._on_finish = on_finish
+        self._mesh_workers = mesh_workers
+        self._job_ttl = job_ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._pool = None
+
+    def _start(self):
+        self._context = multiprocessing.get_context("spawn")
+        self._progress = self._context.Queue()
+        self._pool = self._new_pool()
+        threading.Thread(target=self._inference_loop, daemon=True).start()
+        threading.Thread(target=self._progress_loop, daemon=True).start()
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self._mesh_workers, mp_context=self._context,
+                                   initializer=_init_mesh_worker, initargs=(self._progress,))
+
+    def _replace_broken_pool(self, pool):
+        # Every in-flight job of a broken pool fails with BrokenProcessPool; only the first replaces it.
+        if self._pool is pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = self._new_pool()
+
+    def submit(self, params, timings=None, inputs=None):
+        """
+        Queue a new job with the given parameters (and timings measured so far) and return it.
+        inputs are only available to run_depth, and released after it or on cancellation.
+        """
+        job = Job(params, inputs)
+        job.timings.update(timings or {})
+        with self._lock:
+            if self._pool is None:
+                self._start()
+            self._prune()
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFullError("Too many jobs waiting for inference") from None
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        """Return a snapshot of the job's status, or None if it is unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def cancel(self, job_id):
+        """
+        Cancel a job. Queued jobs are dropped right away; jobs past that point stop at
+        the next stage boundary and their outputs are removed.
+
+        :return: False if the job is unknown or already finished, True otherwise.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in ("done", "failed", "cancelled"):
+                return False
+            job.cancel_requested = True
+            if job.status == "queued" or (job.mesh_future is not None and job.mesh_future.cancel()):
+                self._finish(job, "cancelled")
+            return True
+
+    def active_params(self):
+        """Return the parameters of the jobs that are queued or running."""
+        with self._lock:
+            return [job.params for job in self._jobs.values() if job.finished is None]
+
+    def stats(self):
+        """Return the number of queued jobs and of jobs per status."""
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {"queued": self._queue.qsize(), "jobs": counts}
+
+    def _finish(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        job.finished = time.time()
+        job.timings["total"] = job.finished - job.created
+        job.inputs = {}
+        if status == "cancelled":
+            for path in job.outputs.values():
+                for output in (path, path + ".gz"):
+                    if os.path.exists(output):
+                        os.remove(output)
+            job.outputs = {}
+            job.output_stats = {}
+        if self._on_finish is not None:
+            self._on_finish(job)
+
+    def _prune(self):
+        cutoff = time.time() - self._job_ttl
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished is not None and job.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def _end_stage(self, job, stage, start, status="done"):
+        job.stages[stage]["status"] = status
+        job.stages[stage]["seconds"] = time.perf_counter() - start
+
+    def _inference_loop(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                if job.status == "cancelled":
+                    continue
+                job.status = "running"
+                job.stages["depth"]["status"] = "running"
+            start = time.perf_counter()
+            try:
+                with record_spans() as spans:
+                    generate_kwargs, lod_levels = self._run_depth(job)
+            except Exception as e:
+                job.inputs = {}
+                with self._lock:
+                    job.timings.update(spans)
+                    self._end_stage(job, "depth", start, "failed")
+                    self._finish(job, "failed", f"Error generating heightmap: {str(e)}")
+                continue
+            job.inputs = {}
+            with self._lock:
+                job.timings.update(spans)
+                self._end_stage(job, "depth", start)
+                if job.cancel_requested:
+                    self._finish(job, "cancelled")
+                    continue
+                start = time.perf_counter()
+                job.stages["mesh"]["status"] = "running"
+                pool = self._pool
+                try:
+                    job.mesh_future = pool.submit(_mesh_worker, job.id, generate_kwargs, lod_levels,
+                                                  job.params.get("compression"))
+                except BrokenProcessPool as e:
+                    self._replace_broken_pool(pool)
+                    self._end_stage(job, "mesh", start, "failed")
+                    self._finish(job, "failed", f"Error generating model: {str(e)}")
+                    continue
+            job.mesh_future.add_done_callback(
+                lambda future, job=job, start=start, pool=pool: self._mesh_done(job, future, start, pool))
+
+    def _mesh_done(self, job, future, start, pool):
+        with self._lock:
+            if future.cancelled() or job.status == "cancelled":
+                return
+            error = future.exception()
+            if isinstance(error, BrokenProcessPool):
+                self._replace_broken_pool(pool)
+            if error is None:
+                # Progress messages may still be in flight, so take the outputs from the result.
+                written, spans = future.result()
+                job.timings.update(spans)
+                for level, path, stats in written:
+                    job.outputs[level] = path
+                    job.output_stats[level] = stats
+            self._end_stage(job, "mesh", start, "failed" if error else "done")
+            if job.cancel_requested:
+                self._finish(job, "cancelled")
+            elif error:
+                self._finish(job, "failed", f"Error generating model: {str(error)}")
+            else:
+                self._finish(job, "done")
+
+    def _progress_loop(self):
+        while True:
+            job_id, level, path, stats = self._progress.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is not None and job.status != "cancelled":
+                    job.outputs[level] = path
+                    job.output_stats[level] = stats
@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+
+class RetentionSweeper:
+    """
+    Background garbage collector for generated files.
+
+    Files in the watched directories are deleted once they have not been served
+    for ttl seconds, and the least recently served ones are deleted first while
+    the total size exceeds max_bytes. Serving a file updates its modification
+    time (see touch), so the LRU order survives restarts, as in DepthCache.
+
+    A file is never deleted while it is being served (between acquire and
+    release) or while is_protected(path) returns True, e.g. because an active
+    job still references it. A file and its .gz copy are swept as one unit.
+    """
+
+    def __init__(self, directories, ttl=24 * 3600, max_bytes=10 << 30, interval=60, is_protected=None):
+        self.directories = list(directories)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.is_protected = is_protected
+
+        self._lock = threading.Lock()
+        self._in_use = {}
+        self._thread = None
+        self._stop = threading.Event()
+        self.sweeps = 0
+        self.files_deleted = 0
+        self.bytes_reclaimed = 0
+        self.skipped = 0
+        self.last_sweep_seconds = None
+        self.files = 0
+        self.total_bytes = 0
+
+    def start(self):
+        """Start the sweeper thread, if it is not running yet."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def acquire(self, path):
+        """Mark path as being served and record the access for the LRU order."""
+        key = os.path.abspath(path)
+        with self._lock:
+            self._in_use[key] = self._in_use.get(key, 0) + 1
+        self.touch(path)
+
+    def release(self, path):
+        key = os.path.abspath(path)
+        with self._lock:
+            count = self._in_use.get(key, 0) - 1
+            if count > 0:
+                self._in_use[key] = count
+            else:
+                self._in_use.pop(key, None)
+
+    @staticmethod
+    def touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def sweep(self):
+        """
+        Delete expired files, then the least recently used ones until the quota is met.
+
+        A file and its precompressed .gz copy are one unit: they are kept or deleted
+        together, by the most recent use of either, so an output never survives in
+        only one encoding.
+
+        :return: Number of bytes reclaimed by this sweep.
+        """
+        start = time.perf_counter()
+        units = {}  # path without .gz -> [last used, size, paths]
+        num_files = 0
+        for directory in self.directories:
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_file(follow_symlinks=False):
+                            stat = entry.stat(follow_symlinks=False)
+                            key = entry.path[:-3] if entry.path.endswith(".gz") else entry.path
+                            unit = units.setdefault(key, [0.0, 0, []])
+                            unit[0] = max(unit[0], stat.st_mtime)
+                            unit[1] += stat.st_size
+                            unit[2].append(entry.path)
+                            num_files += 1
+            except FileNotFoundError:
+                continue
+        entries = sorted(units.values())
+
+        total_bytes = sum(size for _, size, _ in entries)
+        cutoff = time.time() - self.ttl
+        reclaimed = deleted = skipped = 0
+        for last_used, size, paths in entries:
+            if last_used >= cutoff and total_bytes <= self.max_bytes:
+                break
+            with self._lock:
+                # Checked under the lock, so a file cannot start being served before it is deleted.
+                if any(os.path.abspath(path) in self._in_use or (self.is_protected and self.is_protected(path))
+                       for path in paths):
+                    skipped += 1
+                    continue
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            total_bytes -= size
+            reclaimed += size
+            deleted += len(paths)
+
+        with self._lock:
+            self.sweeps += 1
+            self.files_deleted += deleted
+            self.bytes_reclaimed += reclaimed
+            self.skipped += skipped
+            self.files = num_files - deleted
+            self.total_bytes = total_bytes
+            self.last_sweep_seconds = time.perf_counter() - start
+        return reclaimed
+
+    def stats(self):
+        """Return the sweep counters and the size of the watched directories at the last sweep."""
+        with self._lock:
+            return {
+                "sweeps": self.sweeps,
+                "files_deleted": self.files_deleted,
+                "bytes_reclaimed": self.bytes_reclaimed,
+                "skipped_in_use": self.skipped,
+                "files": self.files,
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "last_sweep_seconds": self.last_sweep_seconds,
+            }
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Retention sweep failed: {e}")
+            self._stop.wait(self.interval)
@@ -0,0 +1,52 @@
+import os
+import time
+
+import numpy as np
+
+from jobs import JobManager
+
+class _KillWorker:
+    """Unpickling this in a meshing process exits it abruptly, like an OOM kill."""
+
+    def __reduce__(self):
+        return os._exit, (1,)
+
+def _wait(manager, job_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job["status"] in ("done", "failed", "cancelled"):
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(f"Job {job_id} did not finish")
+
+def test_jobs_complete_after_a_mesh_worker_dies(tmp_path):
+    def run_depth(job):
+        kwargs = {"heightmap": np.zeros((8, 8), dtype=np.uint8),
+                  "output_path": str(tmp_path / f"{job.id}.stl")}
+        if job.params.get("kill"):
+            kwargs["invert"] = _KillWorker()
+        return kwargs, [0]
+
+    manager = JobManager(run_depth, mesh_workers=1)
+    killed = _wait(manager, manager.submit({"kill": True}).id)
+    assert killed["status"] == "failed"
+    assert killed["stages"]["mesh"]["status"] == "failed"
+
+    job = _wait(manager, manager.submit({}).id)
+    assert job["status"] == "done", job["error"]
+    assert os.path.exists(tmp_path / f"{job['jobId']}.stl")
+
+def test_inputs_are_released_after_the_depth_stage(tmp_path):
+    seen = []
+
+    def run_depth(job):
+        seen.append(job.inputs["color_image"])
+        return {"heightmap": np.zeros((8, 8), dtype=np.uint8),
+                "output_path": str(tmp_path / f"{job.id}.stl")}, [0]
+
+    manager = JobManager(run_depth, mesh_workers=1)
+    job = manager.submit({}, inputs={"color_image": b"image bytes"})
+    assert _wait(manager, job.id)["status"] == "done"
+    assert seen == [b"image bytes"]
+    assert job.inputs == {}
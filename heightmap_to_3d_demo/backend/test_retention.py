@@ -0,0 +1,38 @@
+import importlib
+import os
+import time
+
+from retention import RetentionSweeper
+
+def _write(path, age):
+    with open(path, "wb") as f:
+        f.write(b"x" * 100)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+def test_sweep_keeps_an_output_and_its_gzip_copy_together(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # app creates its upload and output folders on import
+    app = importlib.import_module("app")
+    outputs = tmp_path / "outputs"
+    # Only the .gz copy of kept.stl was served recently; neither file of old.stl was.
+    _write(outputs / "kept.stl", age=7200)
+    _write(outputs / "kept.stl.gz", age=10)
+    _write(outputs / "old.stl", age=7200)
+    _write(outputs / "old.stl.gz", age=7200)
+    sweeper = RetentionSweeper([str(outputs)], ttl=3600, interval=3600)
+    monkeypatch.setattr(app, "OUTPUT_FOLDER", str(outputs))
+    monkeypatch.setattr(app, "retention", sweeper)
+
+    assert sweeper.sweep() == 200
+    assert sorted(os.listdir(outputs)) == ["kept.stl", "kept.stl.gz"]
+
+    sweeper.stop()
+    client = app.app.test_client()
+    response = client.get("/outputs/kept.stl")
+    assert response.status_code == 200
+    assert "Content-Encoding" not in response.headers
+    response.close()
+    response = client.get("/outputs/kept.stl", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    response.close()
+    assert client.get("/outputs/old.stl").status_code == 404
@@ -0,0 +1 @@
+../../scripts/timing.py
\ No newline at end of file
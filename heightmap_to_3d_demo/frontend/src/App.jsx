@@ -4,13 +4,17 @@ import { Canvas } from "@react-three/fiber";
 import { OrbitControls } from "@react-three/drei";
 import { STLLoader } from "three/examples/jsm/loaders/STLLoader";
 import { PLYLoader } from "three/examples/jsm/loaders/PLYLoader";
+import { GLTFLoader } from "three/examples/jsm/loaders/GLTFLoader";
+import * as THREE from "three";
 
 function ModelViewer({ fileUrl, fileType }) {
   const [geometry, setGeometry] = useState(null);
+  const [scene, setScene] = useState(null);
 
   useEffect(() => {
     if (!fileUrl) return;
     setGeometry(null); // reset previous geometry
+    setScene(null);
 
     if (fileType === "stl") {
       const loader = new STLLoader();
@@ -23,10 +27,24 @@ function ModelViewer({ fileUrl, fileType }) {
         geom.computeVertexNormals();
         setGeometry(geom);
       });
+    } else if (fileType === "glb") {
+      // GLB positions may be quantized; the node transform dequantizes them, so render the whole scene.
+      const loader = new GLTFLoader();
+      loader.load(fileUrl, (gltf) => {
+        gltf.scene.traverse((child) => {
+          if (!child.isMesh) return;
+          child.geometry.computeVertexNormals();
+          const hasColor = !!child.geometry.attributes.color;
+          child.material = new THREE.MeshStandardMaterial(
+            hasColor ? { vertexColors: true } : { color: "lightgray" }
+          );
+        });
+        setScene(gltf.scene);
+      });
     }
   }, [fileUrl, fileType]);
 
-  if (!geometry) {
+  if (!geometry && !scene) {
     return (
       <div className="flex items-center justify-center h-full text-lg font-medium">
         Loading model...
@@ -38,13 +56,17 @@ function ModelViewer({ fileUrl, fileType }) {
     <Canvas className="w-full h-full" camera={{ position: [150, 150, 150], fov: 75 }}>
       <ambientLight intensity={0.5} />
       <directionalLight intensity={0.5} position={[0, 0, 100]} />
-      <mesh geometry={geometry}>
-        {fileType === "ply" ? (
-          <meshStandardMaterial vertexColors={!!geometry.attributes.color} />
-        ) : (
-          <meshStandardMaterial color="lightgray" />
-        )}
-      </mesh>
+      {scene ? (
+        <primitive object={scene} />
+      ) : (
+        <mesh geometry={geometry}>
+          {fileType === "ply" ? (
+            <meshStandardMaterial vertexColors={!!geometry.attributes.color} />
+          ) : (
+            <meshStandardMaterial color="lightgray" />
+          )}
+        </mesh>
+      )}
       <OrbitControls />
     </Canvas>
   );
@@ -63,16 +85,21 @@ function App() {
   const [mode, setMode] = useState("protrude");
   const [invert, setInvert] = useState(false);
   const [includeColor, setIncludeColor] = useState(false);
+  const [fileFormat, setFileFormat] = useState("auto");
+  const [quantize, setQuantize] = useState(true);
+  const [compress, setCompress] = useState(true);
 
   // Resulting file
   const [resultUrl, setResultUrl] = useState("");
   const [resultFileType, setResultFileType] = useState("");
+  const [resultStats, setResultStats] = useState(null);
   const [loading, setLoading] = useState(false);
 
   const handleSubmit = async (e) => {
     e.preventDefault();
     setLoading(true);
     setResultUrl("");
+    setResultStats(null);
 
     if (!image) {
       console.error("No image selected");
@@ -93,14 +120,35 @@ function App() {
     formData.append("mode", mode);
     formData.append("invert", invert ? "true" : "false");
     formData.append("include_color", includeColor ? "true" : "false");
+    formData.append("file_format", fileFormat);
+    // Quantization and gzip are GLB-only options; their controls only show for GLB.
+    if (fileFormat === "glb") {
+      formData.append("quantize", quantize ? "true" : "false");
+      formData.append("compression", compress ? "gzip" : "none");
+    }
 
     try {
       // Post to your /api/generate endpoint
       const response = await axios.post("http://127.0.0.1:5000/api/generate", formData, {
         headers: { "Content-Type": "multipart/form-data" },
       });
-      setResultUrl(response.data.fileUrl);
-      setResultFileType(response.data.fileType);
+      // The backend queues a job; poll it, showing the low-LOD preview until the full model is done.
+      const { statusUrl } = response.data;
+      const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+      for (;;) {
+        const { data: job } = await axios.get(statusUrl);
+        if (job.fileType) setResultFileType(job.fileType);
+        if (job.status === "done") {
+          setResultUrl(job.fileUrl);
+          setResultStats(job);
+          break;
+        } else if (job.status === "failed" || job.status === "cancelled") {
+          console.error("Error generating model:", job.error || job.status);
+          break;
+        }
+        if (job.previewUrl) setResultUrl(job.previewUrl);
+        await sleep(1000);
+      }
     } catch (error) {
       console.error("Error generating model:", error);
     } finally {
@@ -211,6 +259,20 @@ function App() {
                   <option value="carve">Carve</option>
                 </select>
               </div>
+              <div>
+                <label className="block text-sm font-medium text-gray-700 dark:text-gray-200">
+                  File Format
+                </label>
+                <select
+                  value={fileFormat}
+                  onChange={(e) => setFileFormat(e.target.value)}
+                  className="mt-1 block w-full p-2 border border-gray-300 rounded-md 
+                             focus:outline-none dark:bg-gray-700 dark:border-gray-600"
+                >
+                  <option value="auto">STL / PLY</option>
+                  <option value="glb">GLB (compact)</option>
+                </select>
+              </div>
             </div>
 
             <div className="flex justify-between mt-4">
@@ -248,6 +310,43 @@ function App() {
               </div>
             </div>
 
+            {fileFormat === "glb" && (
+              <div className="flex justify-between mt-4">
+                {/* Quantize GLB attributes checkbox */}
+                <div className="flex items-center">
+                  <input
+                    type="checkbox"
+                    id="quantize"
+                    checked={quantize}
+                    onChange={(e) => setQuantize(e.target.checked)}
+                    className="h-4 w-4 text-blue-600 border-gray-300 rounded"
+                  />
+                  <label
+                    htmlFor="quantize"
+                    className="ml-2 text-sm font-medium text-gray-700 dark:text-gray-200"
+                  >
+                    Quantize
+                  </label>
+                </div>
+                {/* Gzip compression checkbox */}
+                <div className="flex items-center">
+                  <input
+                    type="checkbox"
+                    id="compress"
+                    checked={compress}
+                    onChange={(e) => setCompress(e.target.checked)}
+                    className="h-4 w-4 text-blue-600 border-gray-300 rounded"
+                  />
+                  <label
+                    htmlFor="compress"
+                    className="ml-2 text-sm font-medium text-gray-700 dark:text-gray-200"
+                  >
+                    Compress Download
+                  </label>
+                </div>
+              </div>
+            )}
+
             {/* Generate button */}
             <div>
               <button
@@ -304,6 +403,14 @@ function App() {
                 Download Model
               </a>
             </p>
+            {resultStats && (
+              <p className="mb-4 text-sm text-gray-600 dark:text-gray-300">
+                {(resultStats.fileSize / 1e6).toFixed(1)} MB
+                {resultStats.compressedSize &&
+                  ` (${(resultStats.compressedSize / 1e6).toFixed(1)} MB compressed)`}
+                , encoded in {resultStats.encodeSeconds.toFixed(2)} s
+              </p>
+            )}
             <div className="mt-4 h-96 border border-gray-300 rounded overflow-hidden">
               <ModelViewer fileUrl={resultUrl} fileType={resultFileType} />
             </div>
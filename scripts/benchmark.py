@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the heightmap-to-mesh and depth post-processing hot paths.
+
+Every case runs on deterministic synthetic inputs in its own process, and every
+stage records its wall time, peak RSS and output size. Results are saved as
+JSON and can be compared against a stored baseline:
+
+    python benchmark.py --output results.json
+    python benchmark.py --sizes 64 256 --baseline results.json --time_threshold 0.15
+
+Depth stages use the "stub" depth model, so no network access, weights or GPU
+are needed.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+DEFAULT_SIZES = (64, 256, 1024, 4096)
+MODES = ("protrude", "carve")
+
+def synthetic_heightmap(size, seed=0):
+    """Smooth relief plus fine noise, as (size, size) uint8, identical for a given size and seed."""
+    rng = np.random.default_rng(seed)
+    t = np.linspace(0.0, 4.0 * np.pi, size, dtype=np.float32)
+    relief = np.sin(t)[np.newaxis, :] * np.cos(0.7 * t)[:, np.newaxis]
+    noise = rng.standard_normal((size, size), dtype=np.float32) * 0.1
+    values = (relief + noise - (relief + noise).min()) / np.ptp(relief + noise)
+    return (values * 255).astype(np.uint8)
+
+def synthetic_color(size, seed=0):
+    """(size, size, 3) uint8 color image matching synthetic_heightmap."""
+    gray = synthetic_heightmap(size, seed)
+    ramp = np.linspace(0, 255, size, dtype=np.float32).astype(np.uint8)
+    return np.stack([gray, np.broadcast_to(ramp, (size, size)), 255 - gray], axis=-1)
+
+def _current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return None
+
+class PeakRssSampler:
+    """
+    Samples this process's RSS on a background thread to find the peak within a stage.
+    Falls back to the process-wide ru_maxrss where /proc is unavailable.
+    """
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.peak_mb = None
+
+    def __enter__(self):
+        self._stop = threading.Event()
+        self.peak_mb = _current_rss_mb()
+        if self.peak_mb is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, _current_rss_mb())
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self.peak_mb is None:
+            from generate_depth import _peak_rss_mb
+            self.peak_mb = _peak_rss_mb()
+        else:
+            self._thread.join()
+            self.peak_mb = max(self.peak_mb, _current_rss_mb())
+
+def run_stage(results, name, func, output_path=None):
+    """Time func(), recording its wall time, peak RSS and (if output_path is set) output size."""
+    with PeakRssSampler() as rss:
+        start = time.perf_counter()
+        value = func()
+        seconds = time.perf_counter() - start
+    results[name] = {
+        "seconds": seconds,
+        "peak_rss_mb": round(rss.peak_mb, 1) if rss.peak_mb is not None else None,
+        "output_bytes": os.path.getsize(output_path) if output_path else None,
+    }
+    if output_path:
+        os.remove(output_path)
+    return value
+
+def mesh_case(size, mode, color, workdir, streaming_from):
+    """Stages of generate_block_from_heightmap for one heightmap size, mode and color setting."""
+    import heightmap_to_3d as h3d
+
+    results = {}
+    heightmap_path = os.path.join(workdir, f"heightmap_{size}.png")
+    color_path = os.path.join(workdir, f"color_{size}.png") if color else None
+    if not os.path.exists(heightmap_path):
+        Image.fromarray(synthetic_heightmap(size), mode="L").save(heightmap_path)
+    if color and not os.path.exists(color_path):
+        Image.fromarray(synthetic_color(size), mode="RGB").save(color_path)
+    output_path = os.path.join(workdir, f"mesh_{size}_{mode}.{'ply' if color else 'stl'}")
+
+    # The in-memory path needs several GB at the largest sizes, so those stream instead.
+    streaming = size >= streaming_from
+    run_stage(results, "generate_block_from_heightmap",
+              lambda: h3d.generate_block_from_heightmap(heightmap_path, output_path, mode=mode,
+                                                        color_reference=color_path, streaming=streaming),
+              output_path)
+    if streaming:
+        return results
+
+    # The hot paths inside it: mesh assembly and export.
+    pixels = h3d.normalize_heightmap(h3d.open_heightmap(heightmap_path))
+    vertices, faces = run_stage(results, "build_mesh", lambda: (
+        h3d.build_block_vertices(pixels, 100.0, 100.0, 10.0, 5.0, 0.0, mode),
+        h3d.build_block_faces(size, size)))
+    if color:
+        ref_pixels = np.asarray(Image.open(color_path).convert("RGB"))
+        vertex_colors = run_stage(results, "build_vertex_colors", lambda: h3d.build_vertex_colors(ref_pixels))
+        run_stage(results, "write_ply", lambda: h3d.write_ply(output_path, vertices, faces, vertex_colors),
+                  output_path)
+    else:
+        run_stage(results, "write_stl", lambda: h3d.write_stl(output_path, vertices, faces), output_path)
+    return results
+
+def depth_case(size, workdir):
+    """Stages of get_grayscale_depth with the stub depth model."""
+    import generate_depth
+    from depth_models import get_depth_model
+
+    results = {}
+    image_path = os.path.join(workdir, f"color_{size}.png")
+    if not os.path.exists(image_path):
+        Image.fromarray(synthetic_color(size), mode="RGB").save(image_path)
+    output_path = os.path.join(workdir, f"depth_{size}.png")
+
+    run_stage(results, "get_grayscale_depth",
+              lambda: generate_depth.get_grayscale_depth(image_path, output_path, model_name="stub"),
+              output_path)
+
+    image = Image.open(image_path).convert("RGB")
+    depth = run_stage(results, "infer", lambda: get_depth_model("stub").infer_pil(image))
+    run_stage(results, "depth_to_heightmap", lambda: generate_depth.depth_to_heightmap(depth))
+    run_stage(results, "depth_to_float_heightmap", lambda: generate_depth.depth_to_float_heightmap(depth))
+    try:
+        import matplotlib  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        run_stage(results, "colorize", lambda: generate_depth.colorize(depth, cmap="gray"))
+    return results
+
+def _run_case(kind, args):
+    # Runs in a fresh process: quiet the per-file prints and return the stage results.
+    sys.stdout = open(os.devnull, "w")
+    return mesh_case(*args) if kind == "mesh" else depth_case(*args)
+
+def run_benchmarks(sizes=DEFAULT_SIZES, repeat=3, streaming_from=4096, include_depth=True, workdir=None):
+    """
+    Run every case and return the results.
+
+    Each case runs repeat times, each time in a new process so that peak RSS is
+    not carried over; the fastest time and the highest peak RSS are kept.
+
+    :param sizes: Edge lengths of the square synthetic heightmaps.
+    :param streaming_from: Sizes from this one up are meshed with the streaming exporter only.
+    :return: Dict with "meta" (environment) and "results" (case -> stage -> metrics).
+    """
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        cases = []
+        for size in sizes:
+            for mode in MODES:
+                for color in (False, True):
+                    cases.append((f"mesh/{size}/{mode}/{'color' if color else 'gray'}", "mesh",
+                                  (size, mode, color, tmp, streaming_from)))
+            if include_depth:
+                cases.append((f"depth/{size}", "depth", (size, tmp)))
+
+        for name, kind, args in cases:
+            best = None
+            for _ in range(repeat):
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    run = pool.submit(_run_case, kind, args).result()
+                if best is None:
+                    best = run
+                    continue
+                for stage, metrics in run.items():
+                    best[stage]["seconds"] = min(best[stage]["seconds"], metrics["seconds"])
+                    if metrics["peak_rss_mb"] is not None:
+                        best[stage]["peak_rss_mb"] = max(best[stage]["peak_rss_mb"], metrics["peak_rss_mb"])
+            results[name] = best
+            print(f"{name}: " + ", ".join(f"{stage} {metrics['seconds']:.3f}s" for stage, metrics in best.items()))
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+def compare_to_baseline(current, baseline, time_threshold=0.10, rss_threshold=0.20, min_seconds=0.05):
+    """
+    Compare two runs stage by stage.
+
+    :param time_threshold: Relative slowdown counted as a regression (0.10 = 10% slower).
+    :param rss_threshold: Relative peak RSS increase counted as a regression.
+    :param min_seconds: Stages faster than this in both runs are too noisy to compare.
+    :return: List of (case, stage, metric, baseline value, current value, relative change)
+             for every regression.
+    """
+    regressions = []
+    for case, stages in current["results"].items():
+        for stage, metrics in stages.items():
+            base = baseline["results"].get(case, {}).get(stage)
+            if base is None:
+                continue
+            if max(base["seconds"], metrics["seconds"]) >= min_seconds and base["seconds"] > 0:
+                change = metrics["seconds"] / base["seconds"] - 1
+                if change > time_threshold:
+                    regressions.append((case, stage, "seconds", base["seconds"], metrics["seconds"], change))
+            if base.get("peak_rss_mb") and metrics.get("peak_rss_mb"):
+                change = metrics["peak_rss_mb"] / base["peak_rss_mb"] - 1
+                if change > rss_threshold:
+                    regressions.append((case, stage, "peak_rss_mb", base["peak_rss_mb"], metrics["peak_rss_mb"], change))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark heightmap meshing and depth post-processing.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="Edge lengths of the synthetic heightmaps (default: 64 256 1024 4096).")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case; the fastest is kept (default: 3).")
+    parser.add_argument("--streaming_from", type=int, default=4096,
+                        help="Mesh sizes from this one up with the streaming exporter only (default: 4096).")
+    parser.add_argument("--no_depth", action="store_true", help="Skip the depth post-processing cases.")
+    parser.add_argument("--workdir", help="Directory for temporary inputs and outputs (default: system temp).")
+    parser.add_argument("--output", help="Save the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare against the results in this JSON file.")
+    parser.add_argument("--time_threshold", type=float, default=0.10,
+                        help="Relative slowdown reported as a regression (default: 0.10).")
+    parser.add_argument("--rss_threshold", type=float, default=0.20,
+                        help="Relative peak RSS increase reported as a regression (default: 0.20).")
+    parser.add_argument("--min_seconds", type=float, default=0.05,
+                        help="Ignore timing changes of stages faster than this (default: 0.05).")
+    args = parser.parse_args()
+
+    current = run_benchmarks(args.sizes, repeat=args.repeat, streaming_from=args.streaming_from,
+                             include_depth=not args.no_depth, workdir=args.workdir)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(current, baseline, args.time_threshold,
+                                          args.rss_threshold, args.min_seconds)
+        for case, stage, metric, before, after, change in regressions:
+            print(f"REGRESSION {case} {stage} {metric}: {before:.3f} -> {after:.3f} ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+if __name__ == "__main__":
+    main()
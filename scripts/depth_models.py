@@ -0,0 +1,352 @@
+import argparse
+import copy
+import os
+import threading
+import time
+from contextlib import ExitStack
+from functools import partial
+
+import numpy as np
+
+# Model used when callers do not ask for a specific one.
+DEFAULT_DEPTH_MODEL = os.environ.get("DEPTH_MODEL", "zoedepth-n")
+
+_loaders = {}
+_instances = {}
+_lock = threading.Lock()
+
+def register_depth_model(name, loader):
+    """
+    Register a depth model loader. Any instance already loaded under that name is dropped.
+
+    Args:
+        name (str): Registry key, e.g. "zoedepth-n".
+        loader (Callable[[], object]): Returns a model exposing infer_pil(image, output_type="tensor").
+    """
+    with _lock:
+        _loaders[name] = loader
+        _instances.pop(name, None)
+
+def available_depth_models():
+    """Return the names of all registered depth models."""
+    return sorted(_loaders)
+
+def get_depth_model(name=None):
+    """
+    Return the shared instance of a depth model, loading it on first use.
+
+    Args:
+        name (str, optional): Registry key. Defaults to DEFAULT_DEPTH_MODEL
+            (the DEPTH_MODEL environment variable, or "zoedepth-n").
+
+    Returns:
+        object: The loaded model. Loading happens once per process, even when
+        several threads ask for the model at the same time.
+    """
+    name = name or DEFAULT_DEPTH_MODEL
+    model = _instances.get(name)
+    if model is None:
+        with _lock:
+            if name not in _loaders:
+                raise KeyError(f"Unknown depth model: {name}")
+            if name not in _instances:
+                _instances[name] = _loaders[name]()
+            model = _instances[name]
+    return model
+
+def get_device():
+    """Return "cuda" if a GPU is available, otherwise "cpu"."""
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+# CPU inference profiles, applied by apply_inference_profile. Each ZoeDepth model is also
+# registered as "<name>-<profile>", e.g. DEPTH_MODEL=zoedepth-n-cpu-int8.
+INFERENCE_PROFILES = {
+    # Linear layers (most of the BEiT backbone) quantized to int8 weights with dynamic activations.
+    "cpu-int8": {"quantize": True, "channels_last": True, "compile": True},
+    # bfloat16 autocast, on CPUs with native bfloat16 support (float32 elsewhere).
+    "cpu-bf16": {"bfloat16": True, "channels_last": True, "compile": True},
+    # float32, only compiled and with channels_last convolutions.
+    "cpu-fp32": {"channels_last": True, "compile": True},
+}
+
+def set_torch_threads(threads=None, interop_threads=None):
+    """
+    Set torch's intra-op and inter-op CPU thread counts, e.g. to split the cores between workers.
+
+    Args:
+        threads (int, optional): Intra-op threads. Defaults to $DEPTH_THREADS, else torch's default.
+        interop_threads (int, optional): Inter-op threads. Defaults to $DEPTH_INTEROP_THREADS,
+            else torch's default. Torch only accepts this before its first parallel work.
+    """
+    import torch
+
+    threads = threads or int(os.environ.get("DEPTH_THREADS", 0))
+    interop_threads = interop_threads or int(os.environ.get("DEPTH_INTEROP_THREADS", 0))
+    if threads:
+        torch.set_num_threads(threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            print(f"Inter-op threads already in use; keeping {torch.get_num_interop_threads()}.")
+
+def cpu_supports_bfloat16():
+    """Whether oneDNN has native bfloat16 kernels for this CPU (AVX512-BF16 or AMX)."""
+    import torch
+
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+class ProfiledDepthModel:
+    """
+    Depth model running under an inference profile: inference mode, optional bfloat16
+    autocast, and float32 outputs. Other attributes are those of the wrapped model,
+    so infer_batch works with it too.
+    """
+
+    def __init__(self, model, profile, bfloat16=False):
+        self.model = model
+        self.profile = profile
+        self.bfloat16 = bfloat16
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def _context(self):
+        import torch
+
+        stack = ExitStack()
+        stack.enter_context(torch.inference_mode())
+        if self.bfloat16:
+            stack.enter_context(torch.autocast("cpu", dtype=torch.bfloat16))
+        return stack
+
+    def infer(self, x):
+        with self._context():
+            return self.model.infer(x).float()
+
+    def infer_pil(self, image, output_type="numpy"):
+        with self._context():
+            depth = self.model.infer_pil(image, output_type="tensor").float()
+        return depth.squeeze().cpu().numpy() if output_type == "numpy" else depth
+
+def apply_inference_profile(model, profile, threads=None, interop_threads=None, warmup_size=(512, 384)):
+    """
+    Prepare a depth model for CPU inference with one of INFERENCE_PROFILES.
+
+    Depending on the profile, linear layers are dynamically quantized to int8, weights are
+    converted to channels_last, inference runs under bfloat16 autocast (where the CPU supports
+    it), and forward is compiled with torch.compile. The model is warmed up on a blank image,
+    so compilation happens at load rather than on the first request; if compiling fails, the
+    model runs eagerly.
+
+    Args:
+        model (torch.nn.Module): Float32 depth model exposing infer_pil, e.g. from load_zoedepth.
+        profile (str): Key of INFERENCE_PROFILES.
+        threads (int, optional), interop_threads (int, optional): See set_torch_threads.
+        warmup_size (tuple[int, int]): (width, height) of the warm-up image.
+
+    Returns:
+        ProfiledDepthModel: The prepared model.
+    """
+    import torch
+    from PIL import Image
+
+    if profile not in INFERENCE_PROFILES:
+        raise KeyError(f"Unknown inference profile: {profile}")
+    options = INFERENCE_PROFILES[profile]
+    set_torch_threads(threads, interop_threads)
+
+    model = model.to("cpu").eval()
+    if options.get("quantize"):
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if options.get("channels_last"):
+        model = model.to(memory_format=torch.channels_last)
+    bfloat16 = options.get("bfloat16", False) and cpu_supports_bfloat16()
+    if options.get("bfloat16") and not bfloat16:
+        print("This CPU has no native bfloat16 support; running in float32.")
+    profiled = ProfiledDepthModel(model, profile, bfloat16)
+
+    eager_forward = model.forward
+    if options.get("compile"):
+        model.forward = torch.compile(eager_forward)
+    warmup = Image.new("RGB", warmup_size, (128, 128, 128))
+    start = time.perf_counter()
+    try:
+        profiled.infer_pil(warmup)
+    except Exception as e:
+        if not options.get("compile"):
+            raise
+        print(f"torch.compile failed ({type(e).__name__}: {e}); running eagerly.")
+        model.forward = eager_forward
+        profiled.infer_pil(warmup)
+    print(f"Depth model ready with inference profile {profile} "
+          f"({torch.get_num_threads()} threads, warm-up {time.perf_counter() - start:.1f}s)")
+    return profiled
+
+def load_zoedepth(model_type="ZoeD_N", profile=None):
+    """
+    Load a ZoeDepth model through Torch Hub.
+
+    The source can be configured for hosts without network access:
+        DEPTH_MODEL_HUB_DIR: Torch Hub cache directory holding downloaded repos and weights.
+        DEPTH_MODEL_REPO: GitHub repo ("isl-org/ZoeDepth", the default) or a local
+            checkout such as <hub dir>/isl-org_ZoeDepth_main, loaded with source="local".
+        DEPTH_MODEL_CHECKPOINT: Local state dict loaded instead of downloading pretrained weights.
+
+    Args:
+        model_type (str): Hub entry point: "ZoeD_N", "ZoeD_K" or "ZoeD_NK".
+        profile (str, optional): CPU inference profile (see apply_inference_profile). Defaults
+            to None: float32 on the GPU if there is one, else on the CPU.
+    """
+    import torch
+
+    hub_dir = os.environ.get("DEPTH_MODEL_HUB_DIR")
+    if hub_dir:
+        torch.hub.set_dir(hub_dir)
+    repo = os.environ.get("DEPTH_MODEL_REPO", "isl-org/ZoeDepth")
+    checkpoint = os.environ.get("DEPTH_MODEL_CHECKPOINT")
+    source = "local" if os.path.isdir(repo) else "github"
+
+    model = torch.hub.load(repo, model_type, source=source, pretrained=checkpoint is None,
+                           trust_repo=True, skip_validation=True)
+    if checkpoint:
+        state = torch.load(checkpoint, map_location="cpu")
+        model.load_state_dict(state.get("model", state))
+    if profile is not None:
+        return apply_inference_profile(model, profile)
+    return model.to(get_device())
+
+def infer_batch(model, images):
+    """
+    Infer depth for a batch of same-sized RGB PIL images in one forward pass.
+
+    Models exposing ZoeDepth's infer(x) get a single (N, 3, H, W) tensor built
+    exactly like infer_pil builds its (1, 3, H, W) input, so results match the
+    single-image path. Other models fall back to one infer_pil call per image.
+
+    Returns:
+        list: One (H, W) depth map per image.
+    """
+    if not hasattr(model, "infer"):
+        return [model.infer_pil(image, output_type="tensor") for image in images]
+
+    import torch
+
+    device = next(model.parameters()).device
+    # Same conversion as torchvision's ToTensor(): HWC uint8 -> CHW float in [0, 1].
+    x = torch.stack([torch.from_numpy(np.asarray(image)).permute(2, 0, 1) for image in images])
+    x = x.to(device=device, dtype=torch.float32).div_(255)
+    with torch.no_grad():
+        out = model.infer(x)
+    return list(out.squeeze(1).cpu())
+
+class StubDepthModel:
+    """
+    Lightweight stand-in for tests and benchmarks: derives depth from the inverted
+    luminance of the image, without torch, weights or network access.
+    """
+
+    def infer_pil(self, image, output_type="numpy"):
+        luminance = np.asarray(image.convert("L"), dtype=np.float32) / 255.0
+        return 1.0 + 9.0 * (1.0 - luminance)
+
+def check_inference_profile(images, model_type="ZoeD_N", profile="cpu-int8", repeat=3, threads=None):
+    """
+    Compare a CPU inference profile with eager float32 inference of the same model.
+
+    Args:
+        images (list[PIL.Image.Image]): RGB test images.
+        model_type (str): ZoeDepth hub entry point.
+        profile (str): Key of INFERENCE_PROFILES.
+        repeat (int): Timed runs per image and model; the fastest counts.
+        threads (int, optional): Intra-op threads for both models (see set_torch_threads).
+
+    Returns:
+        dict: Per image ("images"), the depth error of the profile ("abs_rel": mean relative
+        error, "max_abs", "rmse"), the largest change of the float heightmap in [0, 1]
+        ("heightmap_max_error"), the fraction of 8-bit heightmap pixels that change
+        ("heightmap_changed_pixels"), and both inference times. Also "speedup", the
+        ratio of total reference time to total profile time.
+    """
+    import torch
+    from generate_depth import depth_to_float_heightmap, depth_to_heightmap
+
+    set_torch_threads(threads)
+    reference = load_zoedepth(model_type).to("cpu").eval()
+    profiled = apply_inference_profile(copy.deepcopy(reference), profile)
+
+    def timed(infer, image):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            depth = infer(image)
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        return depth, best
+
+    def infer_reference(image):
+        with torch.inference_mode():
+            return reference.infer_pil(image, output_type="tensor").float().squeeze().cpu().numpy()
+
+    results = []
+    for image in images:
+        expected, reference_seconds = timed(infer_reference, image)
+        actual, profile_seconds = timed(profiled.infer_pil, image)
+        error = np.abs(actual - expected)
+        results.append({
+            "size": image.size,
+            "abs_rel": float(np.mean(error / np.maximum(np.abs(expected), 1e-6))),
+            "max_abs": float(error.max()),
+            "rmse": float(np.sqrt(np.mean(error ** 2))),
+            "heightmap_max_error": float(np.abs(depth_to_float_heightmap(actual) - depth_to_float_heightmap(expected)).max()),
+            "heightmap_changed_pixels": float(np.mean(depth_to_heightmap(actual) != depth_to_heightmap(expected))),
+            "reference_seconds": reference_seconds,
+            "profile_seconds": profile_seconds,
+        })
+
+    reference_total = sum(result["reference_seconds"] for result in results)
+    profile_total = sum(result["profile_seconds"] for result in results)
+    return {
+        "profile": profile,
+        "model_type": model_type,
+        "threads": torch.get_num_threads(),
+        "images": results,
+        "abs_rel": float(np.mean([result["abs_rel"] for result in results])),
+        "heightmap_max_error": max(result["heightmap_max_error"] for result in results),
+        "speedup": reference_total / profile_total if profile_total > 0 else float("nan"),
+    }
+
+_ZOEDEPTH_MODELS = {"zoedepth-n": "ZoeD_N", "zoedepth-k": "ZoeD_K", "zoedepth-nk": "ZoeD_NK"}
+for _name, _model_type in _ZOEDEPTH_MODELS.items():
+    register_depth_model(_name, partial(load_zoedepth, _model_type))
+    for _profile in INFERENCE_PROFILES:
+        register_depth_model(f"{_name}-{_profile}", partial(load_zoedepth, _model_type, profile=_profile))
+register_depth_model("stub", StubDepthModel)
+
+if __name__ == "__main__":
+    from PIL import Image
+
+    parser = argparse.ArgumentParser(description="Check the accuracy and speed of a CPU inference profile "
+                                                 "against float32 inference.")
+    parser.add_argument("images", nargs="+", help="Test images.")
+    parser.add_argument("--profile", choices=sorted(INFERENCE_PROFILES), default="cpu-int8",
+                        help="Inference profile to check (default: cpu-int8).")
+    parser.add_argument("--model_type", choices=sorted(_ZOEDEPTH_MODELS.values()), default="ZoeD_N",
+                        help="ZoeDepth model (default: ZoeD_N).")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per image; the fastest counts (default: 3).")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads (default: $DEPTH_THREADS or torch's).")
+    args = parser.parse_args()
+
+    report = check_inference_profile([Image.open(path).convert("RGB") for path in args.images],
+                                     args.model_type, args.profile, args.repeat, args.threads)
+    for path, result in zip(args.images, report["images"]):
+        print(f"{path}: abs rel {result['abs_rel']:.4f}, max abs {result['max_abs']:.4f}, "
+              f"heightmap max error {result['heightmap_max_error']:.4f}, "
+              f"{result['heightmap_changed_pixels']:.1%} of 8-bit pixels changed, "
+              f"{result['reference_seconds']:.2f}s -> {result['profile_seconds']:.2f}s")
+    print(f"{report['profile']} ({report['threads']} threads): mean abs rel {report['abs_rel']:.4f}, "
+          f"heightmap max error {report['heightmap_max_error']:.4f}, speedup {report['speedup']:.2f}x")
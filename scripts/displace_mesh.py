@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Headless replacement for displace_top_face_with_texture.py, which needs Blender.
+
+Loads an STL or PLY mesh, selects its upward-facing triangles by normal, subdivides
+them into edges of about a target length, displaces the new vertices along Z
+with a heightmap (bilinearly sampled, mapped onto the XY bounding box of the selected
+faces, as in heightmap_to_3d) and colors them from a color texture. The result is
+written with the exporters of heightmap_to_3d (STL, PLY or GLB by extension):
+
+    python displace_mesh.py cube.stl heightmap.png relief.ply --color_texture color.png --target_edge_length 0.5
+"""
+import argparse
+import time
+
+import numpy as np
+from stl import mesh
+from PIL import Image
+
+from heightmap_to_3d import (
+    PLY_FORMATS, is_glb_path, modify_top_z, normalize_heightmap, open_heightmap, write_glb, write_ply, write_stl,
+)
+
+PLY_TYPES = {
+    "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4", "double": "f8", "float64": "f8",
+}
+
+def _read_ply_header(f):
+    if f.readline().strip() != b"ply":
+        raise ValueError("Not a PLY file.")
+    file_format = None
+    elements = []  # (name, count, [(property name, type, list count type or None)])
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError("PLY header has no end_header.")
+        parts = line.decode("ascii").split()
+        if not parts or parts[0] in ("comment", "obj_info"):
+            continue
+        if parts[0] == "end_header":
+            return file_format, elements
+        if parts[0] == "format":
+            file_format = parts[1]
+        elif parts[0] == "element":
+            elements.append((parts[1], int(parts[2]), []))
+        elif parts[0] == "property" and parts[1] == "list":
+            elements[-1][2].append((parts[4], PLY_TYPES[parts[3]], PLY_TYPES[parts[2]]))
+        elif parts[0] == "property":
+            elements[-1][2].append((parts[2], PLY_TYPES[parts[1]], None))
+
+def _read_ply_element(f, file_format, count, properties):
+    """Read one element as a structured array; list properties must all hold 3 items (triangles)."""
+    if file_format == "ascii":
+        rows = [f.readline().split() for _ in range(count)]
+        table = np.array(rows, dtype=np.float64).reshape(count, -1)
+        fields = {}
+        column = 0
+        for name, item_type, count_type in properties:
+            if count_type is None:
+                fields[name] = table[:, column].astype(item_type)
+                column += 1
+            else:
+                if not np.all(table[:, column] == 3):
+                    raise ValueError("Only triangle meshes are supported.")
+                fields[name] = table[:, column + 1:column + 4].astype(np.int64)
+                column += 4
+        return fields
+
+    order = {"binary_little_endian": "<", "binary_big_endian": ">"}.get(file_format)
+    if order is None:
+        raise ValueError(f"Unsupported PLY format: {file_format}")
+    dtype = []
+    for name, item_type, count_type in properties:
+        if count_type is None:
+            dtype.append((name, order + item_type))
+        else:
+            dtype.append((name + "_count", order + count_type))
+            dtype.append((name, order + item_type, (3,)))
+    data = np.frombuffer(f.read(np.dtype(dtype).itemsize * count), dtype=dtype, count=count)
+    fields = {}
+    for name, _, count_type in properties:
+        if count_type is not None and not np.all(data[name + "_count"] == 3):
+            raise ValueError("Only triangle meshes are supported.")
+        fields[name] = data[name]
+    return fields
+
+def read_ply(filename):
+    """
+    Read a triangle mesh from an ASCII or binary PLY file, such as those written by write_ply.
+
+    :return: Tuple (vertices, faces, vertex_colors): (N, 3) float32 positions, (F, 3) int64
+             indices, and (N, 3) uint8 colors or None if the file has none.
+    """
+    with open(filename, "rb") as f:
+        file_format, elements = _read_ply_header(f)
+        vertices = faces = colors = None
+        for name, count, properties in elements:
+            fields = _read_ply_element(f, file_format, count, properties)
+            if name == "vertex":
+                vertices = np.stack([fields["x"], fields["y"], fields["z"]], axis=1).astype(np.float32)
+                if all(channel in fields for channel in ("red", "green", "blue")):
+                    colors = np.stack([fields["red"], fields["green"], fields["blue"]], axis=1).astype(np.uint8)
+            elif name == "face":
+                faces = np.asarray(fields.get("vertex_indices", fields.get("vertex_index")), dtype=np.int64)
+    if vertices is None or faces is None:
+        raise ValueError("PLY file has no vertex or face element.")
+    return vertices, faces, colors
+
+def read_mesh(filename):
+    """
+    Read an STL or PLY triangle mesh as indexed vertices and faces.
+
+    STL triangles are welded on exactly equal coordinates, so that neighbouring
+    faces share vertices.
+
+    :return: Tuple (vertices, faces, vertex_colors), see read_ply.
+    """
+    if filename.lower().endswith(".ply"):
+        return read_ply(filename)
+    corners = mesh.Mesh.from_file(filename).vectors.reshape(-1, 3)
+    vertices, inverse = np.unique(corners, axis=0, return_inverse=True)
+    return vertices.astype(np.float32), inverse.reshape(-1, 3).astype(np.int64), None
+
+def face_normals(vertices, faces):
+    """Unit normals of the triangles (zero for degenerate ones)."""
+    corners = vertices[faces].astype(np.float64)
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    return np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+
+def select_upward_faces(vertices, faces, max_angle=10.0):
+    """Boolean mask of the faces whose normal is within max_angle degrees of +Z."""
+    return face_normals(vertices, faces)[:, 2] >= np.cos(np.radians(max_angle))
+
+def _lattice(n):
+    """
+    Barycentric lattice of a triangle split into n * n triangles.
+
+    :return: Tuple (points, triangles): (P, 2) integer (i, j) coordinates, where a point
+             is A + i/n (B - A) + j/n (C - A), and (n * n, 3) triangles indexing points,
+             wound like (A, B, C).
+    """
+    j = np.repeat(np.arange(n + 1), np.arange(n + 1, 0, -1))
+    row_start = j * (n + 1) - j * (j - 1) // 2  # index of point (0, j)
+    i = np.arange(len(j)) - row_start
+    index = lambda i, j: j * (n + 1) - j * (j - 1) // 2 + i
+
+    up = i + j < n
+    down = i + j < n - 1
+    triangles = np.concatenate([
+        np.stack([index(i[up], j[up]), index(i[up] + 1, j[up]), index(i[up], j[up] + 1)], axis=1),
+        np.stack([index(i[down] + 1, j[down]), index(i[down] + 1, j[down] + 1), index(i[down], j[down] + 1)], axis=1),
+    ])
+    return np.stack([i, j], axis=1), triangles.astype(np.int64)
+
+def _edge_keys(a, b, num_vertices):
+    return np.minimum(a, b) * num_vertices + np.maximum(a, b)
+
+def subdivide_faces(vertices, faces, selected, target_edge_length):
+    """
+    Split the selected triangles into edges of about target_edge_length, keeping the mesh
+    watertight.
+
+    Every edge of the selection is split into its own number of segments, set by its
+    length, and every selected triangle into n * n triangles with n set by its own
+    longest edge, so the output grows with the selected area rather than with the
+    largest face. Lattice points on a triangle's sides are snapped to the nearest points
+    of those edges, which neighbouring triangles share; snapped triangles that collapse
+    are dropped. Edge splits and the lattice stay within target_edge_length, and edges
+    moved by the snapping within twice that. Unselected triangles bordering the selection are fanned around their
+    centroid through the new points on their split edges, which avoids T-junctions
+    (and cracks once the selection is displaced).
+
+    :return: Tuple (vertices, faces, region): the new mesh, and a boolean mask of the vertices
+             of the subdivided region (including its boundary).
+    """
+    num_vertices = len(vertices)
+    selected_faces = faces[selected]
+    region = np.zeros(num_vertices, dtype=bool)
+    region[selected_faces] = True
+    if target_edge_length <= 0 or not len(selected_faces):
+        return vertices, faces, region
+
+    # Unique edges of the selection, each split into segments of at most target_edge_length.
+    a, b, c = selected_faces.T
+    edges = np.concatenate([np.stack([a, b], 1), np.stack([b, c], 1), np.stack([c, a], 1)])
+    edges.sort(axis=1)
+    edge_keys, edge_index = np.unique(_edge_keys(edges[:, 0], edges[:, 1], num_vertices), return_inverse=True)
+    unique_edges = np.stack([edge_keys // num_vertices, edge_keys % num_vertices], axis=1)
+    starts, ends = vertices[unique_edges[:, 0]].astype(np.float64), vertices[unique_edges[:, 1]].astype(np.float64)
+    segments = np.maximum(1, np.ceil(np.linalg.norm(ends - starts, axis=1) / target_edge_length)).astype(np.int64)
+    if segments.max() == 1:
+        return vertices, faces, region
+
+    # Points on the edges: segments - 1 per unique edge, numbered from the lower vertex index.
+    edge_base = num_vertices
+    edge_offsets = edge_base + np.concatenate(([0], np.cumsum(segments - 1)[:-1]))
+    point_edges = np.repeat(np.arange(len(segments)), segments - 1)
+    point_steps = np.arange(len(point_edges)) - (edge_offsets - edge_base)[point_edges] + 1
+    t = (point_steps / segments[point_edges])[:, np.newaxis]
+    edge_points = starts[point_edges] + (ends - starts)[point_edges] * t
+
+    def edge_point_ids(start, end, edge_ids, q):
+        # Global id of point q (0..segments) along each edge, counted from its start vertex.
+        m = segments[edge_ids]
+        from_lower = start < end
+        position = np.where(from_lower, q, m - q)
+        lower, upper = np.minimum(start, end), np.maximum(start, end)
+        return np.where(position == 0, lower,
+                        np.where(position == m, upper, edge_offsets[edge_ids] + position - 1))
+
+    # Points inside the triangles, grouped by the triangle's n so each group is one lattice.
+    num_selected = len(selected_faces)
+    ab, bc, ca = (edge_index[k * num_selected:(k + 1) * num_selected] for k in range(3))
+    face_n = np.maximum(np.maximum(segments[ab], segments[bc]), segments[ca])
+    interior_base = edge_base + len(edge_points)
+    interior_chunks, new_selected_faces = [], []
+    for n in np.unique(face_n):
+        group = np.flatnonzero(face_n == n)
+        ga, gb, gc = a[group, np.newaxis], b[group, np.newaxis], c[group, np.newaxis]
+        points, triangles = _lattice(n)
+        i, j = points[:, 0], points[:, 1]
+        interior = (i > 0) & (j > 0) & (i + j < n)
+        weights = np.stack([n - i - j, i, j], axis=1)[interior] / n
+        interior_points = np.einsum("pk,fkd->fpd", weights, vertices[selected_faces[group]].astype(np.float64))
+
+        def snap(k, edge_ids):
+            # Lattice step k (0..n) along a side to the nearest of its edge's own points.
+            return np.floor(k * segments[edge_ids] / n + 0.5).astype(np.int64)
+
+        ids = np.empty((len(group), len(points)), dtype=np.int64)
+        on_ab = j == 0  # i steps from A
+        ids[:, on_ab] = edge_point_ids(ga, gb, ab[group, np.newaxis], snap(i[on_ab], ab[group, np.newaxis]))
+        on_bc = (i + j == n) & (j > 0)  # j steps from B
+        ids[:, on_bc] = edge_point_ids(gb, gc, bc[group, np.newaxis], snap(j[on_bc], bc[group, np.newaxis]))
+        on_ca = (i == 0) & (j > 0) & (j < n)  # n - j steps from C
+        ids[:, on_ca] = edge_point_ids(gc, ga, ca[group, np.newaxis], snap(n - j[on_ca], ca[group, np.newaxis]))
+        ids[:, interior] = interior_base + np.arange(interior_points.shape[0] * interior_points.shape[1]).reshape(len(group), -1)
+        interior_base += interior_points.shape[0] * interior_points.shape[1]
+        interior_chunks.append(interior_points.reshape(-1, 3))
+
+        group_faces = ids[:, triangles].reshape(-1, 3)
+        collapsed = ((group_faces[:, 0] == group_faces[:, 1]) | (group_faces[:, 1] == group_faces[:, 2])
+                     | (group_faces[:, 2] == group_faces[:, 0]))
+        new_selected_faces.append(group_faces[~collapsed])
+    interior_points = np.concatenate(interior_chunks)
+
+    # Unselected faces sharing an edge with the selection: fan around a new centroid vertex.
+    other_faces = faces[~selected]
+    oa, ob, oc = other_faces.T
+    width = segments.max()
+    steps = np.arange(width)
+    chains = []
+    split = np.zeros(len(other_faces), dtype=bool)
+    for start, end in ((oa, ob), (ob, oc), (oc, oa)):
+        keys = _edge_keys(start, end, num_vertices)
+        position = np.searchsorted(edge_keys, keys).clip(max=len(edge_keys) - 1)
+        found = edge_keys[position] == keys
+        split |= found
+        # Start vertex, then the edge's points in order; shorter chains repeat the start vertex.
+        chain = np.repeat(start[:, np.newaxis], width, axis=1)
+        edge_ids = position[found, np.newaxis]
+        q = np.maximum(steps - (width - segments[edge_ids]), 0)
+        chain[found] = edge_point_ids(start[found, np.newaxis], end[found, np.newaxis], edge_ids, q)
+        chains.append(chain)
+    chain = np.concatenate(chains, axis=1)[split]
+    centroid_base = interior_base
+    centroids = vertices[other_faces[split]].astype(np.float64).mean(axis=1)
+    centroid_ids = centroid_base + np.arange(len(chain))
+    fan = np.stack([chain, np.roll(chain, -1, axis=1), np.repeat(centroid_ids[:, np.newaxis], chain.shape[1], axis=1)], axis=2)
+    fan = fan.reshape(-1, 3)
+    fan = fan[fan[:, 0] != fan[:, 1]]
+
+    new_vertices = np.concatenate([
+        vertices.astype(np.float32),
+        edge_points.astype(np.float32),
+        interior_points.astype(np.float32),
+        centroids.astype(np.float32),
+    ])
+    new_faces = np.concatenate([other_faces[~split], fan] + new_selected_faces)
+    region = np.concatenate([region, np.ones(centroid_base - num_vertices, dtype=bool),
+                             np.zeros(len(centroids), dtype=bool)])
+    return new_vertices, new_faces, region
+
+def sample_bilinear(image, x, y):
+    """
+    Sample an (H, W) or (H, W, C) image at fractional pixel coordinates, vectorized.
+
+    :param x: Column coordinates in [0, W - 1] (clipped).
+    :param y: Row coordinates in [0, H - 1] (clipped).
+    :return: float32 array of shape x.shape (+ (C,)).
+    """
+    height, width = image.shape[:2]
+    x = np.clip(np.asarray(x, dtype=np.float64), 0, width - 1)
+    y = np.clip(np.asarray(y, dtype=np.float64), 0, height - 1)
+    x0 = np.minimum(x.astype(np.int64), max(width - 2, 0))
+    y0 = np.minimum(y.astype(np.int64), max(height - 2, 0))
+    x1 = np.minimum(x0 + 1, width - 1)
+    y1 = np.minimum(y0 + 1, height - 1)
+    fx, fy = x - x0, y - y0
+    if image.ndim == 3:
+        fx, fy = fx[:, np.newaxis], fy[:, np.newaxis]
+    top = image[y0, x0] * (1 - fx) + image[y0, x1] * fx
+    bottom = image[y1, x0] * (1 - fx) + image[y1, x1] * fx
+    return (top * (1 - fy) + bottom * fy).astype(np.float32)
+
+def displace_mesh(input_path, heightmap_path, output_path, color_texture=None, target_edge_length=1.0,
+                  depth=5.0, mode="protrude", invert=False, max_angle=10.0, ply_format="binary",
+                  quantize=False, bottom_color=(200, 200, 200)):
+    """
+    Displace the upward-facing surface of an existing mesh with a heightmap.
+
+    The heightmap (and color texture) is stretched over the XY bounding box of the selected
+    faces: column 0 at the lowest X and row 0 at the lowest Y, as in heightmap_to_3d.
+
+    :param input_path: STL or PLY mesh.
+    :param heightmap_path: Grayscale image, 16-bit PNG or 2D .npy heightmap (see open_heightmap).
+    :param output_path: .stl, .ply or .glb output; STL has no vertex colors.
+    :param color_texture: Optional color image applied to the displaced surface as vertex colors.
+    :param target_edge_length: Edge length of the subdivided surface, in model units (see subdivide_faces).
+    :param depth: Displacement of a white pixel, in model units.
+    :param mode: 'protrude' (raise) or 'carve' (lower), as in modify_top_z.
+    :param max_angle: Faces whose normal is within this many degrees of +Z are displaced.
+    :param bottom_color: Color of the vertices outside the displaced surface, unless the input has colors.
+    :return: Dict with "vertices", "triangles", "selected_faces" and "seconds".
+    """
+    start = time.perf_counter()
+    vertices, faces, vertex_colors = read_mesh(input_path)
+    selected = select_upward_faces(vertices, faces, max_angle)
+    if not selected.any():
+        raise ValueError(f"No faces within {max_angle} degrees of +Z in {input_path}.")
+
+    num_input_vertices = len(vertices)
+    vertices, faces, region = subdivide_faces(vertices, faces, selected, target_edge_length)
+
+    # Map the region's XY bounding box onto the heightmap's pixel grid.
+    region_xy = vertices[region, :2].astype(np.float64)
+    low = region_xy.min(axis=0)
+    extent = region_xy.max(axis=0) - low
+    uv = (region_xy - low) / np.where(extent > 0, extent, 1.0)
+
+    pixels = normalize_heightmap(open_heightmap(heightmap_path), invert)
+    heights = sample_bilinear(pixels, uv[:, 0] * (pixels.shape[1] - 1), uv[:, 1] * (pixels.shape[0] - 1))
+    vertices[region, 2] = modify_top_z(vertices[region, 2], heights, depth, mode)
+
+    if color_texture is not None or vertex_colors is not None:
+        colors = np.empty((len(vertices), 3), dtype=np.uint8)
+        colors[:] = np.asarray(bottom_color, dtype=np.uint8)
+        if vertex_colors is not None:
+            colors[:num_input_vertices] = vertex_colors
+        if color_texture is not None:
+            texture = np.asarray(Image.open(color_texture).convert("RGB"), dtype=np.float32)
+            sampled = sample_bilinear(texture, uv[:, 0] * (texture.shape[1] - 1), uv[:, 1] * (texture.shape[0] - 1))
+            colors[region] = np.clip(np.rint(sampled), 0, 255).astype(np.uint8)
+        vertex_colors = colors
+
+    if is_glb_path(output_path):
+        write_glb(output_path, vertices, faces, vertex_colors, quantize=quantize)
+    elif output_path.lower().endswith(".ply"):
+        if vertex_colors is None:
+            vertex_colors = np.broadcast_to(np.asarray(bottom_color, dtype=np.uint8), vertices.shape)
+        write_ply(output_path, vertices, faces, vertex_colors, ply_format)
+    else:
+        write_stl(output_path, vertices, faces)
+    seconds = time.perf_counter() - start
+    print(f"Displaced {int(selected.sum())} faces into {len(faces)} triangles in {seconds:.2f}s, "
+          f"saved model to: {output_path}")
+    return {"vertices": len(vertices), "triangles": len(faces), "selected_faces": int(selected.sum()),
+            "seconds": seconds}
+
+def main():
+    parser = argparse.ArgumentParser(description="Displace the top surface of an STL/PLY mesh with a heightmap, without Blender.")
+    parser.add_argument("input_mesh", type=str, help="Input STL or PLY mesh.")
+    parser.add_argument("heightmap", type=str, help="Heightmap image, 16-bit PNG or .npy.")
+    parser.add_argument("output", type=str, help="Output .stl, .ply or .glb file.")
+    parser.add_argument("--color_texture", type=str, default=None, help="Color image applied as vertex colors.")
+    parser.add_argument("--target_edge_length", type=float, default=1.0,
+                        help="Edge length of the subdivided top surface, in model units (default: 1.0).")
+    parser.add_argument("--depth", type=float, default=5.0, help="Displacement of a white pixel (default: 5.0).")
+    parser.add_argument("--mode", choices=["protrude", "carve"], default="protrude", help="Raise or lower the surface.")
+    parser.add_argument("--invert", action="store_true", help="Invert the heightmap.")
+    parser.add_argument("--max_angle", type=float, default=10.0,
+                        help="Displace faces whose normal is within this many degrees of +Z (default: 10).")
+    parser.add_argument("--ply_format", choices=PLY_FORMATS, default="binary", help="PLY encoding (default: binary).")
+    parser.add_argument("--quantize", action="store_true", help="Quantize GLB vertex attributes.")
+    args = parser.parse_args()
+
+    displace_mesh(args.input_mesh, args.heightmap, args.output, color_texture=args.color_texture,
+                  target_edge_length=args.target_edge_length, depth=args.depth, mode=args.mode,
+                  invert=args.invert, max_angle=args.max_angle, ply_format=args.ply_format,
+                  quantize=args.quantize)
+
+if __name__ == "__main__":
+    main()
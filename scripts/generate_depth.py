@@ -1,40 +1,351 @@
-import torch
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import argparse
 import numpy as np
-import matplotlib
+from depth_models import available_depth_models, get_depth_model, infer_batch
+from image_files import list_images, prefetch_map
+from timing import span
 
-# Load ZoeDepth model using Torch Hub
-repo = "isl-org/ZoeDepth"
-model_zoe_n = torch.hub.load(repo, "ZoeD_N", pretrained=True)
-
-# Set the device
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-model_zoe_n = model_zoe_n.to(DEVICE)
-
-def get_grayscale_depth(image_path, output_path):
+def get_grayscale_depth(image_path, output_path, model_name=None, tile_size=None, tile_overlap=64,
+                        sidecar_path=None):
     """
     Get the grayscale depth of an image, invert it, and save it to a file.
 
     Args:
         image_path (str): Path to the input image.
         output_path (str): Path to save the inverted grayscale depth image.
+        model_name (str, optional): Depth model from the registry in depth_models.
+            Defaults to DEFAULT_DEPTH_MODEL; the model is loaded on first use.
+        tile_size (int, optional): If set, infer the image in overlapping tiles of at most
+            tile_size x tile_size pixels (see infer_depth_tiled). Defaults to None (whole image).
+        tile_overlap (int): Overlap between neighbouring tiles, in pixels.
+        sidecar_path (str, optional): Also save the heightmap without 8-bit quantization, as
+            float32 .npy or 16-bit .png (see save_depth_sidecar). Defaults to None.
     """
     # Load the image
-    image = Image.open(image_path).convert("RGB")
+    with span("depth.decode"):
+        image = Image.open(image_path).convert("RGB")
 
-    # Infer depth using ZoeDepth model
-    depth_tensor = model_zoe_n.infer_pil(image, output_type="tensor")
+    # Infer depth and save the inverted grayscale depth image
+    depth = infer_depth(image, model_name=model_name, tile_size=tile_size, tile_overlap=tile_overlap)
+    with span("depth.heightmap"):
+        heightmap = depth_to_heightmap(depth)
+    with span("depth.save"):
+        Image.fromarray(heightmap, mode="L").save(output_path)
+    print(f"Inverted grayscale depth image saved at {output_path}")
+    if sidecar_path is not None:
+        with span("depth.sidecar"):
+            save_depth_sidecar(depth_to_float_heightmap(depth), sidecar_path)
+        print(f"High-precision heightmap saved at {sidecar_path}")
 
-    # Colorize the depth map in grayscale
-    grayscale_depth = colorize(depth_tensor, cmap="gray")
+def get_heightmap(image, model_name=None, tile_size=None, tile_overlap=64, high_precision=False):
+    """
+    In-memory variant of get_grayscale_depth: infer the depth of a decoded image and
+    return the inverted grayscale heightmap as an array instead of saving it.
 
-    # Invert the grayscale depth
-    inverted_depth = 255 - grayscale_depth  # Invert grayscale values
+    Args:
+        image (PIL.Image.Image): RGB input image.
+        model_name (str, optional): Depth model from the registry in depth_models.
+        tile_size (int, optional): Tile size for infer_depth_tiled. Defaults to None (whole image).
+        tile_overlap (int): Overlap between neighbouring tiles, in pixels.
+        high_precision (bool): Return the float32 heightmap of depth_to_float_heightmap
+            instead of the 8-bit one. Defaults to False.
 
-    # Save the inverted grayscale depth image
-    Image.fromarray(inverted_depth[:, :, :3]).save(output_path)
-    print(f"Inverted grayscale depth image saved at {output_path}")
+    Returns:
+        numpy.ndarray, dtype - uint8: Heightmap, identical to the saved image, or float32 in
+            [0, 1] if high_precision is set. Shape: (H, W)
+    """
+    depth = infer_depth(image, model_name=model_name, tile_size=tile_size, tile_overlap=tile_overlap)
+    with span("depth.heightmap"):
+        return depth_to_float_heightmap(depth) if high_precision else depth_to_heightmap(depth)
+
+def infer_depth(image, model_name=None, tile_size=None, tile_overlap=64):
+    """
+    Infer the raw depth of a decoded image, whole or in tiles.
+
+    Args:
+        image (PIL.Image.Image): RGB input image.
+        model_name (str, optional): Depth model from the registry in depth_models.
+        tile_size (int, optional): Tile size for infer_depth_tiled. Defaults to None (whole image).
+        tile_overlap (int): Overlap between neighbouring tiles, in pixels.
+
+    Returns:
+        torch.Tensor, numpy.ndarray: Depth map as returned by the depth model.
+    """
+    # Infer depth using the (lazily loaded, shared) depth model
+    with span("depth.load_model"):
+        model = get_depth_model(model_name)
+    with span("depth.infer"):
+        if tile_size is None:
+            depth_tensor = model.infer_pil(image, output_type="tensor")
+        else:
+            depth_tensor, stats = infer_depth_tiled(image, model, tile_size=tile_size, overlap=tile_overlap)
+            tile_seconds = [tile["seconds"] for tile in stats["tiles"]]
+            print(f"Inferred {len(tile_seconds)} tiles in {sum(tile_seconds):.2f}s "
+                  f"(max {max(tile_seconds):.2f}s per tile, peak RSS {stats['peak_rss_mb']} MB)")
+    return depth_tensor
+
+def _tile_starts(length, tile_size, overlap):
+    """Start offsets of tiles covering [0, length), the last one aligned to the end."""
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, tile_size - overlap))
+    return starts + [length - tile_size]
+
+def _feather(length, overlap, ramp_start, ramp_end):
+    """1D blend weights: linear ramps over overlap pixels at the tile's inner edges."""
+    weights = np.ones(length, dtype=np.float32)
+    if not overlap:
+        # Abutting tiles: no ramp, and weights[-0:] would select the whole array.
+        return weights
+    ramp = np.linspace(0.0, 1.0, overlap + 2, dtype=np.float32)[1:-1]
+    if ramp_start:
+        weights[:overlap] = ramp
+    if ramp_end:
+        weights[-overlap:] = np.minimum(weights[-overlap:], ramp[::-1])
+    return weights
+
+def _peak_rss_mb():
+    """Peak resident memory of this process in MB, or None where unavailable."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def infer_depth_tiled(image, model, tile_size=512, overlap=64):
+    """
+    Infer depth for a large image tile by tile, keeping model memory bounded by the tile size.
+
+    Tiles overlap by overlap pixels and are processed in raster order. Each tile's depth is
+    aligned to the depth already blended in its overlap with earlier tiles by a least-squares
+    scale and shift, then feather-blended in with linear weights ramping across the overlap.
+
+    Args:
+        image (PIL.Image.Image): RGB input image.
+        model: Depth model exposing infer_pil(image, output_type="tensor").
+        tile_size (int): Maximum tile width and height, in pixels.
+        overlap (int): Overlap between neighbouring tiles, in pixels.
+
+    Returns:
+        tuple[numpy.ndarray, dict]: The (H, W) float32 depth map, and stats with one
+        {"box", "seconds", "scale", "shift"} entry per tile under "tiles" and the
+        process's peak resident memory under "peak_rss_mb".
+    """
+    if not 0 <= overlap < tile_size:
+        raise ValueError("Tile overlap must be non-negative and smaller than the tile size.")
+    width, height = image.size
+    depth_sum = np.zeros((height, width), dtype=np.float32)
+    weight_sum = np.zeros((height, width), dtype=np.float32)
+    tiles = []
+
+    for y0 in _tile_starts(height, tile_size, overlap):
+        for x0 in _tile_starts(width, tile_size, overlap):
+            x1, y1 = min(x0 + tile_size, width), min(y0 + tile_size, height)
+            start = time.perf_counter()
+            depth = model.infer_pil(image.crop((x0, y0, x1, y1)), output_type="tensor")
+            if not isinstance(depth, np.ndarray):
+                depth = depth.detach().cpu().numpy()  # torch.Tensor
+            depth = np.asarray(depth, dtype=np.float32).squeeze()
+            seconds = time.perf_counter() - start
+
+            # Align scale and shift to the depth already blended in the overlap.
+            scale, shift = 1.0, 0.0
+            blended = weight_sum[y0:y1, x0:x1] > 0
+            if blended.sum() >= 2:
+                reference = depth_sum[y0:y1, x0:x1][blended] / weight_sum[y0:y1, x0:x1][blended]
+                tile_values = depth[blended]
+                if np.ptp(tile_values) > 0:
+                    design = np.stack([tile_values, np.ones_like(tile_values)], axis=1)
+                    (scale, shift), *_ = np.linalg.lstsq(design, reference, rcond=None)
+                    depth = scale * depth + shift
+
+            weights = np.outer(_feather(y1 - y0, overlap, y0 > 0, y1 < height),
+                               _feather(x1 - x0, overlap, x0 > 0, x1 < width))
+            depth_sum[y0:y1, x0:x1] += weights * depth
+            weight_sum[y0:y1, x0:x1] += weights
+            tiles.append({"box": (x0, y0, x1, y1), "seconds": seconds,
+                          "scale": float(scale), "shift": float(shift)})
+
+    depth_sum /= weight_sum
+    return depth_sum, {"tiles": tiles, "peak_rss_mb": _peak_rss_mb()}
+
+# matplotlib's 256-entry "gray" colormap as bytes, inverted, so the heightmap needs no matplotlib.
+INVERTED_GRAY_LUT = 255 - (np.linspace(0.0, 1.0, 256) * 255).astype(np.uint8)
+
+def _scale_depth(depth, vmin, vmax, invalid_val, invalid_mask):
+    """Depth as float32 scaled so that vmin maps to 0 and vmax to 1 (not clipped), and the invalid mask."""
+    if not isinstance(depth, np.ndarray):
+        depth = depth.detach().cpu().numpy()  # torch.Tensor
+    depth = depth.squeeze()
+    if invalid_mask is None:
+        invalid_mask = depth == invalid_val
+
+    if vmin is None or vmax is None:
+        valid = depth[~invalid_mask]  # a copy, so it can be partitioned in place
+        vmin = np.percentile(valid, 2, overwrite_input=True) if vmin is None else vmin
+        vmax = np.percentile(valid, 85, overwrite_input=True) if vmax is None else vmax
+        del valid
+
+    scaled = np.subtract(depth, vmin, dtype=np.float32)
+    if vmin != vmax:
+        scaled /= vmax - vmin
+    else:
+        # Avoid 0-division
+        scaled *= 0.
+    return scaled, invalid_mask
+
+def depth_to_heightmap(depth, vmin=None, vmax=None, invalid_val=-99, invalid_mask=None, background_value=128):
+    """Converts a depth map to an inverted single-channel heightmap.
+
+    Gives the same values as 255 - colorize(depth, cmap="gray")[..., 0] without going through
+    matplotlib or RGBA: percentiles are computed in place on a single copy of the valid depths,
+    scaling is done in place in float32, and the inversion is folded into the lookup table.
+
+    Args:
+        depth (torch.Tensor, numpy.ndarray): Depth map. All singular dimensions are squeezed.
+        vmin (float, optional): Depth mapped to white. Defaults to the 2nd percentile.
+        vmax (float, optional): Depth mapped to black. Defaults to the 85th percentile.
+        invalid_val (int, optional): Value of invalid pixels. Defaults to -99.
+        invalid_mask (numpy.ndarray, optional): Boolean mask for invalid regions. Defaults to None.
+        background_value (int, optional): Gray level given to invalid pixels before inversion. Defaults to 128.
+
+    Returns:
+        numpy.ndarray, dtype - uint8: Heightmap. Shape: (H, W)
+    """
+    scaled, invalid_mask = _scale_depth(depth, vmin, vmax, invalid_val, invalid_mask)
+    scaled *= INVERTED_GRAY_LUT.size
+    np.clip(scaled, 0, INVERTED_GRAY_LUT.size - 1, out=scaled)
+
+    heightmap = INVERTED_GRAY_LUT[scaled.astype(np.uint8)]
+    heightmap[invalid_mask] = 255 - background_value
+    return heightmap
+
+def depth_to_float_heightmap(depth, vmin=None, vmax=None, invalid_val=-99, invalid_mask=None, background_value=128):
+    """Converts a depth map to an inverted float32 heightmap in [0, 1], without 8-bit quantization.
+
+    Uses the same scaling and percentiles as depth_to_heightmap, which quantizes the result
+    to 256 levels; without that, deep reliefs built from the heightmap show no terracing.
+
+    Args:
+        depth (torch.Tensor, numpy.ndarray): Depth map. All singular dimensions are squeezed.
+        vmin (float, optional): Depth mapped to 1 (white). Defaults to the 2nd percentile.
+        vmax (float, optional): Depth mapped to 0 (black). Defaults to the 85th percentile.
+        invalid_val (int, optional): Value of invalid pixels. Defaults to -99.
+        invalid_mask (numpy.ndarray, optional): Boolean mask for invalid regions. Defaults to None.
+        background_value (int, optional): Gray level (0-255) given to invalid pixels before inversion. Defaults to 128.
+
+    Returns:
+        numpy.ndarray, dtype - float32: Heightmap. Shape: (H, W)
+    """
+    scaled, invalid_mask = _scale_depth(depth, vmin, vmax, invalid_val, invalid_mask)
+    np.clip(scaled, 0.0, 1.0, out=scaled)
+    np.subtract(1.0, scaled, out=scaled)
+    scaled[invalid_mask] = 1.0 - background_value / 255.0
+    return scaled
+
+def save_depth_sidecar(heightmap, output_path):
+    """
+    Save a float heightmap in [0, 1] without 8-bit quantization, for heightmap_to_3d.
+
+    Args:
+        heightmap (numpy.ndarray): Float heightmap, e.g. from depth_to_float_heightmap.
+        output_path (str): A .npy path for raw float32 values, which heightmap_to_3d memory-maps,
+            or a .png path for a 16-bit grayscale image.
+    """
+    if output_path.lower().endswith(".npy"):
+        np.save(output_path, np.asarray(heightmap, dtype=np.float32))
+    elif output_path.lower().endswith(".png"):
+        levels = np.rint(np.asarray(heightmap, dtype=np.float32) * 65535.0).astype(np.uint16)
+        Image.fromarray(levels).save(output_path)
+    else:
+        raise ValueError(f"Unsupported sidecar format (expected .npy or .png): {output_path}")
+
+def save_grayscale_depth(depth, output_path):
+    """
+    Convert a depth map to an inverted grayscale heightmap and save it as a single-channel image.
+
+    Args:
+        depth (torch.Tensor, numpy.ndarray): Depth map as returned by the depth model.
+        output_path (str): Path to save the inverted grayscale depth image.
+    """
+    Image.fromarray(depth_to_heightmap(depth), mode="L").save(output_path)
+
+def get_grayscale_depth_batch(images, output_dir, model_name=None, batch_size=8, num_workers=4, resize=None):
+    """
+    Get the inverted grayscale depth of many images, batching the depth model's forward passes.
+
+    Images are decoded (and optionally resized) on a background thread pool while
+    earlier batches run through the model. They are grouped by resolution, and each
+    group of batch_size images is inferred in one forward pass. Heightmaps are encoded
+    and saved on the same pool as soon as their batch completes, to
+    output_dir/depth_<image name>, and match those of get_grayscale_depth.
+
+    Args:
+        images (str, list[str]): Directory of images, or a list of image paths.
+        output_dir (str): Directory to save the inverted grayscale depth images in.
+        model_name (str, optional): Depth model from the registry in depth_models.
+        batch_size (int): Maximum number of images per forward pass.
+        num_workers (int): Threads used for decoding and saving.
+        resize (tuple[int, int], optional): (width, height) every image is resized to
+            before inference, so that they all share batches. Defaults to None (no resizing).
+
+    Returns:
+        dict: Throughput stats: "images", "batches", "seconds" and "images_per_second".
+    """
+    image_paths = list_images(images) if isinstance(images, str) else list(images)
+    os.makedirs(output_dir, exist_ok=True)
+    model = get_depth_model(model_name)
+
+    def decode(path):
+        image = Image.open(path).convert("RGB")
+        if resize is not None:
+            image = image.resize(resize, Image.BICUBIC)
+        return path, image
+
+    def output_path_for(path):
+        return os.path.join(output_dir, "depth_" + os.path.basename(path))
+
+    start = time.perf_counter()
+    num_batches = 0
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        saves = []
+        groups = {}
+
+        def run_batch(batch):
+            paths, batch_images = zip(*batch)
+            for path, depth in zip(paths, infer_batch(model, batch_images)):
+                saves.append(pool.submit(save_grayscale_depth, depth, output_path_for(path)))
+
+        # Decode a bounded number of images ahead of the model.
+        prefetch = max(batch_size, num_workers) * 2
+        for path, image in prefetch_map(pool, decode, image_paths, prefetch):
+            group = groups.setdefault(image.size, [])
+            group.append((path, image))
+            if len(group) == batch_size:
+                run_batch(groups.pop(image.size))
+                num_batches += 1
+        for group in groups.values():
+            run_batch(group)
+            num_batches += 1
+        for save in saves:
+            save.result()
+
+    seconds = time.perf_counter() - start
+    stats = {
+        "images": len(image_paths),
+        "batches": num_batches,
+        "seconds": seconds,
+        "images_per_second": len(image_paths) / seconds if seconds > 0 else 0.0,
+    }
+    print(f"Saved {stats['images']} inverted grayscale depth images to {output_dir} "
+          f"in {seconds:.2f}s ({stats['images_per_second']:.2f} images/s)")
+    return stats
 
 def colorize(value, vmin=None, vmax=None, cmap='gray_r', invalid_val=-99, invalid_mask=None, background_color=(128, 128, 128, 255), gamma_corrected=False, value_transform=None):
     """Converts a depth map to a color image.
@@ -53,8 +364,8 @@ def colorize(value, vmin=None, vmax=None, cmap='gray_r', invalid_val=-99, invali
     Returns:
         numpy.ndarray, dtype - uint8: Colored depth map. Shape: (H, W, 4)
     """
-    if isinstance(value, torch.Tensor):
-        value = value.detach().cpu().numpy()
+    if not isinstance(value, np.ndarray):
+        value = value.detach().cpu().numpy()  # torch.Tensor
 
     value = value.squeeze()
     if invalid_mask is None:
@@ -74,7 +385,8 @@ def colorize(value, vmin=None, vmax=None, cmap='gray_r', invalid_val=-99, invali
     # grey out the invalid values
 
     value[invalid_mask] = np.nan
-    cmapper = matplotlib.cm.get_cmap(cmap)
+    import matplotlib  # only needed for real colormaps; see depth_to_heightmap for grayscale
+    cmapper = matplotlib.colormaps[cmap]
     if value_transform:
         value = value_transform(value)
         # value = value / value.max()
@@ -96,9 +408,26 @@ def colorize(value, vmin=None, vmax=None, cmap='gray_r', invalid_val=-99, invali
 if __name__ == "__main__":
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description="Generate inverted grayscale depth map from an image.")
-    parser.add_argument("input_path", type=str, help="Path to the input image.")
-    parser.add_argument("output_path", type=str, help="Path to save the inverted grayscale depth image.")
+    parser.add_argument("input_path", type=str, help="Path to the input image, or a directory of images.")
+    parser.add_argument("output_path", type=str,
+                        help="Path to save the inverted grayscale depth image (a directory if input_path is one).")
+    parser.add_argument("--model", choices=available_depth_models(), default=None,
+                        help="Depth model to use (default: $DEPTH_MODEL or zoedepth-n).")
+    parser.add_argument("--batch_size", type=int, default=8, help="Images per forward pass for directories (default: 8).")
+    parser.add_argument("--workers", type=int, default=4, help="Decode/save threads for directories (default: 4).")
+    parser.add_argument("--tile_size", type=int, default=None,
+                        help="Infer single images in overlapping tiles of this size to bound memory.")
+    parser.add_argument("--tile_overlap", type=int, default=64, help="Overlap between tiles in pixels (default: 64).")
+    parser.add_argument("--sidecar_path", type=str, default=None,
+                        help="For single images, also save the heightmap without 8-bit quantization, "
+                             "as float32 .npy or 16-bit .png.")
     args = parser.parse_args()
 
     # Run the function with provided arguments
-    get_grayscale_depth(args.input_path, args.output_path)
+    if os.path.isdir(args.input_path):
+        get_grayscale_depth_batch(args.input_path, args.output_path, model_name=args.model,
+                                  batch_size=args.batch_size, num_workers=args.workers)
+    else:
+        get_grayscale_depth(args.input_path, args.output_path, model_name=args.model,
+                            tile_size=args.tile_size, tile_overlap=args.tile_overlap,
+                            sidecar_path=args.sidecar_path)
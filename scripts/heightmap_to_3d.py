@@ -1,40 +1,189 @@
 #!/usr/bin/env python3
 import argparse
+import json
+import os
+import time
+from functools import lru_cache
 import numpy as np
 from stl import mesh
 from PIL import Image
+from timing import span
 
-def write_ply(filename, vertices, faces, vertex_colors):
-    """
-    Write an ASCII PLY file with per-vertex colors.
-    """
-    with open(filename, "w") as f:
-        f.write("ply\n")
-        f.write("format ascii 1.0\n")
-        f.write("element vertex {}\n".format(len(vertices)))
-        f.write("property float x\n")
-        f.write("property float y\n")
-        f.write("property float z\n")
-        f.write("property uchar red\n")
-        f.write("property uchar green\n")
-        f.write("property uchar blue\n")
-        f.write("element face {}\n".format(len(faces)))
-        f.write("property list uchar int vertex_indices\n")
-        f.write("end_header\n")
-        for i, v in enumerate(vertices):
-            r, g, b = vertex_colors[i]
-            f.write("{:.6f} {:.6f} {:.6f} {} {} {}\n".format(v[0], v[1], v[2],
-                                                               int(r), int(g), int(b)))
-        for face in faces:
-            # Each face is a triangle (3 vertices)
-            f.write("3 {} {} {}\n".format(face[0], face[1], face[2]))
+PLY_FORMATS = ("binary", "ascii")
+
+PLY_VERTEX_DTYPE = np.dtype([
+    ("x", "<f4"), ("y", "<f4"), ("z", "<f4"),
+    ("red", "u1"), ("green", "u1"), ("blue", "u1"),
+])
+PLY_FACE_DTYPE = np.dtype([("count", "u1"), ("vertex_indices", "<i4", (3,))])
+
+def _ply_header(file_format, num_vertices, num_faces):
+    return (
+        "ply\n"
+        "format {} 1.0\n"
+        "element vertex {}\n"
+        "property float x\n"
+        "property float y\n"
+        "property float z\n"
+        "property uchar red\n"
+        "property uchar green\n"
+        "property uchar blue\n"
+        "element face {}\n"
+        "property list uchar int vertex_indices\n"
+        "end_header\n"
+    ).format(file_format, num_vertices, num_faces)
+
+def pack_ply_vertices(vertices, vertex_colors):
+    """
+    Pack vertex positions and colors into a PLY_VERTEX_DTYPE structured array.
+    """
+    packed = np.empty(len(vertices), dtype=PLY_VERTEX_DTYPE)
+    packed["x"] = vertices[:, 0]
+    packed["y"] = vertices[:, 1]
+    packed["z"] = vertices[:, 2]
+    packed["red"] = vertex_colors[:, 0]
+    packed["green"] = vertex_colors[:, 1]
+    packed["blue"] = vertex_colors[:, 2]
+    return packed
+
+def pack_ply_faces(faces):
+    """
+    Pack (F, 3) triangle indices into a PLY_FACE_DTYPE structured array.
+    """
+    packed = np.empty(len(faces), dtype=PLY_FACE_DTYPE)
+    packed["count"] = 3
+    packed["vertex_indices"] = faces
+    return packed
+
+def write_ply(filename, vertices, faces, vertex_colors, ply_format="binary"):
+    """
+    Write a PLY file with per-vertex colors.
+
+    :param ply_format: 'binary' (default) writes binary_little_endian, packing
+                       vertices and faces into structured arrays written with
+                       one buffer write each; 'ascii' writes the text format.
+    """
+    if ply_format == "binary":
+        with open(filename, "wb") as f:
+            f.write(_ply_header("binary_little_endian", len(vertices), len(faces)).encode("ascii"))
+            f.write(pack_ply_vertices(vertices, vertex_colors).data)
+            f.write(pack_ply_faces(faces).data)
+    elif ply_format == "ascii":
+        with open(filename, "w") as f:
+            f.write(_ply_header("ascii", len(vertices), len(faces)))
+            for i, v in enumerate(vertices):
+                r, g, b = vertex_colors[i]
+                f.write("{:.6f} {:.6f} {:.6f} {} {} {}\n".format(v[0], v[1], v[2],
+                                                                   int(r), int(g), int(b)))
+            for face in faces:
+                # Each face is a triangle (3 vertices)
+                f.write("3 {} {} {}\n".format(face[0], face[1], face[2]))
+    else:
+        raise ValueError("Invalid PLY format: choose 'binary' or 'ascii'.")
+
+# glTF 2.0 constants used by write_glb.
+GLB_MAGIC = 0x46546C67  # "glTF"
+GLB_CHUNK_JSON = 0x4E4F534A
+GLB_CHUNK_BIN = 0x004E4942
+GLTF_UNSIGNED_BYTE = 5121
+GLTF_SHORT = 5122
+GLTF_UNSIGNED_SHORT = 5123
+GLTF_UNSIGNED_INT = 5125
+GLTF_FLOAT = 5126
+GLTF_ARRAY_BUFFER = 34962
+GLTF_ELEMENT_ARRAY_BUFFER = 34963
+
+def _pad4(data, fill=b"\0"):
+    return data + fill * (-len(data) % 4)
+
+def write_glb(filename, vertices, faces, vertex_colors=None, quantize=False):
+    """
+    Write an indexed glTF binary (GLB) file, with per-vertex colors if given.
+
+    Unlike STL, each vertex is stored once and referenced by index (uint16 when
+    there are fewer than 65536 vertices, uint32 otherwise).
+
+    :param quantize: If True, store positions as normalized int16 (KHR_mesh_quantization,
+                     dequantized by the node's scale and translation) and colors as
+                     normalized uint8, instead of float32 for both.
+    """
+    vertices = np.asarray(vertices, dtype=np.float32)
+    buffer = bytearray()
+    buffer_views = []
+    accessors = []
+
+    def add_accessor(array, target, component_type, accessor_type, count, byte_stride=None, **extra):
+        view = {"buffer": 0, "byteOffset": len(buffer), "byteLength": array.nbytes, "target": target}
+        if byte_stride is not None:
+            view["byteStride"] = byte_stride
+        buffer.extend(_pad4(array.tobytes()))
+        buffer_views.append(view)
+        accessors.append(dict({"bufferView": len(buffer_views) - 1, "componentType": component_type,
+                               "count": count, "type": accessor_type}, **extra))
+        return len(accessors) - 1
+
+    node = {"mesh": 0}
+    if len(vertices) < 65536:
+        indices = add_accessor(faces.astype(np.uint16).ravel(), GLTF_ELEMENT_ARRAY_BUFFER,
+                               GLTF_UNSIGNED_SHORT, "SCALAR", faces.size)
+    else:
+        indices = add_accessor(faces.astype(np.uint32).ravel(), GLTF_ELEMENT_ARRAY_BUFFER,
+                               GLTF_UNSIGNED_INT, "SCALAR", faces.size)
+
+    if quantize:
+        # Map each axis onto [-32767, 32767]; vertex attributes need a 4-byte aligned stride.
+        low, high = vertices.min(axis=0).astype(np.float64), vertices.max(axis=0).astype(np.float64)
+        center = (low + high) / 2
+        half_extent = np.where(high > low, (high - low) / 2, 1.0)
+        packed = np.zeros((len(vertices), 4), dtype=np.int16)
+        packed[:, :3] = np.round((vertices - center) / half_extent * 32767)
+        positions = add_accessor(packed, GLTF_ARRAY_BUFFER, GLTF_SHORT, "VEC3", len(vertices),
+                                 byte_stride=8, normalized=True,
+                                 min=packed[:, :3].min(axis=0).tolist(), max=packed[:, :3].max(axis=0).tolist())
+        node["translation"] = center.tolist()
+        node["scale"] = half_extent.tolist()
+    else:
+        positions = add_accessor(vertices, GLTF_ARRAY_BUFFER, GLTF_FLOAT, "VEC3", len(vertices),
+                                 min=vertices.min(axis=0).tolist(), max=vertices.max(axis=0).tolist())
+    attributes = {"POSITION": positions}
+
+    if vertex_colors is not None:
+        if quantize:
+            packed = np.zeros((len(vertex_colors), 4), dtype=np.uint8)
+            packed[:, :3] = vertex_colors
+            attributes["COLOR_0"] = add_accessor(packed, GLTF_ARRAY_BUFFER, GLTF_UNSIGNED_BYTE, "VEC3",
+                                                 len(vertex_colors), byte_stride=4, normalized=True)
+        else:
+            colors = np.asarray(vertex_colors, dtype=np.float32) / 255.0
+            attributes["COLOR_0"] = add_accessor(colors, GLTF_ARRAY_BUFFER, GLTF_FLOAT, "VEC3", len(colors))
+
+    gltf = {
+        "asset": {"version": "2.0", "generator": "heightmap_to_3d"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [node],
+        "meshes": [{"primitives": [{"attributes": attributes, "indices": indices, "mode": 4}]}],
+        "accessors": accessors,
+        "bufferViews": buffer_views,
+        "buffers": [{"byteLength": len(buffer)}],
+    }
+    if quantize:
+        gltf["extensionsUsed"] = gltf["extensionsRequired"] = ["KHR_mesh_quantization"]
+
+    json_chunk = _pad4(json.dumps(gltf, separators=(",", ":")).encode("utf-8"), b" ")
+    with open(filename, "wb") as f:
+        f.write(np.array([GLB_MAGIC, 2, 12 + 8 + len(json_chunk) + 8 + len(buffer)], dtype="<u4").tobytes())
+        f.write(np.array([len(json_chunk), GLB_CHUNK_JSON], dtype="<u4").tobytes())
+        f.write(json_chunk)
+        f.write(np.array([len(buffer), GLB_CHUNK_BIN], dtype="<u4").tobytes())
+        f.write(buffer)
 
 def modify_top_z(base_top, pixel_value, depth, mode):
     """
     Compute the top Z coordinate for a given pixel value and mode.
     
     :param base_top: The nominal top (base_height + block_thickness)
-    :param pixel_value: Grayscale value [0, 1]
+    :param pixel_value: Grayscale value [0, 1], as a scalar or a NumPy array
     :param depth: Maximum extra height (used positively for protrude, negatively for carve)
     :param mode: Either 'protrude' or 'carve'
     :return: Adjusted Z coordinate.
@@ -46,6 +195,702 @@ def modify_top_z(base_top, pixel_value, depth, mode):
     else:
         raise ValueError("Invalid mode: choose 'protrude' or 'carve'.")
 
+def open_heightmap(heightmap_path):
+    """
+    Open a heightmap as a 2D array without normalizing it.
+
+    A .npy file (e.g. the float32 sidecar of generate_depth) is memory-mapped read-only,
+    so rows are only read from disk when they are sliced. A 16-bit grayscale image is
+    read as uint16; any other image is decoded with PIL as 8-bit grayscale.
+
+    :param heightmap_path: Path to a grayscale image or a 2D .npy array.
+    :return: (H, W) array-like of raw height values.
+    """
+    if str(heightmap_path).lower().endswith(".npy"):
+        raw = np.load(heightmap_path, mmap_mode="r")
+        if raw.ndim != 2:
+            raise ValueError("Heightmap array must be two-dimensional.")
+        return raw
+    image = Image.open(heightmap_path)
+    if image.mode in ("I;16", "I;16B", "I;16L", "I"):
+        # 16-bit PNGs may be reported as 32-bit "I"; their values still fit in uint16.
+        return np.asarray(image).astype(np.uint16, copy=False)
+    return np.asarray(image.convert('L'))
+
+def open_color_reference(color_reference):
+    """
+    Open a color reference as an (H, W, 3) uint8 array.
+
+    Like open_heightmap, an (H, W, 3) uint8 .npy file is memory-mapped read-only, so rows
+    are only read from disk when they are sliced. Any other image is decoded whole with PIL,
+    which has no row-by-row decoder for compressed formats such as PNG or JPEG.
+
+    :param color_reference: Path to a color image or an (H, W, 3) uint8 .npy array.
+    """
+    if str(color_reference).lower().endswith(".npy"):
+        ref_pixels = np.load(color_reference, mmap_mode="r")
+        if ref_pixels.ndim != 3 or ref_pixels.shape[2] != 3 or ref_pixels.dtype != np.uint8:
+            raise ValueError("Color reference array must be (H, W, 3) uint8.")
+        return ref_pixels
+    return np.asarray(Image.open(color_reference).convert('RGB'))
+
+def normalize_heightmap(raw, invert=False):
+    """
+    Convert raw height values to a float32 array in [0, 1].
+
+    8-bit and 16-bit integer values are divided by their full-scale value;
+    floating point values are assumed to already be in [0, 1].
+
+    :param raw: Array (or memory-mapped slice) of raw height values.
+    :param invert: If True, invert the heightmap (swap black and white).
+    """
+    if raw.dtype == np.uint8:
+        pixels = np.asarray(raw, dtype=np.float32) / 255.0
+    elif raw.dtype == np.uint16:
+        pixels = np.asarray(raw, dtype=np.float32) / 65535.0
+    else:
+        pixels = np.array(raw, dtype=np.float32)
+    if invert:
+        pixels = 1.0 - pixels
+    return pixels
+
+def grid_xy(width_px, height_px, block_width, block_length):
+    """
+    Compute the real-world X and Y coordinates of every pixel column and row.
+
+    :param width_px: Number of heightmap columns.
+    :param height_px: Number of heightmap rows.
+    :param block_width: X dimension of the block.
+    :param block_length: Y dimension of the block.
+    :return: Tuple (xs, ys) of float64 arrays of length width_px and height_px.
+    """
+    xs = (np.arange(width_px) / (width_px - 1)) * block_width
+    ys = (np.arange(height_px) / (height_px - 1)) * block_length
+    return xs, ys
+
+def build_layer_vertices(xs, ys, z):
+    """
+    Build the (len(ys) * len(xs), 3) float32 vertices of one layer of the grid,
+    in row-major (y, x) order.
+
+    :param xs: X coordinates of the grid columns.
+    :param ys: Y coordinates of the grid rows.
+    :param z: Z coordinate(s): a scalar or a (len(ys), len(xs)) array.
+    """
+    layer = np.empty((len(ys), len(xs), 3), dtype=np.float32)
+    layer[:, :, 0] = xs[np.newaxis, :]
+    layer[:, :, 1] = ys[:, np.newaxis]
+    layer[:, :, 2] = z
+    return layer.reshape(-1, 3)
+
+def build_block_vertices(pixels, block_width, block_length, block_thickness,
+                         depth, base_height, mode, xs=None, ys=None):
+    """
+    Build the (2 * H * W, 3) float32 vertex array for a block.
+
+    The first H * W vertices form the top layer (Z taken from the heightmap),
+    the next H * W the flat bottom layer at base_height, both in row-major
+    (y, x) order.
+
+    :param pixels: (H, W) float32 heightmap normalized to [0, 1].
+    :param xs: Optional X coordinates of the pixel columns (defaults to grid_xy).
+    :param ys: Optional Y coordinates of the pixel rows (defaults to grid_xy);
+               pass a slice of the full grid when pixels is a band of rows.
+    :return: float32 array of vertex positions.
+    """
+    height_px, width_px = pixels.shape
+    if xs is None or ys is None:
+        xs, ys = grid_xy(width_px, height_px, block_width, block_length)
+    base_top = base_height + block_thickness
+
+    top_z = modify_top_z(base_top, pixels, depth, mode)
+    return np.concatenate([build_layer_vertices(xs, ys, top_z),
+                           build_layer_vertices(xs, ys, base_height)])
+
+def build_vertex_colors(ref_pixels, bottom_color=(200, 200, 200)):
+    """
+    Build the per-vertex colors matching build_block_vertices: the reference
+    image on the top layer and a flat default color on the bottom layer.
+
+    :param ref_pixels: (H, W, 3) uint8 reference image.
+    :param bottom_color: RGB color assigned to every bottom vertex.
+    :return: (2 * H * W, 3) uint8 array.
+    """
+    height_px, width_px = ref_pixels.shape[:2]
+    vertex_colors = np.empty((2, height_px * width_px, 3), dtype=np.uint8)
+    vertex_colors[0] = ref_pixels.reshape(-1, 3)
+    vertex_colors[1] = np.asarray(bottom_color, dtype=np.uint8)
+    return vertex_colors.reshape(-1, 3)
+
+def _squares_to_triangles(v1, v2, v3, v4):
+    """
+    Split quads (v1, v2, v3, v4) into triangles (v1, v2, v3) and (v3, v4, v1).
+
+    Each argument is an index array of the same shape S; the result has shape
+    S + (2, 3) so that the two triangles of each quad stay adjacent.
+    """
+    return np.stack([np.stack([v1, v2, v3], axis=-1),
+                     np.stack([v3, v4, v1], axis=-1)], axis=-2)
+
+def build_cell_faces(top, bottom):
+    """
+    Build the top and bottom triangles of every grid cell, interleaved per cell
+    in row-major order: two top triangles, then two bottom triangles with
+    reverse winding for outward normals.
+
+    :param top: (rows, W) int32 vertex indices of the top layer.
+    :param bottom: (rows, W) int32 vertex indices of the bottom layer.
+    :return: (4 * (rows - 1) * (W - 1), 3) int32 array.
+    """
+    rows, width_px = top.shape
+    cells = np.empty((rows - 1, width_px - 1, 2, 2, 3), dtype=np.int32)
+    cells[:, :, 0] = _squares_to_triangles(top[:-1, :-1], top[:-1, 1:],
+                                           top[1:, 1:], top[1:, :-1])
+    cells[:, :, 1] = _squares_to_triangles(bottom[:-1, :-1], bottom[1:, :-1],
+                                           bottom[1:, 1:], bottom[:-1, 1:])
+    return cells.reshape(-1, 3)
+
+def build_wall_faces_x(top_cols, bottom_cols):
+    """
+    Build the side walls along the x = 0 and x = W - 1 edges, row by row.
+
+    :param top_cols: (H, 2) int32 top-layer indices of the first and last columns.
+    :param bottom_cols: (H, 2) int32 bottom-layer indices of the same columns.
+    :return: (4 * (H - 1), 3) int32 array.
+    """
+    return _squares_to_triangles(top_cols[:-1], top_cols[1:],
+                                 bottom_cols[1:], bottom_cols[:-1]).reshape(-1, 3)
+
+def build_wall_faces_y(top_rows, bottom_rows):
+    """
+    Build the side walls along the y = 0 and y = H - 1 edges, column by column.
+
+    :param top_rows: (2, W) int32 top-layer indices of the first and last rows.
+    :param bottom_rows: (2, W) int32 bottom-layer indices of the same rows.
+    :return: (4 * (W - 1), 3) int32 array.
+    """
+    return _squares_to_triangles(top_rows[:, :-1].T, top_rows[:, 1:].T,
+                                 bottom_rows[:, 1:].T, bottom_rows[:, :-1].T).reshape(-1, 3)
+
+def build_block_faces(width_px, height_px):
+    """
+    Build the int32 triangle index buffer for a block of width_px x height_px
+    vertices per layer (see build_block_vertices for the vertex layout).
+
+    Triangles are ordered as: for each grid cell in row-major order, the two
+    top triangles followed by the two bottom triangles (reverse winding);
+    then the left/right side walls row by row; then the front/back side walls
+    column by column.
+
+    :return: (F, 3) int32 array of vertex indices.
+    """
+    num_vertices_top = width_px * height_px
+    top = np.arange(num_vertices_top, dtype=np.int32).reshape(height_px, width_px)
+    bottom = top + num_vertices_top
+
+    side_x = [0, width_px - 1]
+    side_y = [0, height_px - 1]
+    return np.concatenate([build_cell_faces(top, bottom),
+                           build_wall_faces_x(top[:, side_x], bottom[:, side_x]),
+                           build_wall_faces_y(top[side_y], bottom[side_y])])
+
+# Parameters a sweep can vary without changing the mesh topology.
+SWEEP_PARAMETERS = ("block_thickness", "depth", "base_height", "mode", "invert")
+
+class BlockMeshTemplate:
+    """
+    Topology and XY coordinates of a block mesh, which depend only on the grid
+    size and the block footprint. Variants that differ in depth, base height,
+    thickness, mode or inversion only need their Z coordinates recomputed.
+
+    Get instances through get_block_template, which caches them.
+    """
+
+    def __init__(self, width_px, height_px, block_width, block_length):
+        self.width_px = width_px
+        self.height_px = height_px
+        xs, ys = grid_xy(width_px, height_px, block_width, block_length)
+        layer = build_layer_vertices(xs, ys, 0.0)
+        self.xy_vertices = np.concatenate([layer, layer])
+        self.faces = build_block_faces(width_px, height_px)
+        # Shared between variants (and threads), so guard against accidental edits.
+        self.xy_vertices.flags.writeable = False
+        self.faces.flags.writeable = False
+
+    def build_vertices(self, pixels, block_thickness, depth, base_height, mode):
+        """
+        Same result as build_block_vertices, reusing the template's XY coordinates.
+
+        :param pixels: (H, W) float32 heightmap normalized to [0, 1].
+        :return: (2 * H * W, 3) float32 array of vertex positions.
+        """
+        if pixels.shape != (self.height_px, self.width_px):
+            raise ValueError("Heightmap dimensions do not match the mesh template.")
+        num_vertices_top = pixels.size
+        vertices = self.xy_vertices.copy()
+        vertices[:num_vertices_top, 2] = modify_top_z(base_height + block_thickness,
+                                                      pixels, depth, mode).reshape(-1)
+        vertices[num_vertices_top:, 2] = base_height
+        return vertices
+
+@lru_cache(maxsize=4)
+def get_block_template(width_px, height_px, block_width, block_length):
+    """
+    Return the BlockMeshTemplate for a grid size and block footprint, building
+    it on first use. The most recently used templates are kept.
+    """
+    return BlockMeshTemplate(width_px, height_px, block_width, block_length)
+
+def _planar_error(blocks):
+    """
+    Maximum deviation of each (s + 1, s + 1) block of heights from the two
+    triangles (v1, v2, v3) and (v3, v4, v1) spanned by its corners.
+
+    :param blocks: (N, s + 1, s + 1) array of heights.
+    :return: (N,) array of maximum absolute errors.
+    """
+    size = blocks.shape[1] - 1
+    u = (np.arange(size + 1, dtype=np.float32) / size)[np.newaxis, np.newaxis, :]
+    v = (np.arange(size + 1, dtype=np.float32) / size)[np.newaxis, :, np.newaxis]
+    z1 = blocks[:, :1, :1]
+    z2 = blocks[:, :1, -1:]
+    z3 = blocks[:, -1:, -1:]
+    z4 = blocks[:, -1:, :1]
+    # Above the v1-v3 diagonal (u >= v) lies triangle (v1, v2, v3), below it (v3, v4, v1).
+    plane = np.where(u >= v,
+                     z1 + u * (z2 - z1) + v * (z3 - z2),
+                     z1 + v * (z4 - z1) + u * (z3 - z4))
+    return np.abs(blocks - plane).max(axis=(1, 2))
+
+def _quadtree_leaves(pixels, tolerance):
+    """
+    Split the heightmap grid into square quadtree leaves whose heights stay
+    within tolerance of their two corner triangles.
+
+    Levels are processed one at a time with whole-array operations. Nodes
+    sticking out of the grid are always split, so every leaf is a
+    power-of-two square lying fully inside the grid.
+
+    :return: List of (nodes, size) pairs, nodes being an (N, 2) array of (y0, x0).
+    """
+    height_px, width_px = pixels.shape
+    size = 1
+    while size < max(width_px - 1, height_px - 1):
+        size *= 2
+    windows = np.lib.stride_tricks.sliding_window_view
+    nodes = np.zeros((1, 2), dtype=np.int64)
+    leaves = []
+    while len(nodes):
+        nodes = nodes[(nodes[:, 0] < height_px - 1) & (nodes[:, 1] < width_px - 1)]
+        if size == 1:
+            leaves.append((nodes, 1))
+            break
+        y0, x0 = nodes[:, 0], nodes[:, 1]
+        inside = (y0 + size <= height_px - 1) & (x0 + size <= width_px - 1)
+        flat = np.zeros(len(nodes), dtype=bool)
+        if inside.any():
+            blocks = windows(pixels, (size + 1, size + 1))[y0[inside], x0[inside]]
+            flat[inside] = _planar_error(blocks) <= tolerance
+        leaves.append((nodes[flat], size))
+        half = size // 2
+        offsets = np.array([[0, 0], [0, half], [half, 0], [half, half]])
+        nodes = (nodes[~flat][:, np.newaxis, :] + offsets).reshape(-1, 2)
+        size = half
+    return leaves
+
+def _leaf_ring(size):
+    """
+    (dy, dx) offsets of the 4 * size boundary points of a size x size leaf,
+    walking v1 -> v2 -> v3 -> v4 in the winding order of the top faces.
+    """
+    k = np.arange(size)
+    dy = np.concatenate([np.zeros(size, dtype=np.int64), k, np.full(size, size), size - k])
+    dx = np.concatenate([k, np.full(size, size), size - k, np.zeros(size, dtype=np.int64)])
+    return dy, dx
+
+def _fan_faces(apex, chain):
+    """
+    Triangles (apex, chain[k], chain[k + 1]) fanning over a chain of vertex ids.
+    """
+    return np.stack([np.full(len(chain) - 1, apex), chain[:-1], chain[1:]], axis=-1)
+
+def _strip_faces(upper, upper_x, lower, lower_x):
+    """
+    Triangulate the strip between two rows of points lying on parallel lines,
+    advancing along whichever row has the nearer next point, so that every
+    triangle has vertices on both lines.
+
+    :param upper: Vertex ids on the first line, sorted by x.
+    :param upper_x: X coordinates of upper.
+    :param lower: Vertex ids on the second line, sorted by x.
+    :param lower_x: X coordinates of lower.
+    """
+    keys = np.concatenate([upper_x[1:], lower_x[1:]])
+    advance_lower = np.concatenate([np.zeros(len(upper) - 1, dtype=bool),
+                                    np.ones(len(lower) - 1, dtype=bool)])
+    advance_lower = advance_lower[np.argsort(keys, kind="stable")]
+    i = np.cumsum(~advance_lower) - ~advance_lower
+    j = np.cumsum(advance_lower) - advance_lower
+    next_upper = upper[np.minimum(i + 1, len(upper) - 1)]
+    next_lower = lower[np.minimum(j + 1, len(lower) - 1)]
+    return np.stack([upper[i], np.where(advance_lower, next_lower, next_upper), lower[j]], axis=-1)
+
+def simplify_block_faces(pixels, tolerance):
+    """
+    Build a simplified, watertight triangulation of the block.
+
+    The top surface is covered by quadtree leaves whose heights stay within
+    tolerance of their corner triangles. Leaves with finer neighbours are
+    fanned from their centre over every boundary point those neighbours use,
+    so there are no T-junctions; the rendered surface then stays within
+    2 * tolerance of every heightmap sample. The side walls follow the
+    simplified boundary, and the flat bottom is triangulated from the
+    perimeter vertices only.
+
+    :param pixels: (H, W) float32 heightmap normalized to [0, 1].
+    :param tolerance: Maximum height error of a leaf, in normalized units.
+    :return: Tuple (vertex_ids, faces): the indices of the kept vertices in the
+             build_block_vertices layout, and an (F, 3) int32 index buffer into
+             vertex_ids.
+    """
+    height_px, width_px = pixels.shape
+    num_vertices_top = width_px * height_px
+    leaves = _quadtree_leaves(pixels, tolerance)
+
+    used = np.zeros((height_px, width_px), dtype=bool)
+    for nodes, size in leaves:
+        for dy in (0, size):
+            for dx in (0, size):
+                used[nodes[:, 0] + dy, nodes[:, 1] + dx] = True
+
+    # Top surface: two triangles per leaf, or a centre fan when neighbours are finer.
+    faces = []
+    centers = []
+    for nodes, size in leaves:
+        plain = np.ones(len(nodes), dtype=bool)
+        if size > 1 and len(nodes):
+            dy, dx = _leaf_ring(size)
+            ring_y = nodes[:, :1] + dy
+            ring_x = nodes[:, 1:] + dx
+            ring_used = used[ring_y, ring_x]
+            plain = ring_used.sum(axis=1) == 4
+            fan = ~plain
+            if fan.any():
+                rows, cols = np.nonzero(ring_used[fan])
+                ring_ids = (ring_y * width_px + ring_x)[fan][rows, cols]
+                # Close each ring by linking its last point back to its first.
+                last = np.append(rows[1:] != rows[:-1], True)
+                first = np.concatenate([[0], np.flatnonzero(last)[:-1] + 1])
+                next_ids = np.roll(ring_ids, -1)
+                next_ids[last] = ring_ids[first]
+                center = nodes[fan] + size // 2
+                centers.append(center)
+                center_ids = center[:, 0] * width_px + center[:, 1]
+                faces.append(np.stack([center_ids[rows], ring_ids, next_ids], axis=-1))
+        v1 = nodes[plain, 0] * width_px + nodes[plain, 1]
+        v2 = v1 + size
+        v4 = v1 + size * width_px
+        v3 = v4 + size
+        faces.append(_squares_to_triangles(v1, v2, v3, v4).reshape(-1, 3))
+    for center in centers:
+        used[center[:, 0], center[:, 1]] = True
+
+    # Side walls between consecutive boundary vertices of the simplified top.
+    left = np.flatnonzero(used[:, 0]) * width_px
+    right = np.flatnonzero(used[:, -1]) * width_px + (width_px - 1)
+    front_x = np.flatnonzero(used[0])
+    back_x = np.flatnonzero(used[-1])
+    front = front_x
+    back = back_x + (height_px - 1) * width_px
+    for side in (left, right):
+        faces.append(build_wall_faces_x(side[:, np.newaxis], side[:, np.newaxis] + num_vertices_top))
+    for side in (front, back):
+        faces.append(build_wall_faces_y(side[np.newaxis, :], side[np.newaxis, :] + num_vertices_top))
+
+    # Bottom: fan the left and right edges, and stitch the front and back edges as a strip.
+    front, back, left, right = (side + num_vertices_top for side in (front, back, left, right))
+    bottom = np.concatenate([
+        _fan_faces(front[1], np.concatenate([front[:1], left[1:-1], back[:1]])),
+        _strip_faces(front[1:], front_x[1:], back[:-1], back_x[:-1]),
+        _fan_faces(back[-2], np.concatenate([front[-1:], right[1:-1], back[-1:]])),
+    ])
+    # Orient every bottom triangle downwards.
+    by, bx = np.divmod(bottom - num_vertices_top, width_px)
+    up = ((bx[:, 1] - bx[:, 0]) * (by[:, 2] - by[:, 0])
+          - (by[:, 1] - by[:, 0]) * (bx[:, 2] - bx[:, 0])) > 0
+    bottom[up] = bottom[up][:, ::-1]
+    faces.append(bottom)
+
+    border = np.zeros_like(used)
+    border[[0, -1], :] = True
+    border[:, [0, -1]] = True
+    vertex_ids = np.concatenate([np.flatnonzero(used),
+                                 np.flatnonzero(used & border) + num_vertices_top])
+    remap = np.empty(2 * num_vertices_top, dtype=np.int32)
+    remap[vertex_ids] = np.arange(len(vertex_ids), dtype=np.int32)
+    return vertex_ids, remap[np.concatenate(faces)]
+
+def block_triangle_count(width_px, height_px):
+    """
+    Number of triangles build_block_faces produces for a width_px x height_px grid.
+    """
+    return 4 * (width_px - 1) * (height_px - 1) + 4 * (height_px - 1) + 4 * (width_px - 1)
+
+def downsample_heightmap(pixels):
+    """
+    Halve a heightmap (or an (H, W, C) image) by averaging 2x2 pixel areas.
+    Odd dimensions are padded by repeating the last row or column.
+
+    :return: float32 array of shape ((H + 1) // 2, (W + 1) // 2, ...).
+    """
+    height_px, width_px = pixels.shape[:2]
+    pad = [(0, height_px % 2), (0, width_px % 2)] + [(0, 0)] * (pixels.ndim - 2)
+    padded = np.pad(np.asarray(pixels, dtype=np.float32), pad, mode="edge")
+    blocks = padded.reshape((padded.shape[0] // 2, 2, padded.shape[1] // 2, 2) + padded.shape[2:])
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+def build_heightmap_pyramid(pixels, num_levels):
+    """
+    Build LOD levels 0..num_levels from a single pass down the heightmap: level 0
+    is the input itself and each further level is the area-averaged half of the
+    previous one.
+
+    :param pixels: (H, W) heightmap or (H, W, C) image.
+    :param num_levels: Index of the coarsest level to build.
+    :return: List of num_levels + 1 arrays.
+    """
+    pyramid = [pixels]
+    for _ in range(num_levels):
+        if min(pyramid[-1].shape[:2]) <= 2:
+            raise ValueError("LOD level too coarse for a heightmap of this size.")
+        pyramid.append(downsample_heightmap(pyramid[-1]))
+    return pyramid
+
+def lod_level_for_budget(width_px, height_px, triangle_budget):
+    """
+    Return the finest LOD level whose full-resolution mesh fits in triangle_budget
+    triangles (or the coarsest available level if none does).
+    """
+    level = 0
+    while block_triangle_count(width_px, height_px) > triangle_budget and min(width_px, height_px) > 2:
+        width_px, height_px = (width_px + 1) // 2, (height_px + 1) // 2
+        level += 1
+    return level
+
+def lod_output_path(output_path, level):
+    """
+    Output path of an LOD level: output_path itself for level 0, otherwise
+    '<name>_lod<level><ext>' next to it.
+    """
+    if level == 0:
+        return output_path
+    root, ext = os.path.splitext(output_path)
+    return f"{root}_lod{level}{ext}"
+
+def write_stl(filename, vertices, faces):
+    """
+    Write a binary STL file for an indexed triangle mesh.
+
+    The records are packed in one array and written with a single buffer write,
+    which is much faster than going through numpy-stl's Mesh.save.
+    """
+    with open(filename, "wb") as f:
+        _write_stl_header(f, len(faces))
+        f.write(_stl_records(vertices[faces]).data)
+
+def _write_stl_header(f, num_faces):
+    """Binary STL: 80-byte header and uint32 triangle count, followed by 50-byte records."""
+    f.write(b"heightmap_to_3d".ljust(80, b" "))
+    f.write(np.uint32(num_faces).tobytes())
+
+def _stl_records(vectors):
+    """
+    Pack (N, 3, 3) triangle corners into binary STL records, with normals
+    computed the same way as numpy-stl.
+    """
+    records = np.zeros(len(vectors), dtype=mesh.Mesh.dtype)
+    records["vectors"] = vectors
+    records["normals"] = np.cross(vectors[:, 1] - vectors[:, 0],
+                                  vectors[:, 2] - vectors[:, 0])
+    return records
+
+def stream_block_from_heightmap(
+    heightmap_path,
+    output_path,
+    block_width=100.0,
+    block_length=100.0,
+    block_thickness=10.0,
+    depth=5.0,
+    base_height=0.0,
+    mode="protrude",
+    invert=False,
+    color_reference=None,
+    band_rows=64
+):
+    """
+    Out-of-core variant of generate_block_from_heightmap.
+
+    The heightmap is read in bands of band_rows rows (memory-mapped when it is a
+    .npy file) and the triangles of each band are written straight to the
+    output file, so only one band of vertices and triangles is in memory at a
+    time. The triangle count and file header are known up front from the
+    heightmap size. Output is binary STL, or binary PLY when color_reference is
+    given, with the same triangle order as the in-memory path.
+
+    The color reference is read band by band as well when it is an (H, W, 3) uint8
+    .npy file; an image file is decoded whole (see open_color_reference), so for
+    bounded memory with colors, pass a .npy color reference.
+
+    :param band_rows: Number of heightmap rows meshed per band.
+    """
+    if band_rows < 1:
+        raise ValueError("band_rows must be at least 1.")
+    raw = open_heightmap(heightmap_path)
+    height_px, width_px = raw.shape
+
+    ref_pixels = None
+    if color_reference:
+        ref_pixels = open_color_reference(color_reference)
+        if ref_pixels.shape[0] != height_px or ref_pixels.shape[1] != width_px:
+            raise ValueError("Reference image dimensions do not match the heightmap.")
+
+    xs, ys = grid_xy(width_px, height_px, block_width, block_length)
+    side_x = [0, width_px - 1]
+    side_y = [0, height_px - 1]
+    num_vertices_top = width_px * height_px
+    num_faces = block_triangle_count(width_px, height_px)
+
+    def bands(last_row):
+        for y0 in range(0, last_row, band_rows):
+            yield y0, min(y0 + band_rows, last_row)
+
+    def vertices_for(pixels, band_xs, band_ys):
+        return build_block_vertices(pixels, block_width, block_length, block_thickness,
+                                    depth, base_height, mode, xs=band_xs, ys=band_ys)
+
+    with open(output_path, "wb") as f:
+        if ref_pixels is None:
+            _write_stl_header(f, num_faces)
+
+            # Cells: each band covers vertex rows y0..y1 inclusive.
+            wall_cols = np.empty((height_px, 2), dtype=np.float32)
+            wall_rows = np.empty((2, width_px), dtype=np.float32)
+            for y0, y1 in bands(height_px - 1):
+                pixels = normalize_heightmap(raw[y0:y1 + 1], invert)
+                wall_cols[y0:y1 + 1] = pixels[:, side_x]
+                if y0 == 0:
+                    wall_rows[0] = pixels[0]
+                if y1 == height_px - 1:
+                    wall_rows[1] = pixels[-1]
+                vertices = vertices_for(pixels, xs, ys[y0:y1 + 1])
+                top = np.arange(pixels.size, dtype=np.int32).reshape(pixels.shape)
+                faces = build_cell_faces(top, top + pixels.size)
+                f.write(_stl_records(vertices[faces]).data)
+
+            # Side walls, meshed from the edge columns and rows only.
+            vertices = vertices_for(wall_cols, xs[side_x], ys)
+            top = np.arange(wall_cols.size, dtype=np.int32).reshape(wall_cols.shape)
+            f.write(_stl_records(vertices[build_wall_faces_x(top, top + wall_cols.size)]).data)
+
+            vertices = vertices_for(wall_rows, xs, ys[side_y])
+            top = np.arange(wall_rows.size, dtype=np.int32).reshape(wall_rows.shape)
+            f.write(_stl_records(vertices[build_wall_faces_y(top, top + wall_rows.size)]).data)
+        else:
+            print("Color reference provided – exporting as a PLY file with vertex colors.")
+            f.write(_ply_header("binary_little_endian", 2 * num_vertices_top, num_faces).encode("ascii"))
+
+            # Vertices: the whole top layer, then the whole bottom layer.
+            base_top = base_height + block_thickness
+            for y0, y1 in bands(height_px):
+                pixels = normalize_heightmap(raw[y0:y1], invert)
+                vertices = build_layer_vertices(xs, ys[y0:y1],
+                                                modify_top_z(base_top, pixels, depth, mode))
+                f.write(pack_ply_vertices(vertices, ref_pixels[y0:y1].reshape(-1, 3)).data)
+            bottom_color = np.array([[200, 200, 200]], dtype=np.uint8)
+            for y0, y1 in bands(height_px):
+                vertices = build_layer_vertices(xs, ys[y0:y1], base_height)
+                f.write(pack_ply_vertices(vertices, np.broadcast_to(bottom_color, vertices.shape)).data)
+
+            # Faces reference the global vertex indices.
+            for y0, y1 in bands(height_px - 1):
+                top = np.arange(y0 * width_px, (y1 + 1) * width_px, dtype=np.int32).reshape(-1, width_px)
+                f.write(pack_ply_faces(build_cell_faces(top, top + num_vertices_top)).data)
+            top_cols = (np.arange(height_px, dtype=np.int32) * width_px)[:, np.newaxis] + np.int32(side_x)
+            top_rows = (np.int32(side_y) * width_px)[:, np.newaxis] + np.arange(width_px, dtype=np.int32)
+            f.write(pack_ply_faces(build_wall_faces_x(top_cols, top_cols + num_vertices_top)).data)
+            f.write(pack_ply_faces(build_wall_faces_y(top_rows, top_rows + num_vertices_top)).data)
+    print(f"Saved model to: {output_path}")
+
+def write_block_mesh(
+    pixels,
+    output_path,
+    block_width=100.0,
+    block_length=100.0,
+    block_thickness=10.0,
+    depth=5.0,
+    base_height=0.0,
+    mode="protrude",
+    ref_pixels=None,
+    ply_format="binary",
+    max_error=None,
+    template=None,
+    quantize=False
+):
+    """
+    Mesh a normalized heightmap into a block and export it: a PLY file with vertex
+    colors when ref_pixels is given, an STL file otherwise.
+
+    :param pixels: (H, W) float32 heightmap normalized to [0, 1].
+    :param ref_pixels: Optional (H, W, 3) uint8 image used for top vertex colors.
+    :param template: Optional BlockMeshTemplate for this grid and footprint; its XY
+                     coordinates and faces are reused instead of being rebuilt.
+    See generate_block_from_heightmap for the other parameters.
+    :return: Dict with the file size in "bytes", the number of "triangles" and the
+             "encode_seconds" spent writing the file.
+    """
+    height_px, width_px = pixels.shape
+    use_color = ref_pixels is not None
+
+    # Build the vertex grid and the face index buffer with whole-array operations.
+    with span("mesh.vertices"):
+        if template is None:
+            vertices = build_block_vertices(pixels, block_width, block_length,
+                                            block_thickness, depth, base_height, mode)
+        else:
+            vertices = template.build_vertices(pixels, block_thickness, depth, base_height, mode)
+        vertex_colors = None
+        if use_color:
+            vertex_colors = build_vertex_colors(ref_pixels)
+
+    with span("mesh.faces"):
+        if max_error is None:
+            faces = build_block_faces(width_px, height_px) if template is None else template.faces
+        else:
+            # The simplified surface deviates by at most twice the leaf tolerance.
+            tolerance = max_error / (2.0 * abs(depth)) if depth else np.inf
+            vertex_ids, faces = simplify_block_faces(pixels, tolerance)
+            vertices = vertices[vertex_ids]
+            if use_color:
+                vertex_colors = vertex_colors[vertex_ids]
+
+    # Export the model.
+    start = time.perf_counter()
+    with span("mesh.export"):
+        if is_glb_path(output_path):
+            write_glb(output_path, vertices, faces, vertex_colors, quantize=quantize)
+        elif use_color:
+            print("Color reference provided – exporting as a PLY file with vertex colors.")
+            write_ply(output_path, vertices, faces, vertex_colors, ply_format=ply_format)
+        else:
+            write_stl(output_path, vertices, faces)
+    print(f"Saved model to: {output_path}")
+    return {"bytes": os.path.getsize(output_path), "triangles": len(faces),
+            "encode_seconds": time.perf_counter() - start}
+
+def is_glb_path(output_path):
+    """Whether output_path selects the glTF binary exporter (a .glb extension)."""
+    return str(output_path).lower().endswith(".glb")
+
 def generate_block_from_heightmap(
     heightmap_path,
     output_path,
@@ -56,7 +901,16 @@ def generate_block_from_heightmap(
     base_height=0.0,
     mode="protrude",
     invert=False,
-    color_reference=None
+    color_reference=None,
+    ply_format="binary",
+    streaming=False,
+    band_rows=64,
+    max_error=None,
+    triangle_budget=None,
+    lod_levels=None,
+    on_lod_written=None,
+    quantize=False,
+    export_stats=None
 ):
     """
     Generate a rectangular block (of size block_width x block_length x block_thickness)
@@ -69,10 +923,11 @@ def generate_block_from_heightmap(
     
     Optionally, if a color_reference image is provided (and matches the heightmap dimensions),
     its RGB values are applied to the top face vertices. In that case the model is exported as
-    a PLY file; otherwise, an STL file is generated.
+    a PLY file (binary little-endian unless ply_format='ascii'); otherwise, an STL file is generated.
+    An output path ending in .glb selects an indexed glTF binary file instead, with or without colors.
     
-    :param heightmap_path: Path to the grayscale heightmap image.
-    :param output_path: Output file path (STL if no color, PLY if colored).
+    :param heightmap_path: Path to the grayscale heightmap image (or a 2D .npy array).
+    :param output_path: Output file path (STL if no color, PLY if colored, or GLB).
     :param block_width: X dimension of the block.
     :param block_length: Y dimension of the block.
     :param block_thickness: Base thickness (height) of the block.
@@ -80,120 +935,211 @@ def generate_block_from_heightmap(
     :param base_height: Z offset for the bottom of the block.
     :param mode: 'protrude' (default) to raise the top, or 'carve' to cut into the block.
     :param invert: If True, invert the heightmap (swap black and white).
-    :param color_reference: Optional path to a reference color image (must match heightmap dimensions).
+    :param color_reference: Optional path to a reference color image, or an (H, W, 3) uint8 .npy
+                            array (must match heightmap dimensions).
+    :param ply_format: 'binary' (default) or 'ascii' encoding for colored PLY output.
+    :param streaming: If True, mesh and write the block band by band with
+                      stream_block_from_heightmap (binary output only).
+    :param band_rows: Heightmap rows per band in streaming mode.
+    :param max_error: If set, simplify the mesh: flat and nearly planar areas of the top are
+                      merged while staying within max_error (in model units, e.g. mm) of the
+                      heightmap, and the bottom is built from the perimeter vertices only.
+    :param triangle_budget: If set, mesh the finest level of detail whose grid fits in this many
+                            triangles instead of the full resolution.
+    :param lod_levels: Optional list of levels of detail to write, 0 being full resolution and
+                       each further level halving the heightmap by area averaging. Level n is
+                       written to lod_output_path(output_path, n), coarsest first.
+    :param on_lod_written: Optional callback(level, path) invoked as each level is saved.
+    :param quantize: For GLB output, store positions as int16 and colors as uint8 (see write_glb).
+    :param export_stats: Optional dict, filled with the write_block_mesh stats of each level
+                         before on_lod_written is called for it.
+    :return: List of the output paths written.
     """
-    # 1) Load heightmap as grayscale and normalize to [0, 1]
-    img = Image.open(heightmap_path).convert('L')
-    width_px, height_px = img.size
-    pixels = np.array(img, dtype=np.float32) / 255.0
-    if invert:
-        pixels = 1.0 - pixels
+    if streaming:
+        if ply_format != "binary" or is_glb_path(output_path):
+            raise ValueError("Streaming export only supports binary STL or PLY output.")
+        if max_error is not None or triangle_budget is not None or lod_levels is not None:
+            raise ValueError("Streaming export does not support simplification or levels of detail.")
+        with span("mesh.stream"):
+            stream_block_from_heightmap(
+                heightmap_path, output_path,
+                block_width=block_width, block_length=block_length,
+                block_thickness=block_thickness, depth=depth, base_height=base_height,
+                mode=mode, invert=invert, color_reference=color_reference,
+                band_rows=band_rows
+            )
+        return [output_path]
 
-    # Optionally load the reference image for vertex colors.
-    use_color = False
-    if color_reference:
-        ref_img = Image.open(color_reference).convert('RGB')
-        ref_pixels = np.array(ref_img, dtype=np.uint8)
+    # 1) Load the heightmap and, optionally, the reference image for vertex colors.
+    with span("mesh.load"):
+        heightmap = open_heightmap(heightmap_path)
+        ref_pixels = None
+        if color_reference:
+            ref_pixels = open_color_reference(color_reference)
+    return generate_block_from_array(
+        heightmap, output_path,
+        block_width=block_width, block_length=block_length,
+        block_thickness=block_thickness, depth=depth, base_height=base_height,
+        mode=mode, invert=invert, ref_pixels=ref_pixels, ply_format=ply_format,
+        max_error=max_error, triangle_budget=triangle_budget,
+        lod_levels=lod_levels, on_lod_written=on_lod_written,
+        quantize=quantize, export_stats=export_stats
+    )
+
+def generate_block_from_array(
+    heightmap,
+    output_path,
+    block_width=100.0,
+    block_length=100.0,
+    block_thickness=10.0,
+    depth=5.0,
+    base_height=0.0,
+    mode="protrude",
+    invert=False,
+    ref_pixels=None,
+    ply_format="binary",
+    max_error=None,
+    triangle_budget=None,
+    lod_levels=None,
+    on_lod_written=None,
+    quantize=False,
+    export_stats=None
+):
+    """
+    In-memory variant of generate_block_from_heightmap, for callers that already hold
+    the decoded heightmap (and color reference), so nothing is re-read from disk.
+
+    :param heightmap: (H, W) array of raw height values: uint8, uint16, or float in [0, 1].
+    :param ref_pixels: Optional (H, W, 3) uint8 image used for top vertex colors.
+    See generate_block_from_heightmap for the other parameters.
+    :return: List of the output paths written.
+    """
+    # 1) Normalize the heightmap to [0, 1]
+    with span("mesh.normalize"):
+        pixels = normalize_heightmap(heightmap, invert)
+    height_px, width_px = pixels.shape
+
+    if ref_pixels is not None:
+        ref_pixels = np.asarray(ref_pixels, dtype=np.uint8)
         if ref_pixels.shape[0] != height_px or ref_pixels.shape[1] != width_px:
             raise ValueError("Reference image dimensions do not match the heightmap.")
-        use_color = True
 
-    # 2) Create vertices for the top (modified by heightmap) and bottom (flat)
-    num_vertices_top = width_px * height_px
-    num_vertices_bottom = width_px * height_px
-    total_vertices = num_vertices_top + num_vertices_bottom
+    # 2) Mesh and export each requested level of detail, coarsest first.
+    if lod_levels is None:
+        levels = [lod_level_for_budget(width_px, height_px, triangle_budget)
+                  if triangle_budget is not None else 0]
+        output_paths = [output_path]
+    else:
+        levels = sorted(set(lod_levels), reverse=True)
+        output_paths = [lod_output_path(output_path, level) for level in levels]
 
-    vertices = np.zeros((total_vertices, 3), dtype=np.float32)
-    vertex_colors = np.zeros((total_vertices, 3), dtype=np.uint8) if use_color else None
+    with span("mesh.pyramid"):
+        pyramid = build_heightmap_pyramid(pixels, max(levels))
+        ref_pyramid = None
+        if ref_pixels is not None:
+            ref_pyramid = [np.round(level).astype(np.uint8)
+                           for level in build_heightmap_pyramid(ref_pixels, max(levels))]
+    for level, level_path in zip(levels, output_paths):
+        stats = write_block_mesh(
+            pyramid[level], level_path,
+            block_width=block_width, block_length=block_length,
+            block_thickness=block_thickness, depth=depth, base_height=base_height,
+            mode=mode, ref_pixels=ref_pyramid[level] if ref_pyramid else None,
+            ply_format=ply_format, max_error=max_error, quantize=quantize
+        )
+        if export_stats is not None:
+            export_stats[level] = stats
+        if on_lod_written is not None:
+            on_lod_written(level, level_path)
+    return output_paths
 
-    def vertex_index(x, y, is_top=True):
-        """Return index of the vertex at (x,y) in the top or bottom layer."""
-        base = 0 if is_top else num_vertices_top
-        return base + (y * width_px + x)
+def sweep_block_from_heightmap(
+    heightmap_path,
+    output_pattern,
+    variants,
+    block_width=100.0,
+    block_length=100.0,
+    color_reference=None,
+    ply_format="binary",
+    max_error=None,
+    quantize=False,
+    **defaults
+):
+    """
+    Write several variants of a block from one heightmap in a single run.
 
-    base_top = base_height + block_thickness
-    # Fill top vertices (modified by heightmap and optionally colored)
-    for y in range(height_px):
-        for x in range(width_px):
-            X_real = (x / (width_px - 1)) * block_width
-            Y_real = (y / (height_px - 1)) * block_length
-            # Adjust top Z coordinate based on the selected mode.
-            z_top = modify_top_z(base_top, pixels[y, x], depth, mode)
-            idx = vertex_index(x, y, is_top=True)
-            vertices[idx] = [X_real, Y_real, z_top]
-            if use_color:
-                vertex_colors[idx] = ref_pixels[y, x]
-
-    # Fill bottom vertices (flat at base_height; assign a default color if using color)
-    default_bottom_color = np.array([200, 200, 200], dtype=np.uint8)
-    for y in range(height_px):
-        for x in range(width_px):
-            X_real = (x / (width_px - 1)) * block_width
-            Y_real = (y / (height_px - 1)) * block_length
-            z_bottom = base_height
-            idx = vertex_index(x, y, is_top=False)
-            vertices[idx] = [X_real, Y_real, z_bottom]
-            if use_color:
-                vertex_colors[idx] = default_bottom_color
+    The heightmap and color reference are loaded once, and all variants share one
+    cached BlockMeshTemplate (see get_block_template), so only the Z coordinates
+    are recomputed per variant.
 
-    # 3) Create faces (triangles) for top, bottom, and side walls.
-    faces = []
-    def add_square(v1, v2, v3, v4):
-        faces.append([v1, v2, v3])
-        faces.append([v3, v4, v1])
-
-    for y in range(height_px - 1):
-        for x in range(width_px - 1):
-            # Top face
-            v1_top = vertex_index(x,     y,     True)
-            v2_top = vertex_index(x + 1, y,     True)
-            v3_top = vertex_index(x + 1, y + 1, True)
-            v4_top = vertex_index(x,     y + 1, True)
-            add_square(v1_top, v2_top, v3_top, v4_top)
-
-            # Bottom face (reverse winding for outward normals)
-            v1_bot = vertex_index(x,     y,     False)
-            v2_bot = vertex_index(x + 1, y,     False)
-            v3_bot = vertex_index(x + 1, y + 1, False)
-            v4_bot = vertex_index(x,     y + 1, False)
-            add_square(v1_bot, v4_bot, v3_bot, v2_bot)
-
-    # Side walls (connect top edge to bottom edge)
-    for y in range(height_px - 1):
-        for side_x in [0, width_px - 1]:
-            v_top1 = vertex_index(side_x, y,     True)
-            v_top2 = vertex_index(side_x, y + 1, True)
-            v_bot1 = vertex_index(side_x, y,     False)
-            v_bot2 = vertex_index(side_x, y + 1, False)
-            add_square(v_top1, v_top2, v_bot2, v_bot1)
-    for x in range(width_px - 1):
-        for side_y in [0, height_px - 1]:
-            v_top1 = vertex_index(x,     side_y, True)
-            v_top2 = vertex_index(x + 1, side_y, True)
-            v_bot1 = vertex_index(x,     side_y, False)
-            v_bot2 = vertex_index(x + 1, side_y, False)
-            add_square(v_top1, v_top2, v_bot2, v_bot1)
-
-    faces = np.array(faces, dtype=np.int32)
-
-    # 4) Export the model.
-    if use_color:
-        print("Color reference provided – exporting as a PLY file with vertex colors.")
-        write_ply(output_path, vertices, faces, vertex_colors)
-    else:
-        output_mesh = mesh.Mesh(np.zeros(faces.shape[0], dtype=mesh.Mesh.dtype))
-        for i, f in enumerate(faces):
-            for j in range(3):
-                output_mesh.vectors[i][j] = vertices[f[j]]
-        output_mesh.save(output_path)
-    print(f"Saved model to: {output_path}")
+    :param heightmap_path: Path to the grayscale heightmap image (or a 2D .npy array).
+    :param output_pattern: Output path with str.format fields, filled with the variant's
+                           index and its SWEEP_PARAMETERS, e.g. 'block_{index}_d{depth}.stl'.
+    :param variants: List of dicts overriding any of SWEEP_PARAMETERS.
+    :param defaults: Values of SWEEP_PARAMETERS used when a variant does not set them
+                     (otherwise the defaults of generate_block_from_heightmap).
+    See generate_block_from_heightmap for the other parameters.
+    :return: List of the output paths written.
+    """
+    base = dict(block_thickness=10.0, depth=5.0, base_height=0.0, mode="protrude", invert=False)
+    for params in [defaults] + list(variants):
+        unknown = set(params) - set(SWEEP_PARAMETERS)
+        if unknown:
+            raise ValueError(f"Cannot sweep over: {', '.join(sorted(unknown))}")
+    base.update(defaults)
+
+    raw = open_heightmap(heightmap_path)
+    height_px, width_px = raw.shape
+    ref_pixels = None
+    if color_reference:
+        ref_pixels = open_color_reference(color_reference)
+        if ref_pixels.shape[0] != height_px or ref_pixels.shape[1] != width_px:
+            raise ValueError("Reference image dimensions do not match the heightmap.")
+    template = get_block_template(width_px, height_px, block_width, block_length)
+
+    pixels_by_invert = {}
+    output_paths = []
+    for index, variant in enumerate(variants):
+        params = dict(base, **variant)
+        output_path = output_pattern.format(index=index, **params)
+        invert = params.pop("invert")
+        if invert not in pixels_by_invert:
+            pixels_by_invert[invert] = normalize_heightmap(raw, invert)
+        write_block_mesh(
+            pixels_by_invert[invert], output_path,
+            block_width=block_width, block_length=block_length,
+            ref_pixels=ref_pixels, ply_format=ply_format, max_error=max_error,
+            template=template, quantize=quantize, **params
+        )
+        output_paths.append(output_path)
+    return output_paths
+
+def parse_variant(spec):
+    """
+    Parse a sweep variant given as 'key=value,key=value', e.g. 'depth=2,mode=carve'.
+    """
+    variant = {}
+    for item in spec.split(","):
+        key, sep, value = item.partition("=")
+        key = key.strip()
+        if not sep or key not in SWEEP_PARAMETERS:
+            raise argparse.ArgumentTypeError(
+                f"Invalid variant item '{item}': use key=value with key in {', '.join(SWEEP_PARAMETERS)}.")
+        value = value.strip()
+        if key == "mode":
+            variant[key] = value
+        elif key == "invert":
+            variant[key] = value.lower() in ("1", "true", "yes")
+        else:
+            variant[key] = float(value)
+    return variant
 
 def main():
     parser = argparse.ArgumentParser(
         description="Generate a block with a modified top face from a heightmap, either by protruding or carving."
     )
     parser.add_argument("heightmap_path", help="Path to the grayscale heightmap image.")
-    parser.add_argument("output_path", help="Output file path (STL if no color, PLY if colored).")
+    parser.add_argument("output_path", help="Output file path (STL if no color, PLY if colored, or .glb for glTF binary).")
     parser.add_argument("--block_width", type=float, default=100.0, help="X dimension of the block (default: 100).")
     parser.add_argument("--block_length", type=float, default=100.0, help="Y dimension of the block (default: 100).")
     parser.add_argument("--block_thickness", type=float, default=10.0, help="Base thickness of the block (default: 10).")
@@ -202,9 +1148,48 @@ def main():
     parser.add_argument("--mode", choices=["protrude", "carve"], default="protrude",
                         help="Mode for top modification: 'protrude' to raise or 'carve' to cut into the block (default: protrude).")
     parser.add_argument("--invert", action="store_true", help="Invert the heightmap (swap black and white).")
-    parser.add_argument("--color_reference", help="Path to a reference color image (must match heightmap dimensions).")
+    parser.add_argument("--color_reference", help="Path to a reference color image or (H, W, 3) uint8 .npy array "
+                                                  "(must match heightmap dimensions; use .npy to stream colors).")
+    parser.add_argument("--ply_format", choices=list(PLY_FORMATS), default="binary",
+                        help="Encoding for colored PLY output (default: binary).")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Write the mesh band by band to bound memory use on very large heightmaps.")
+    parser.add_argument("--band_rows", type=int, default=64,
+                        help="Heightmap rows per band in streaming mode (default: 64).")
+    parser.add_argument("--max_error", type=float,
+                        help="Simplify flat regions, keeping the top within this height error (e.g. 0.05 mm).")
+    parser.add_argument("--triangle_budget", type=int,
+                        help="Mesh the finest level of detail that fits in this many triangles.")
+    parser.add_argument("--lod_levels", type=int, nargs="+",
+                        help="Write these levels of detail (0 = full resolution, each level halves it).")
+    parser.add_argument("--quantize", action="store_true",
+                        help="For .glb output, quantize positions to int16 and colors to uint8.")
+    parser.add_argument("--variant", type=parse_variant, action="append",
+                        help="Add a sweep variant, e.g. 'depth=2,mode=carve' (repeatable). Variants override "
+                             "the other options and output_path becomes a pattern such as 'out_{index}.stl'.")
     args = parser.parse_args()
 
+    if args.variant:
+        if args.streaming or args.triangle_budget is not None or args.lod_levels is not None:
+            parser.error("--variant cannot be combined with --streaming, --triangle_budget or --lod_levels.")
+        sweep_block_from_heightmap(
+            heightmap_path=args.heightmap_path,
+            output_pattern=args.output_path,
+            variants=args.variant,
+            block_width=args.block_width,
+            block_length=args.block_length,
+            color_reference=args.color_reference,
+            ply_format=args.ply_format,
+            max_error=args.max_error,
+            quantize=args.quantize,
+            block_thickness=args.block_thickness,
+            depth=args.depth,
+            base_height=args.base_height,
+            mode=args.mode,
+            invert=args.invert
+        )
+        return
+
     generate_block_from_heightmap(
         heightmap_path=args.heightmap_path,
         output_path=args.output_path,
@@ -215,7 +1200,14 @@ def main():
         base_height=args.base_height,
         mode=args.mode,
         invert=args.invert,
-        color_reference=args.color_reference
+        color_reference=args.color_reference,
+        ply_format=args.ply_format,
+        streaming=args.streaming,
+        band_rows=args.band_rows,
+        max_error=args.max_error,
+        triangle_budget=args.triangle_budget,
+        lod_levels=args.lod_levels,
+        quantize=args.quantize
     )
 
 if __name__ == "__main__":
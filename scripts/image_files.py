@@ -0,0 +1,44 @@
+import os
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+
+def list_images(directory, recursive=False):
+    """
+    Return the sorted paths of the image files in a directory.
+
+    Args:
+        directory (str): Directory to search.
+        recursive (bool): Also search its subdirectories.
+    """
+    if recursive:
+        return sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(directory)
+            for name in names if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+def prefetch_map(pool, fn, items, ahead):
+    """
+    Yield fn(item) for each item in order, running at most ahead calls on pool at a time.
+
+    Used to decode a bounded number of images ahead of the model, so that decoding
+    overlaps inference without holding every decoded image in memory.
+
+    Args:
+        pool (concurrent.futures.Executor): Pool the calls run on.
+        fn (Callable): Function applied to each item.
+        items (list): Items, consumed in order.
+        ahead (int): Maximum number of calls submitted but not yet yielded.
+    """
+    pending = [pool.submit(fn, item) for item in items[:ahead]]
+    for next_index in range(ahead, len(items) + ahead):
+        if not pending:
+            break
+        result = pending.pop(0).result()
+        if next_index < len(items):
+            pending.append(pool.submit(fn, items[next_index]))
+        yield result
@@ -0,0 +1,41 @@
+from collections import Counter
+
+import numpy as np
+
+from displace_mesh import select_upward_faces, subdivide_faces
+
+def _slab(width, cells, x0=0.0):
+    """Closed 1-unit-thick slab whose square top is a cells * cells grid of width * width."""
+    ticks = np.linspace(0.0, width, cells + 1)
+    x, y = np.meshgrid(ticks + x0, ticks)
+    top = np.stack([x.ravel(), y.ravel(), np.zeros(x.size)], axis=1)
+    vertices = np.concatenate([top, top - [0.0, 0.0, 1.0]])
+    index = np.arange(x.size).reshape(cells + 1, cells + 1)
+    v00, v10, v01, v11 = index[:-1, :-1].ravel(), index[:-1, 1:].ravel(), index[1:, :-1].ravel(), index[1:, 1:].ravel()
+    top_faces = np.concatenate([np.stack([v00, v10, v11], 1), np.stack([v00, v11, v01], 1)])
+    faces = [top_faces, top_faces[:, ::-1] + x.size]
+    ring = np.concatenate([index[0, :-1], index[:-1, -1], index[-1, :0:-1], index[:0:-1, 0]])
+    nxt = np.roll(ring, -1)
+    faces += [np.stack([nxt, ring, ring + x.size], 1), np.stack([nxt, ring + x.size, nxt + x.size], 1)]
+    return vertices, np.concatenate(faces)
+
+def _directed_edges(faces):
+    return Counter(map(tuple, np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])))
+
+def test_mixed_face_sizes_grow_with_area():
+    big_vertices, big_faces = _slab(32.0, 1)
+    small_vertices, small_faces = _slab(16.0, 16, x0=40.0)
+    vertices = np.concatenate([big_vertices, small_vertices]).astype(np.float32)
+    faces = np.concatenate([big_faces, small_faces + len(big_vertices)])
+    selected = select_upward_faces(vertices, faces)
+
+    new_vertices, new_faces, region = subdivide_faces(vertices, faces, selected, 1.0)
+
+    # One n for all faces would split each of the 512 unit faces 46 * 46 times (over a million triangles).
+    top_area = 32.0 ** 2 + 16.0 ** 2
+    assert len(new_faces) < 8 * top_area
+    edges = _directed_edges(new_faces)
+    assert all(count == 1 and edges[(b, a)] == 1 for (a, b), count in edges.items())
+    top = new_faces[np.all(region[new_faces], axis=1)]
+    lengths = np.linalg.norm(new_vertices[top] - np.roll(new_vertices[top], -1, axis=1), axis=2)
+    assert lengths.max() <= 2.0 + 1e-4
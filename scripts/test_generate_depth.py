@@ -0,0 +1,15 @@
+import numpy as np
+import pytest
+
+from generate_depth import save_depth_sidecar
+from heightmap_to_3d import open_heightmap
+
+@pytest.mark.filterwarnings("error")
+def test_png_sidecar_keeps_16_bit_levels(tmp_path):
+    heightmap = np.linspace(0.0, 1.0, 64 * 48, dtype=np.float32).reshape(48, 64)
+    path = str(tmp_path / "depth.png")
+    save_depth_sidecar(heightmap, path)
+
+    levels = open_heightmap(path)
+    assert levels.dtype == np.uint16
+    np.testing.assert_array_equal(levels, np.rint(heightmap * 65535.0).astype(np.uint16))
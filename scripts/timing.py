@@ -0,0 +1,36 @@
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()
+
+@contextmanager
+def span(name):
+    """
+    Time a pipeline stage. The duration is added to the innermost record_spans()
+    collection of the current thread; with none active, this costs one attribute lookup.
+    """
+    spans = getattr(_local, "spans", None)
+    if spans is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans[name] = spans.get(name, 0.0) + time.perf_counter() - start
+
+@contextmanager
+def record_spans():
+    """
+    Collect the spans run by the current thread inside the with block.
+
+    Yields:
+        dict: Stage name -> total seconds, filled as the spans finish.
+    """
+    previous = getattr(_local, "spans", None)
+    _local.spans = spans = {}
+    try:
+        yield spans
+    finally:
+        _local.spans = previous
@@ -0,0 +1,131 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+VECTORS_FILE = "vectors.npy"
+VOCAB_FILE = "vocab.txt"
+
+class WordEmbeddings:
+    """
+    Word vectors stored as a float32 matrix, opened as a read-only memory map, plus a
+    vocabulary mapping each word to its row.
+
+    Opening only reads the vocabulary; vector pages are read from disk when a word is
+    looked up, so resident memory grows with the words actually used, and processes
+    opening the same directory share the pages through the OS page cache.
+
+    Supports `word in embeddings` and `embeddings[word]`, like gensim's KeyedVectors.
+    """
+
+    def __init__(self, vectors, words):
+        self.vectors = vectors
+        self.words = words
+        self.index = {word: i for i, word in enumerate(words)}
+
+    @classmethod
+    def load(cls, directory):
+        """Open embeddings written by convert_embeddings."""
+        vectors = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode="r")
+        with open(os.path.join(directory, VOCAB_FILE), encoding="utf-8") as f:
+            words = f.read().split("\n")[:-1]
+        if len(words) != len(vectors):
+            raise ValueError(f"{directory} has {len(words)} words but {len(vectors)} vectors")
+        return cls(vectors, words)
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word):
+        return word in self.index
+
+    def __getitem__(self, word):
+        return np.array(self.vectors[self.index[word]])
+
+    def vectors_for(self, words):
+        """
+        Return the vectors of words as one (len(words), dim) float32 array.
+
+        Rows are gathered in index order, so each page of the memory map is read at most once.
+        Raises KeyError for words not in the vocabulary.
+        """
+        indices = np.fromiter((self.index[word] for word in words), dtype=np.int64, count=len(words))
+        order = np.argsort(indices, kind="stable")
+        result = np.empty((len(words), self.dim), dtype=np.float32)
+        result[order] = self.vectors[indices[order]]
+        return result
+
+def _replace(path, write):
+    # Written under a temporary name and renamed, so readers never see a partial file.
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+def _write_embeddings(directory, words, vectors):
+    os.makedirs(directory, exist_ok=True)
+    _replace(os.path.join(directory, VOCAB_FILE),
+             lambda f: f.write("".join(word + "\n" for word in words).encode("utf-8")))
+    # Vectors last: load_embeddings treats a directory without them as not converted.
+    _replace(os.path.join(directory, VECTORS_FILE),
+             lambda f: np.save(f, np.ascontiguousarray(vectors, dtype=np.float32)))
+
+def _read_text_vectors(path):
+    """Parse a GloVe/word2vec text file: one "word v1 v2 ..." line per word (a word2vec header is skipped)."""
+    words = []
+    vectors = None
+    with open(path, encoding="utf-8") as f:
+        count = sum(1 for _ in f)
+        f.seek(0)
+        for line in f:
+            parts = line.rstrip().split(" ")
+            if vectors is None:
+                if len(parts) == 2:  # word2vec header: "<count> <dim>"
+                    count -= 1
+                    continue
+                vectors = np.empty((count, len(parts) - 1), dtype=np.float32)
+            vectors[len(words)] = parts[1:]
+            words.append(parts[0])
+    return words, vectors
+
+def convert_embeddings(source, output_dir):
+    """
+    One-time conversion of word vectors into the memory-mappable format of WordEmbeddings.
+
+    :param source: A GloVe or word2vec text file, or the name of a gensim-data model
+                   (e.g. "glove-wiki-gigaword-100"), which is downloaded on first use.
+    :param output_dir: Directory to write vectors.npy and vocab.txt to.
+    :return: The converted WordEmbeddings.
+    """
+    start = time.perf_counter()
+    if os.path.isfile(source):
+        words, vectors = _read_text_vectors(source)
+    else:
+        from gensim.downloader import load  # only needed to convert
+        keyed_vectors = load(source)
+        words, vectors = keyed_vectors.index_to_key, keyed_vectors.vectors
+    _write_embeddings(output_dir, words, vectors)
+    print(f"Converted {len(words)} word vectors from {source} to {output_dir} "
+          f"in {time.perf_counter() - start:.1f}s")
+    return WordEmbeddings.load(output_dir)
+
+def load_embeddings(directory, source=None):
+    """Open the embeddings in directory, converting them from source first if they are missing."""
+    if not os.path.exists(os.path.join(directory, VECTORS_FILE)):
+        if source is None:
+            raise FileNotFoundError(f"No converted embeddings in {directory}")
+        return convert_embeddings(source, directory)
+    return WordEmbeddings.load(directory)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert word vectors into a memory-mappable float32 matrix and vocabulary.")
+    parser.add_argument("--source", default="glove-wiki-gigaword-100",
+                        help="GloVe/word2vec text file or gensim-data model name (default: glove-wiki-gigaword-100).")
+    parser.add_argument("--output_dir", required=True, help="Directory to write vectors.npy and vocab.txt to.")
+    args = parser.parse_args()
+    convert_embeddings(args.source, args.output_dir)